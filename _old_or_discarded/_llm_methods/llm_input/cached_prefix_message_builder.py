@@ -0,0 +1,142 @@
+"""
+Sources:
+
+References:
+    https://platform.openai.com/docs/guides/prompt-caching
+    https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+    https://help.aliyun.com/zh/model-studio/context-cache
+
+Synopsis:
+    对 prompt-prefix-caching 友好的 message-list 构建方法。
+
+Notes:
+    provider 的自动前缀缓存要求每次请求的前缀完全一致(字节级别)。
+    标注等任务中，system-prompt、schema、few-shot 对所有请求都相同，只有最后的 human-message 不同。
+
+    这里的约定:
+        - 前缀只构建一次，之后每次请求复用同一组 message 对象，保证字节稳定。
+        - schema 使用 sort_keys 序列化，避免 dict 顺序变化导致前缀变化。
+        - 可选在前缀最后一条 message 上标记 cache_control ，用于需要显式指定缓存断点的 provider 。
+        - 从 response 中读取命中缓存的 token 数，用于统计。
+"""
+
+from __future__ import annotations
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+import json
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+    from pydantic import BaseModel
+
+
+class CachedPrefixMessageBuilder:
+    """
+    构建 [system-message, few-shot..., human-message] 形式的 message-list ，前缀部分固定不变。
+
+    主要方法:
+        - build_messages: 在固定前缀后添加当前数据的 human-message 。
+        - get_cache_usage: 从 response 中读取命中缓存和未命中缓存的 prompt-token 数。
+    """
+    def __init__(
+        self,
+        system_prompt: str,
+        schema_pydantic_base_model: type[BaseModel] | None = None,
+        few_shot_examples: list[tuple[str, str]] | None = None,
+        use_cache_control: bool = False,
+    ):
+        """
+        Args:
+            system_prompt (str): 已经完成 format 的 system-prompt 。
+            schema_pydantic_base_model (type[BaseModel], optional): 需要放入 system-message 的输出 schema 。
+            few_shot_examples (list[tuple[str, str]], optional): (human, ai) 形式的示例。
+            use_cache_control (bool): 是否在前缀最后一条 message 上标记 cache_control 。
+                仅对支持显式缓存断点的 provider 有效，例如 Anthropic 和 DashScope 的显式缓存。
+        """
+        self._prefix_messages = self._build_prefix_messages(
+            system_prompt=system_prompt,
+            schema_pydantic_base_model=schema_pydantic_base_model,
+            few_shot_examples=few_shot_examples or [],
+            use_cache_control=use_cache_control,
+        )
+
+    @property
+    def prefix_messages(self) -> list[BaseMessage]:
+        return list(self._prefix_messages)
+
+    # ====主要方法。====
+    def build_messages(
+        self,
+        data: str,
+    ) -> list[BaseMessage]:
+        """
+        在固定前缀后添加当前数据。
+
+        Args:
+            data (str): 当前请求的数据。
+
+        Returns:
+            list[BaseMessage]: 可以直接 invoke 的 message-list 。
+        """
+        return [*self._prefix_messages, HumanMessage(content=data)]
+
+    # ====主要方法。====
+    @staticmethod
+    def get_cache_usage(
+        response: AIMessage,
+    ) -> dict[str, int]:
+        """
+        从 response 中读取 prompt-token 的缓存情况。
+
+        优先使用 langchain 统一的 usage_metadata ，否则读取 OpenAI 兼容接口的 prompt_tokens_details 。
+
+        Args:
+            response (AIMessage): LLM 的原始输出。
+
+        Returns:
+            dict[str, int]: {'cached_tokens': ..., 'uncached_tokens': ...} 。无法读取时均为 0 。
+        """
+        usage_metadata = response.usage_metadata or {}
+        if usage_metadata:
+            input_tokens = usage_metadata.get('input_tokens', 0)
+            cached_tokens = (usage_metadata.get('input_token_details') or {}).get('cache_read', 0)
+        else:
+            token_usage = response.response_metadata.get('token_usage') or {}
+            input_tokens = token_usage.get('prompt_tokens', 0)
+            cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+        return {
+            'cached_tokens': cached_tokens,
+            'uncached_tokens': input_tokens - cached_tokens,
+        }
+
+    # ====基础方法。====
+    @staticmethod
+    def _build_prefix_messages(
+        system_prompt: str,
+        schema_pydantic_base_model: type[BaseModel] | None,
+        few_shot_examples: list[tuple[str, str]],
+        use_cache_control: bool,
+    ) -> list[BaseMessage]:
+        system_content = system_prompt
+        if schema_pydantic_base_model is not None:
+            schema_str = json.dumps(
+                schema_pydantic_base_model.model_json_schema(),
+                ensure_ascii=False,
+                sort_keys=True,
+            )
+            system_content = f"{system_prompt}\n\n```json\n{schema_str}\n```"
+        prefix_messages: list[BaseMessage] = [SystemMessage(content=system_content)]
+        for human_content, ai_content in few_shot_examples:
+            prefix_messages.append(HumanMessage(content=human_content))
+            prefix_messages.append(AIMessage(content=ai_content))
+        if use_cache_control:
+            # 缓存断点标记在前缀的最后一条 message 上，之前的内容全部可以被缓存。
+            last_message = prefix_messages[-1]
+            prefix_messages[-1] = last_message.model_copy(update={'content': [{
+                'type': 'text',
+                'text': last_message.content,
+                'cache_control': {'type': 'ephemeral'},
+            }]})
+        return prefix_messages
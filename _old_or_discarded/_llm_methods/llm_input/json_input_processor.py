@@ -6,11 +6,47 @@
 
 我的工程规范:
     - 结构化参数以 json 格式传递，并且用 markdown-code-cell 显式说明。
+
+实现细节:
+    - 安装了 orjson 时使用 orjson 序列化，否则使用标准库 json 。
+        2种方式的输出一致，均为不转义中文的紧凑格式。紧凑格式同时减少了 prompt 的 token 数。
+        NaN 和 Infinity 不是合法的 json ，2种方式均输出为 null 。
+        注意: 这与早期的 json.dumps 默认输出(带空格的分隔符，输出 NaN)不同，是有意的修改。
+        datetime/date/time 、UUID 、Enum 和 dataclass 在2种方式中使用同一个 default 转换，
+            分别为 isoformat 、字符串、value 和字段的 dict 。其他不支持的类型均抛出 TypeError 。
+    - 数据量很大时(例如数 MB 的 record 列表):
+        - write_in_markdown: 直接写入文件等 stream ，不构建完整的字符串。
+        - split_in_markdown: 按照字节数或 token 数将 record 列表拆分为多个 markdown-code-cell 。
+    - record 列表(表格数据)可以选择更紧凑的编码，避免每一行都重复所有的 key :
+        - columnar: {key: [values]} 形式的 json 。
+        - csv / tsv: 表头加数据行，放在 ```csv 或 ```tsv 中。嵌套的值以 json 字符串表示，缺失的值和 null 均为空。
+        - minified_keys: key 替换为短 key ，并附带对照表 {"keys": {短key: 原key}, "records": [...]} 。
+        使用 compare_encoding_token_counts 比较不同编码的 token 数。
 """
 
 from __future__ import annotations
+from loguru import logger
 
+import csv
+import dataclasses
+import datetime
+import enum
+import io
 import json
+import math
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from typing import TYPE_CHECKING, IO, Literal
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+_MARKDOWN_CODE_CELL_PREFIX = "```json\n"
+_MARKDOWN_CODE_CELL_SUFFIX = "\n```"
 
 
 class JsonInputProcessor:
@@ -20,6 +56,8 @@ class JsonInputProcessor:
     主要方法:
         - put_in_markdown: 主要方法，将结构化数据转换并放入 markdown-code-cell 中。
         - get_json_str_from_python_structured_data: 主要实现方法，和 put_in_markdown 区别仅不包裹 markdown-code-cell 。
+        - write_in_markdown: 与 put_in_markdown 结果一致，但是直接写入 stream 。
+        - split_in_markdown: 将 record 列表拆分为多个不超过预算的 markdown-code-cell 。
     """
 
     # ====主要方法。====
@@ -27,18 +65,29 @@ class JsonInputProcessor:
     def put_in_markdown(
         original_structured_data: dict | list,
         # need_escape: bool = False  # 这个参数几乎被完全放弃了，但仅注释相关代码。
+        encoding: Literal['records', 'columnar', 'csv', 'tsv', 'minified_keys'] = 'records',
     ) -> str:
         """
         主要方法。将结构化数据自动转化为 markdown cell 中的字符串。
 
+        json 为不转义中文的紧凑格式，NaN 和 Infinity 输出为 null 。
+
         Args:
             original_structured_data (Union[dict, list]): 输入的数据。默认为 python 的 dict 或 list 。dict 最好为 record 形式。
             # need_escape (bool): 处理 {} 使得可以应用于 f-string。标准处理不应该使用，因此默认为 false 。
+            encoding (Literal['records', 'columnar', 'csv', 'tsv', 'minified_keys']): 编码方式。
+                默认为 records ，即原样转换为 json 。其他方式仅用于 record 列表 (list[dict]) 。
 
         Returns:
             str: 转换完成的字符串。
+
+        Raises:
+            ValueError: encoding 不是 records 时，输入不是 record 列表，或者 encoding 不存在。
         """
+        if encoding != 'records':
+            return JsonInputProcessor._put_records_in_markdown(records=original_structured_data, encoding=encoding)
         # 转换为字符串。
+        # 先 decode 再拼接比先在 bytes 上拼接再 decode 更快: 开头的 ascii 会使 utf-8 解码离开快速路径。
         json_str = JsonInputProcessor.get_json_str_from_python_structured_data(original_structured_data)
         # 放进markdown中。
         result = JsonInputProcessor.wrap_in_markdown_code_cell(json_str)
@@ -48,6 +97,129 @@ class JsonInputProcessor:
         #     result = JsonInputProcessor._escape_braces(result)
         return result
 
+    # ====主要方法。====
+    @staticmethod
+    def write_in_markdown(
+        original_structured_data: dict | list,
+        stream: IO[bytes],
+    ) -> None:
+        """
+        将结构化数据放入 markdown-code-cell ，直接写入二进制 stream 。
+
+        与 put_in_markdown 的结果一致，但是不构建完整的 str 。
+        标准库 json 的情况下使用 iterencode 分块写入。
+
+        Args:
+            original_structured_data (Union[dict, list]): 输入的数据。
+            stream (IO[bytes]): 以二进制方式打开的文件或 BytesIO 。
+        """
+        stream.write(_MARKDOWN_CODE_CELL_PREFIX.encode('utf-8'))
+        json_bytes = JsonInputProcessor._dumps_to_bytes(original_structured_data)
+        if json_bytes is not None:
+            stream.write(json_bytes)
+        else:
+            # 分块写入时无法在出错后重新开始，因此先替换 NaN 和 Infinity 。
+            encoder = json.JSONEncoder(
+                ensure_ascii=False,
+                separators=(',', ':'),
+                allow_nan=False,
+                default=JsonInputProcessor._to_json_compatible,
+            )
+            for chunk in encoder.iterencode(JsonInputProcessor._replace_non_finite_floats(original_structured_data)):
+                stream.write(chunk.encode('utf-8'))
+        stream.write(_MARKDOWN_CODE_CELL_SUFFIX.encode('utf-8'))
+
+    # ====主要方法。====
+    @staticmethod
+    def split_in_markdown(
+        records: list,
+        max_bytes: int | None = None,
+        max_tokens: int | None = None,
+        token_counter: Callable[[str], int] | None = None,
+    ) -> list[str]:
+        """
+        将 record 列表按顺序拆分为多个 markdown-code-cell ，每个不超过指定的字节数或 token 数。
+
+        每条 record 只序列化一次。单条 record 超过预算时单独成为一块，并记录警告。
+
+        Args:
+            records (list): record 列表。
+            max_bytes (int, optional): 每块的最大 utf-8 字节数，包括 markdown-code-cell 。
+            max_tokens (int, optional): 每块的最大 token 数，各条 record 的 token 数之和加上格式的近似值。
+            token_counter (Callable[[str], int], optional): 计算 token 数的方法。
+                默认使用 token_budget_prompt_assembler 中的 count_tokens 。
+
+        Returns:
+            list[str]: 每块为一个 markdown-code-cell 中的 json 列表。
+        """
+        if max_bytes is None and max_tokens is None:
+            return [JsonInputProcessor.put_in_markdown(records)]
+        if max_tokens is not None and token_counter is None:
+            from _old_or_discarded._llm_methods.llm_input.token_budget_prompt_assembler import count_tokens
+            token_counter = count_tokens
+        # markdown-code-cell 和 [] 的固定开销。
+        overhead_bytes = len((_MARKDOWN_CODE_CELL_PREFIX + _MARKDOWN_CODE_CELL_SUFFIX).encode('utf-8')) + 2
+        overhead_tokens = 8
+        chunks: list[list[bytes]] = []
+        current_chunk: list[bytes] = []
+        current_bytes = overhead_bytes
+        current_tokens = overhead_tokens
+        for record in records:
+            record_bytes = JsonInputProcessor._dumps_to_bytes(record)
+            if record_bytes is None:
+                record_bytes = JsonInputProcessor.get_json_str_from_python_structured_data(record).encode('utf-8')
+            # 逗号分隔。
+            record_size = len(record_bytes) + 1
+            record_tokens = token_counter(record_bytes.decode('utf-8')) + 1 if max_tokens is not None else 0
+            is_over_budget = (
+                (max_bytes is not None and current_bytes + record_size > max_bytes)
+                or (max_tokens is not None and current_tokens + record_tokens > max_tokens)
+            )
+            if current_chunk and is_over_budget:
+                chunks.append(current_chunk)
+                current_chunk = []
+                current_bytes = overhead_bytes
+                current_tokens = overhead_tokens
+            if not current_chunk and (
+                (max_bytes is not None and overhead_bytes + record_size > max_bytes)
+                or (max_tokens is not None and overhead_tokens + record_tokens > max_tokens)
+            ):
+                logger.warning("single record exceeds the budget, put it in its own code cell.")
+            current_chunk.append(record_bytes)
+            current_bytes += record_size
+            current_tokens += record_tokens
+        if current_chunk:
+            chunks.append(current_chunk)
+        return [
+            JsonInputProcessor.wrap_in_markdown_code_cell(f"[{b','.join(chunk).decode('utf-8')}]")
+            for chunk in chunks
+        ]
+
+    # ====主要方法。====
+    @staticmethod
+    def compare_encoding_token_counts(
+        records: list[dict],
+        token_counter: Callable[[str], int] | None = None,
+    ) -> dict[str, int]:
+        """
+        比较 record 列表在不同编码下的 token 数。
+
+        Args:
+            records (list[dict]): record 列表。
+            token_counter (Callable[[str], int], optional): 计算 token 数的方法。
+                默认使用 token_budget_prompt_assembler 中的 count_tokens 。
+
+        Returns:
+            dict[str, int]: 编码方式到 token 数的映射。包括 markdown-code-cell 。
+        """
+        if token_counter is None:
+            from _old_or_discarded._llm_methods.llm_input.token_budget_prompt_assembler import count_tokens
+            token_counter = count_tokens
+        return {
+            encoding: token_counter(JsonInputProcessor.put_in_markdown(records, encoding=encoding))
+            for encoding in ('records', 'columnar', 'csv', 'tsv', 'minified_keys')
+        }
+
     # ====基础方法之一。====
     @staticmethod
     def get_json_str_from_python_structured_data(
@@ -64,12 +236,32 @@ class JsonInputProcessor:
         Returns:
             str: 已经转换为 json 格式的字符串。
         """
-        return json.dumps(original_structured_data, ensure_ascii=False)  # 由于中文的原因，需要指定ensure_ascii避免转换。
+        json_bytes = JsonInputProcessor._dumps_to_bytes(original_structured_data)
+        if json_bytes is not None:
+            return json_bytes.decode('utf-8')
+        # 由于中文的原因，需要指定ensure_ascii避免转换。separators与orjson的输出保持一致。
+        try:
+            return json.dumps(
+                original_structured_data,
+                ensure_ascii=False,
+                separators=(',', ':'),
+                allow_nan=False,
+                default=JsonInputProcessor._to_json_compatible,
+            )
+        except ValueError:
+            # 与 orjson 保持一致，NaN 和 Infinity 输出为 null 。
+            return json.dumps(
+                JsonInputProcessor._replace_non_finite_floats(original_structured_data),
+                ensure_ascii=False,
+                separators=(',', ':'),
+                default=JsonInputProcessor._to_json_compatible,
+            )
 
     # ==== 基础方法之一。 ====
     @staticmethod
     def wrap_in_markdown_code_cell(
-        json_str: str
+        json_str: str,
+        language: str = 'json',
     ) -> str:
         """
         将已经转换好的 json 数据放入 markdown 的代码块中。
@@ -80,11 +272,130 @@ class JsonInputProcessor:
 
         Args:
             json_str (str): 已经转换为字符串的json数据。
+            language (str): markdown-code-cell 的语言标记。默认为 json 。
 
         Returns:
             str: 字符串的结构化输入，包裹在 markdown-code-cell 中。
         """
-        return f"```json\n{json_str}\n```"
+        if language != 'json':
+            return f"```{language}\n{json_str}{_MARKDOWN_CODE_CELL_SUFFIX}"
+        return f"{_MARKDOWN_CODE_CELL_PREFIX}{json_str}{_MARKDOWN_CODE_CELL_SUFFIX}"
+
+    # ==== 基础方法之一。 ====
+    @staticmethod
+    def _put_records_in_markdown(
+        records: list[dict],
+        encoding: Literal['columnar', 'csv', 'tsv', 'minified_keys'],
+    ) -> str:
+        """
+        使用紧凑的编码转换 record 列表。
+
+        所有 record 的 key 按照首次出现的顺序合并为列，缺失的值为 null (csv/tsv 中缺失的值和 null 均为空)。
+        """
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError(f"encoding {encoding!r} requires a list of dict (records).")
+        if encoding not in ('columnar', 'csv', 'tsv', 'minified_keys'):
+            raise ValueError(f"unknown encoding: {encoding}")
+        columns = list(dict.fromkeys(key for record in records for key in record))
+        if encoding == 'columnar':
+            columnar_data = {column: [record.get(column) for record in records] for column in columns}
+            return JsonInputProcessor.put_in_markdown(columnar_data)
+        if encoding == 'minified_keys':
+            short_keys = {column: JsonInputProcessor._get_short_key(index) for index, column in enumerate(columns)}
+            minified_data = {
+                'keys': {short_key: column for column, short_key in short_keys.items()},
+                'records': [{short_keys[key]: value for key, value in record.items()} for record in records],
+            }
+            return JsonInputProcessor.put_in_markdown(minified_data)
+        # csv / tsv 。
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=',' if encoding == 'csv' else '\t', lineterminator='\n')
+        writer.writerow(columns)
+        for record in records:
+            writer.writerow([JsonInputProcessor._get_cell_str(record.get(column)) for column in columns])
+        return JsonInputProcessor.wrap_in_markdown_code_cell(buffer.getvalue().rstrip('\n'), language=encoding)
+
+    # ==== 基础方法之一。 ====
+    @staticmethod
+    def _get_cell_str(
+        value,
+    ) -> str:
+        """csv/tsv 中的单元格。字符串原样保留，None 为空，其他值使用 json 表示。"""
+        if isinstance(value, str):
+            return value
+        if value is None:
+            return ''
+        return JsonInputProcessor.get_json_str_from_python_structured_data(value)
+
+    # ==== 基础方法之一。 ====
+    @staticmethod
+    def _get_short_key(
+        index: int,
+    ) -> str:
+        """0 -> a, 25 -> z, 26 -> aa 。"""
+        short_key = ''
+        index += 1
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            short_key = chr(ord('a') + remainder) + short_key
+        return short_key
+
+    # ==== 基础方法之一。 ====
+    @staticmethod
+    def _dumps_to_bytes(
+        original_structured_data: dict | list,
+    ) -> bytes | None:
+        """
+        使用 orjson 序列化为 utf-8 的 bytes 。
+
+        Returns:
+            Optional[bytes]:
+                - bytes: 序列化结果。
+                - None: 没有安装 orjson ，或 orjson 不支持的数据(例如超过64位的整数)，需要使用标准库 json 。
+        """
+        if orjson is None:
+            return None
+        try:
+            # datetime 和 dataclass 不使用 orjson 自身的转换，与标准库 json 使用同一个 default 。
+            return orjson.dumps(
+                original_structured_data,
+                default=JsonInputProcessor._to_json_compatible,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except orjson.JSONEncodeError:
+            return None
+
+    # ==== 基础方法之一。 ====
+    @staticmethod
+    def _to_json_compatible(
+        value,
+    ):
+        """orjson 和标准库 json 共用的 default 。两种方式对同一个输入的结果一致。"""
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        if isinstance(value, enum.Enum):
+            return value.value
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    # ==== 基础方法之一。 ====
+    @staticmethod
+    def _replace_non_finite_floats(
+        value,
+    ):
+        """递归地将 NaN 和 Infinity 替换为 None ，仅在使用标准库 json 时调用。"""
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            value = JsonInputProcessor._to_json_compatible(value)
+        if isinstance(value, float):
+            return value if math.isfinite(value) else None
+        if isinstance(value, dict):
+            return {key: JsonInputProcessor._replace_non_finite_floats(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [JsonInputProcessor._replace_non_finite_floats(item) for item in value]
+        return value
 
     # ====已弃用。使用jinja2、PromptTemplate、一次性完成所有的format，不会遇到这种情况。====
     @staticmethod
@@ -102,3 +413,30 @@ class JsonInputProcessor:
         string = string.replace("{", "{{").replace("}", "}}")
         return string
 
+
+if __name__ == '__main__':
+    import timeit
+
+    # 大量中文文本的 record 列表，约数 MB 。
+    records = [
+        {'id': i, '标题': f'第{i}条新闻', '正文': '这是一段用于测试序列化性能的中文文本。' * 20, '标签': ['经济', '科技']}
+        for i in range(20000)
+    ]
+    number = 5
+    original_time = timeit.timeit(
+        lambda: f"```json\n{json.dumps(records, ensure_ascii=False)}\n```",
+        number=number,
+    )
+    new_time = timeit.timeit(lambda: JsonInputProcessor.put_in_markdown(records), number=number)
+    write_time = timeit.timeit(lambda: JsonInputProcessor.write_in_markdown(records, io.BytesIO()), number=number)
+    print(f"payload: {len(JsonInputProcessor.put_in_markdown(records).encode('utf-8')) / 1e6:.1f} MB")
+    print(f"json.dumps + f-string: {original_time / number * 1000:.1f} ms")
+    print(f"put_in_markdown: {new_time / number * 1000:.1f} ms (orjson: {orjson is not None})")
+    print(f"write_in_markdown: {write_time / number * 1000:.1f} ms")
+
+    # 表格数据在不同编码下的 token 数。以字符数近似，安装 tiktoken 并可以下载 encoding 时可以替换为 count_tokens 。
+    tabular_records = [
+        {'公司': f'公司{i}', '年份': 2020 + i % 5, '营业收入': 1000.5 + i, '净利润': 100.25 + i, '行业': '制造业'}
+        for i in range(200)
+    ]
+    print(JsonInputProcessor.compare_encoding_token_counts(tabular_records, token_counter=len))
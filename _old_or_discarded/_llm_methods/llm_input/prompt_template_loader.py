@@ -20,10 +20,16 @@
             - 强制要求input_variables，但是签名和from_template中不一样。不清楚这样设计的原因。
             - 无法指定utf-8编码，中文文件会出现问题。
         因此，message_prompt_template为我使用pathlib修改的方法。不使用from_template_file，而是封装了from_template。
+    - 缓存:
+        所有j2加载方法通过PromptTemplateRegistry缓存构建好的prompt-template，文件修改后自动重新加载。
+        返回的对象在调用方之间共享，不要修改其属性。
 """
 
 from __future__ import annotations
 
+from _old_or_discarded._llm_methods.llm_input.prompt_template_registry import PromptTemplateRegistry
+from _old_or_discarded._llm_methods.llm_input.safe_format_message_prompt_template import CompiledMessagePromptTemplates
+from langchain_core.messages import convert_to_openai_messages
 from langchain_core.prompts import PromptTemplate
 from langchain_core.prompts import (
     ChatPromptTemplate,
@@ -32,10 +38,16 @@ from langchain_core.prompts import (
     HumanMessagePromptTemplate,
     AIMessagePromptTemplate,
 )
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import itertools
+import json
 from pathlib import Path
 
 from typing import TYPE_CHECKING, Annotated, Literal
 if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+    from langchain_core.messages import BaseMessage
     from langchain_core.prompts.chat import BaseMessagePromptTemplate
 
 
@@ -49,6 +61,7 @@ class PromptTemplateLoader:
         - load_prompt_template_from_j2: 最基础的加载prompt-template的方法，可以处理所有的字符串文本。
         - load_message_prompt_template_from_j2: 最常用的加载message-prompt-template的方法，用于构建message-list。
         - load_chat_prompt_template_from_j2: 预构建部分llm-chain，自带system-prompt。
+        - render_many: 对大量数据批量渲染同一组message-prompt-template。
     """
 
     # ====主要方法。====
@@ -65,10 +78,13 @@ class PromptTemplateLoader:
         Returns:
             PromptTemplate: 可以进行langchain中相关操作的prompt-template。
         """
-        prompt_template = PromptTemplate.from_file(
-            template_file=prompt_template_path,
-            template_format='jinja2',  # 需要指定，否则解析方式为f-string。
-            encoding='utf-8',  # 需要指定，否则解码中文有问题。
+        prompt_template = PromptTemplateRegistry.get_or_compile(
+            template_path=prompt_template_path,
+            template_kind='prompt',
+            compile_template=lambda template: PromptTemplate.from_template(
+                template=template,
+                template_format='jinja2',  # 需要指定，否则解析方式为f-string。
+            ),
         )
         return prompt_template
 
@@ -125,15 +141,19 @@ class PromptTemplateLoader:
         Returns:
             ChatPromptTemplate: 可使用invoke传递chat-history的chat-prompt-template。
         """
-        system_message_prompt_template = PromptTemplateLoader.load_system_message_prompt_template_from_j2(
-            system_message_prompt_template_path=system_message_prompt_template_path,
-        )
-        chat_prompt_template = ChatPromptTemplate.from_messages(
-            messages=[
-                system_message_prompt_template,
-                MessagesPlaceholder(message_place_holder_key),
-            ],
-            template_format='jinja2',
+        chat_prompt_template = PromptTemplateRegistry.get_or_compile(
+            template_path=system_message_prompt_template_path,
+            template_kind=f'chat:{message_place_holder_key}',
+            compile_template=lambda template: ChatPromptTemplate.from_messages(
+                messages=[
+                    SystemMessagePromptTemplate.from_template(
+                        template=template,
+                        template_format='jinja2',
+                    ),
+                    MessagesPlaceholder(message_place_holder_key),
+                ],
+                template_format='jinja2',
+            ),
         )
         return chat_prompt_template
 
@@ -175,15 +195,63 @@ class PromptTemplateLoader:
         )
         return chat_prompt_template
 
+    # ====主要方法。====
+    @staticmethod
+    def render_many(
+        message_prompt_templates: list[BaseMessagePromptTemplate | BaseMessage] | CompiledMessagePromptTemplates,
+        records: Iterable[dict],
+        output_format: Literal['messages', 'jsonl'] = 'messages',
+        model: str | None = None,
+        custom_id_key: str | None = None,
+        num_workers: int = 0,
+        chunk_size: int = 256,
+    ) -> Iterator[list[BaseMessage] | str]:
+        """
+        使用同一组message-prompt-template渲染大量数据。
+
+        实现:
+            - 使用CompiledMessagePromptTemplates预编译，每条数据直接渲染。缺少变量时抛出KeyError。
+            - 惰性读取records，按chunk_size分块处理，输出顺序与输入一致。
+            - num_workers > 0 时使用进程池，同时最多有 2 * num_workers 个块在处理中，内存不随数据量增长。
+                进程池适合较重的模板，轻量模板的进程间通信开销可能大于渲染本身。
+
+        Args:
+            message_prompt_templates (Union[list, CompiledMessagePromptTemplates]): 需要渲染的message-prompt-template。
+            records (Iterable[dict]): 每条数据为一次format的kwargs。
+            output_format (Literal['messages', 'jsonl']): 输出的格式。
+                - messages: list[BaseMessage]。
+                - jsonl: 可以直接用于batch接口的请求行，不包括换行符。
+            model (str, optional): output_format为jsonl时请求体中的模型名，此时必须指定。
+            custom_id_key (str, optional): output_format为jsonl时，custom_id使用record中的这个字段。默认使用序号。
+            num_workers (int): 进程数。为0时在当前进程中渲染。
+            chunk_size (int): 每块的数据量。
+
+        Returns:
+            Iterator[Union[list[BaseMessage], str]]: 每条数据的渲染结果。参数在调用时检查，渲染在迭代时进行。
+        """
+        if output_format == 'jsonl' and not model:
+            raise ValueError("model must be given when output_format is 'jsonl'.")
+        if not isinstance(message_prompt_templates, CompiledMessagePromptTemplates):
+            message_prompt_templates = CompiledMessagePromptTemplates(message_prompt_templates)
+        return _iter_rendered(
+            message_prompt_templates=message_prompt_templates,
+            render_options=(output_format, model, custom_id_key),
+            chunks=_iter_chunks(records=records, chunk_size=chunk_size),
+            num_workers=num_workers,
+        )
+
     # ====常用方法。====
     @staticmethod
     def load_system_message_prompt_template_from_j2(
         system_message_prompt_template_path: Annotated[str | Path, 'message-prompt-template所在的路径'],
     ) -> SystemMessagePromptTemplate:
-        template = Path(system_message_prompt_template_path).read_text(encoding='utf-8')
-        system_message_prompt_template = SystemMessagePromptTemplate.from_template(
-            template=template,
-            template_format='jinja2',
+        system_message_prompt_template = PromptTemplateRegistry.get_or_compile(
+            template_path=system_message_prompt_template_path,
+            template_kind='system',
+            compile_template=lambda template: SystemMessagePromptTemplate.from_template(
+                template=template,
+                template_format='jinja2',
+            ),
         )
         return system_message_prompt_template
 
@@ -192,10 +260,13 @@ class PromptTemplateLoader:
     def load_human_message_prompt_template_from_j2(
         human_message_prompt_template_path: Annotated[str | Path, 'message-prompt-template所在的路径'],
     ) -> HumanMessagePromptTemplate:
-        template = Path(human_message_prompt_template_path).read_text(encoding='utf-8')
-        human_message_prompt_template = HumanMessagePromptTemplate.from_template(
-            template=template,
-            template_format='jinja2',
+        human_message_prompt_template = PromptTemplateRegistry.get_or_compile(
+            template_path=human_message_prompt_template_path,
+            template_kind='human',
+            compile_template=lambda template: HumanMessagePromptTemplate.from_template(
+                template=template,
+                template_format='jinja2',
+            ),
         )
         return human_message_prompt_template
 
@@ -204,10 +275,13 @@ class PromptTemplateLoader:
     def load_ai_message_prompt_template_from_j2(
         ai_message_prompt_template_path: Annotated[str | Path, 'message-prompt-template所在的路径'],
     ) -> AIMessagePromptTemplate:
-        template = Path(ai_message_prompt_template_path).read_text(encoding='utf-8')
-        ai_message_prompt_template = AIMessagePromptTemplate.from_template(
-            template=template,
-            template_format='jinja2',
+        ai_message_prompt_template = PromptTemplateRegistry.get_or_compile(
+            template_path=ai_message_prompt_template_path,
+            template_kind='ai',
+            compile_template=lambda template: AIMessagePromptTemplate.from_template(
+                template=template,
+                template_format='jinja2',
+            ),
         )
         return ai_message_prompt_template
 
@@ -241,3 +315,84 @@ class PromptTemplateLoader:
         text = file_path.read_text(encoding='utf-8')
         return text
 
+
+# ====render_many使用的方法。进程池需要模块级别的函数。====
+_worker_state: dict = {}
+
+
+def _iter_rendered(
+    message_prompt_templates: CompiledMessagePromptTemplates,
+    render_options: tuple[str, str | None, str | None],
+    chunks: Iterator[tuple[int, list[dict]]],
+    num_workers: int,
+) -> Iterator[list[BaseMessage] | str]:
+    if num_workers <= 0:
+        for start_index, chunk in chunks:
+            yield from _render_chunk(message_prompt_templates, render_options, start_index, chunk)
+        return
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_render_worker,
+        initargs=(message_prompt_templates, render_options),
+    ) as executor:
+        futures = deque()
+        for start_index, chunk in chunks:
+            futures.append(executor.submit(_render_chunk_in_worker, start_index, chunk))
+            if len(futures) >= 2 * num_workers:
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
+
+
+def _iter_chunks(
+    records: Iterable[dict],
+    chunk_size: int,
+) -> Iterator[tuple[int, list[dict]]]:
+    iterator = iter(records)
+    start_index = 0
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield start_index, chunk
+        start_index += len(chunk)
+
+
+def _render_chunk(
+    message_prompt_templates: CompiledMessagePromptTemplates,
+    render_options: tuple[str, str | None, str | None],
+    start_index: int,
+    chunk: list[dict],
+) -> list[list[BaseMessage] | str]:
+    output_format, model, custom_id_key = render_options
+    results = []
+    for index, record in enumerate(chunk, start=start_index):
+        messages = message_prompt_templates.format(record)
+        if output_format == 'messages':
+            results.append(messages)
+            continue
+        request_line = {
+            'custom_id': str(record[custom_id_key]) if custom_id_key else str(index),
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {'model': model, 'messages': convert_to_openai_messages(messages)},
+        }
+        results.append(json.dumps(request_line, ensure_ascii=False))
+    return results
+
+
+def _init_render_worker(
+    message_prompt_templates: CompiledMessagePromptTemplates,
+    render_options: tuple[str, str | None, str | None],
+) -> None:
+    _worker_state['message_prompt_templates'] = message_prompt_templates
+    _worker_state['render_options'] = render_options
+
+
+def _render_chunk_in_worker(
+    start_index: int,
+    chunk: list[dict],
+) -> list[list[BaseMessage] | str]:
+    return _render_chunk(
+        _worker_state['message_prompt_templates'],
+        _worker_state['render_options'],
+        start_index,
+        chunk,
+    )
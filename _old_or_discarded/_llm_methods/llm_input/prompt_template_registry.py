@@ -0,0 +1,110 @@
+"""
+进程内共享的prompt-template缓存。
+
+PromptTemplateLoader 的加载方法在每次调用时都会读取 .j2 文件并重新构建 prompt-template 。
+在服务中每个请求都会调用，因此这里对构建好的 prompt-template 进行缓存。
+
+约定:
+    - key 为 (文件的绝对路径, prompt-template 的类型)。
+    - 使用文件的 (mtime_ns, size) 判断文件是否修改。修改后在下一次获取时重新构建，即热加载。
+    - 为了避免每次都 stat ，可以设置 stat_interval ，在间隔内直接使用缓存。默认每次都检查。
+    - 缓存的 prompt-template 会被所有调用方共享，不应该修改其属性。partial 等方法会返回新对象，不受影响。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import threading
+import time
+
+from typing import TYPE_CHECKING, Any
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+@dataclass
+class _RegistryEntry:
+    signature: tuple[int, int]
+    template: Any
+    checked_at: float
+
+
+class PromptTemplateRegistry:
+    """
+    进程内共享的缓存。所有方法均为 classmethod 。
+
+    主要方法:
+        - get_or_compile: 获取缓存的 prompt-template ，没有或文件已修改时构建。
+        - get_stats: 命中情况的统计。
+        - clear: 清空缓存和统计。
+    """
+
+    # 是否启用缓存。关闭后每次都读取文件并构建。
+    enabled: bool = True
+    # 两次 stat 检查的最小间隔，单位为秒。
+    stat_interval: float = 0.
+
+    _entries: dict[tuple[str, str], _RegistryEntry] = {}
+    _stats: dict[str, int] = {'hits': 0, 'misses': 0, 'reloads': 0}
+    _lock = threading.Lock()
+
+    # ====主要方法。====
+    @classmethod
+    def get_or_compile(
+        cls,
+        template_path: str | Path,
+        template_kind: str,
+        compile_template: Callable[[str], Any],
+    ) -> Any:
+        """
+        获取缓存的 prompt-template 。
+
+        Args:
+            template_path (Union[str, Path]): .j2 文件的路径。
+            template_kind (str): prompt-template 的类型。同一个文件可以构建为不同类型的 prompt-template 。
+            compile_template (Callable[[str], Any]): 由文件内容构建 prompt-template 的方法。
+
+        Returns:
+            Any: 构建好的 prompt-template 。
+        """
+        if not cls.enabled:
+            return compile_template(Path(template_path).read_text(encoding='utf-8'))
+        key = (os.path.abspath(template_path), template_kind)
+        now = time.monotonic()
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and now - entry.checked_at < cls.stat_interval:
+                cls._stats['hits'] += 1
+                return entry.template
+        stat_result = os.stat(key[0])
+        signature = (stat_result.st_mtime_ns, stat_result.st_size)
+        with cls._lock:
+            if entry is not None and entry.signature == signature:
+                entry.checked_at = now
+                cls._stats['hits'] += 1
+                return entry.template
+        # 没有缓存或者文件已修改。构建过程不加锁，并发时可能重复构建，但结果一致。
+        template = compile_template(Path(key[0]).read_text(encoding='utf-8'))
+        with cls._lock:
+            cls._stats['misses' if entry is None else 'reloads'] += 1
+            cls._entries[key] = _RegistryEntry(signature=signature, template=template, checked_at=now)
+        return template
+
+    # ====主要方法。====
+    @classmethod
+    def get_stats(cls) -> dict[str, int]:
+        """
+        Returns:
+            dict[str, int]: hits, misses, reloads 和当前缓存的数量 size 。
+        """
+        with cls._lock:
+            return {**cls._stats, 'size': len(cls._entries)}
+
+    # ====主要方法。====
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
+            cls._stats.update(hits=0, misses=0, reloads=0)
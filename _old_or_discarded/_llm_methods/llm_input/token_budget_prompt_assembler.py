@@ -0,0 +1,304 @@
+"""
+Sources:
+
+References:
+    https://github.com/openai/tiktoken
+
+Synopsis:
+    在 token 预算内组装 chat-prompt 。
+
+Notes:
+    PromptTemplateLoader.load_chat_prompt_template_from_j2 构建的是 system + MessagesPlaceholder('chat_history') ，
+    但是没有控制 chat_history 的长度，长对话会使延迟和费用持续增长。
+
+    这里的约定:
+        - 保留最新的消息，超出预算时从最早的消息开始丢弃。
+        - 带有 tool_calls 的 AIMessage 与其后对应的 ToolMessage 作为一个整体保留或丢弃，不会被拆开。
+        - 固定部分(format 后除 chat_history 以外的消息)超出预算时抛出 ValueError 。
+        - 可选对丢弃的消息进行总结，总结作为一条消息放在保留的消息之前。
+            丢弃的消息只增不减，总结是增量的: 使用上一次的总结和新丢弃的消息生成新的总结。
+            总结本身超出预算时不使用总结并记录警告，保证结果在预算内。
+        - tool_calls 也计入 AIMessage 的 token 数。
+        - 每条消息的 token 数会缓存，重新组装时只计算新消息。
+        - token 计数默认使用 tiktoken ，encoding 只加载一次。不同模型的 tokenizer 有差异，预算需要留有余量。
+"""
+
+from __future__ import annotations
+from loguru import logger
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from collections import OrderedDict
+import functools
+import json
+import tiktoken
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from langchain_core.messages import BaseMessage
+    from langchain_core.prompts import ChatPromptTemplate
+
+
+@functools.lru_cache(maxsize=None)
+def get_tiktoken_encoding(
+    encoding_name: str = 'o200k_base',
+) -> tiktoken.Encoding:
+    """
+    获取 tiktoken 的 encoding 。进程内只加载一次。
+
+    Args:
+        encoding_name (str): encoding 的名称。
+
+    Returns:
+        tiktoken.Encoding: 可以 encode 和 decode 的 encoding 。
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(
+    text: str,
+    encoding_name: str = 'o200k_base',
+) -> int:
+    """使用 tiktoken 计算文本的 token 数。"""
+    return len(get_tiktoken_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+class TokenBudgetPromptAssembler:
+    """
+    在 token 预算内组装 chat-prompt 。
+
+    主要方法:
+        - assemble: format chat-prompt-template ，chat_history 按照预算截断或总结。
+        - count_message_tokens: 计算一条消息的 token 数，带缓存。
+    """
+    def __init__(
+        self,
+        chat_prompt_template: ChatPromptTemplate,
+        max_prompt_tokens: int,
+        message_place_holder_key: str = 'chat_history',
+        token_counter: Callable[[str], int] | None = None,
+        summarize_messages: Callable[[list[BaseMessage]], BaseMessage] | None = None,
+        tokens_per_message: int = 4,
+        cache_size: int = 4096,
+    ):
+        """
+        Args:
+            chat_prompt_template (ChatPromptTemplate): 包含 MessagesPlaceholder 的 chat-prompt-template 。
+            max_prompt_tokens (int): 组装后整个 prompt 的 token 预算。
+            message_place_holder_key (str): MessagesPlaceholder 的 key 。默认为'chat_history'。
+            token_counter (Callable[[str], int], optional): 计算文本 token 数的方法。默认使用 tiktoken 的 o200k_base 。
+            summarize_messages (Callable[[list[BaseMessage]], BaseMessage], optional): 总结被丢弃的消息的方法。
+                不指定时直接丢弃。
+            tokens_per_message (int): 每条消息在 chat 格式中额外占用的 token 数。
+            cache_size (int): 缓存的消息 token 数的最大数量。
+        """
+        self._chat_prompt_template = chat_prompt_template
+        self._max_prompt_tokens = max_prompt_tokens
+        self._message_place_holder_key = message_place_holder_key
+        self._token_counter = token_counter or count_tokens
+        self._summarize_messages = summarize_messages
+        self._tokens_per_message = tokens_per_message
+        self._cache_size = cache_size
+        self._token_count_cache: OrderedDict[tuple[str, str], int] = OrderedDict()
+        # (被总结的消息的 key , 总结)。
+        self._summary_cache: tuple[list[tuple[str, str]], BaseMessage] | None = None
+
+    # ====主要方法。====
+    def assemble(
+        self,
+        format_kwargs: dict,
+    ) -> list[BaseMessage]:
+        """
+        format chat-prompt-template ，使结果在 token 预算内。
+
+        Args:
+            format_kwargs (dict): format 的 kwargs ，需要包括 message_place_holder_key 对应的消息列表。
+
+        Returns:
+            list[BaseMessage]: 组装好的消息列表。
+
+        Raises:
+            ValueError: 固定部分已经超出预算。
+        """
+        chat_history: list[BaseMessage] = format_kwargs[self._message_place_holder_key]
+        fixed_messages = self._chat_prompt_template.invoke(
+            input={**format_kwargs, self._message_place_holder_key: []},
+        ).to_messages()
+        fixed_tokens = self._count_messages_tokens(fixed_messages)
+        if fixed_tokens > self._max_prompt_tokens:
+            raise ValueError(
+                f"fixed messages use {fixed_tokens} tokens, exceeding max_prompt_tokens {self._max_prompt_tokens}."
+            )
+        history_budget = self._max_prompt_tokens - fixed_tokens
+        kept_messages = self._select_recent_messages(messages=chat_history, budget=history_budget)
+        dropped_messages = chat_history[:len(chat_history) - len(kept_messages)]
+        if dropped_messages:
+            logger.info(
+                f"chat_history exceeds budget: keep {len(kept_messages)} messages, "
+                f"drop {len(dropped_messages)} messages, history budget {history_budget} tokens."
+            )
+            if self._summarize_messages is not None:
+                kept_messages = self._summarize_dropped_messages(
+                    chat_history=chat_history,
+                    kept_messages=kept_messages,
+                    history_budget=history_budget,
+                )
+        return self._chat_prompt_template.invoke(
+            input={**format_kwargs, self._message_place_holder_key: kept_messages},
+        ).to_messages()
+
+    # ====主要方法。====
+    def count_message_tokens(
+        self,
+        message: BaseMessage,
+    ) -> int:
+        """
+        计算一条消息的 token 数。以 (类型, 内容) 为 key 缓存。
+
+        Args:
+            message (BaseMessage): 消息。
+
+        Returns:
+            int: token 数，包括 tokens_per_message 。
+        """
+        key = self._get_message_key(message)
+        token_count = self._token_count_cache.get(key)
+        if token_count is not None:
+            self._token_count_cache.move_to_end(key)
+            return token_count
+        token_count = self._token_counter(key[1]) + self._tokens_per_message
+        self._token_count_cache[key] = token_count
+        if len(self._token_count_cache) > self._cache_size:
+            self._token_count_cache.popitem(last=False)
+        return token_count
+
+    # ====基础方法。====
+    def _summarize_dropped_messages(
+        self,
+        chat_history: list[BaseMessage],
+        kept_messages: list[BaseMessage],
+        history_budget: int,
+    ) -> list[BaseMessage]:
+        """
+        总结被丢弃的消息，返回总结加上保留的消息。
+
+        总结本身超出 history_budget 时不使用总结，返回总结之前保留的消息。
+        """
+        truncated_messages = kept_messages
+        dropped_messages = chat_history[:len(chat_history) - len(kept_messages)]
+        # 上一次总结过的消息不再放回，避免每次组装都重新总结。
+        num_summarized = self._get_num_summarized(chat_history)
+        if num_summarized > len(dropped_messages):
+            dropped_messages = chat_history[:num_summarized]
+            kept_messages = chat_history[num_summarized:]
+        # 总结也需要在预算内。为总结腾出空间而丢弃的消息同样需要被总结，直到保留的消息不再变化。
+        while True:
+            summary_message = self._get_summary(dropped_messages=dropped_messages)
+            summary_tokens = self.count_message_tokens(summary_message)
+            if summary_tokens > history_budget:
+                logger.warning(
+                    f"summary uses {summary_tokens} tokens, exceeding history budget {history_budget} tokens. "
+                    f"summary is not used."
+                )
+                return truncated_messages
+            recent_messages = self._select_recent_messages(
+                messages=kept_messages,
+                budget=history_budget - summary_tokens,
+            )
+            if len(recent_messages) == len(kept_messages):
+                return [summary_message, *kept_messages]
+            dropped_messages = chat_history[:len(chat_history) - len(recent_messages)]
+            kept_messages = recent_messages
+
+    # ====基础方法。====
+    def _count_messages_tokens(
+        self,
+        messages: list[BaseMessage],
+    ) -> int:
+        return sum(self.count_message_tokens(message) for message in messages)
+
+    # ====基础方法。====
+    def _select_recent_messages(
+        self,
+        messages: list[BaseMessage],
+        budget: int,
+    ) -> list[BaseMessage]:
+        """从最新的消息开始保留，直到超出预算。tool_calls 和对应的 ToolMessage 一起保留或丢弃。"""
+        used_tokens = 0
+        num_kept = 0
+        for message_group in reversed(self._group_messages(messages)):
+            used_tokens += self._count_messages_tokens(message_group)
+            if used_tokens > budget:
+                break
+            num_kept += len(message_group)
+        return messages[len(messages) - num_kept:]
+
+    # ====基础方法。====
+    @staticmethod
+    def _group_messages(
+        messages: list[BaseMessage],
+    ) -> list[list[BaseMessage]]:
+        """带有 tool_calls 的 AIMessage 和其后的 ToolMessage 为一组，其他消息各自为一组。"""
+        message_groups: list[list[BaseMessage]] = []
+        for message in messages:
+            if (
+                isinstance(message, ToolMessage)
+                and message_groups
+                and isinstance(message_groups[-1][0], AIMessage)
+                and message_groups[-1][0].tool_calls
+            ):
+                message_groups[-1].append(message)
+                continue
+            message_groups.append([message])
+        return message_groups
+
+    # ====基础方法。====
+    def _get_summary(
+        self,
+        dropped_messages: list[BaseMessage],
+    ) -> BaseMessage:
+        """增量总结。被丢弃的消息是上一次的延续时，只总结上一次的总结和新丢弃的消息。"""
+        dropped_keys = [self._get_message_key(message) for message in dropped_messages]
+        if self._summary_cache is not None:
+            summarized_keys, summary_message = self._summary_cache
+            if dropped_keys == summarized_keys:
+                return summary_message
+            if dropped_keys[:len(summarized_keys)] == summarized_keys:
+                new_messages = dropped_messages[len(summarized_keys):]
+                logger.info(f"update summary with {len(new_messages)} newly dropped messages.")
+                summary_message = self._summarize_messages([summary_message, *new_messages])
+                self._summary_cache = (dropped_keys, summary_message)
+                return summary_message
+        logger.info(f"summarize {len(dropped_messages)} dropped messages.")
+        summary_message = self._summarize_messages(dropped_messages)
+        self._summary_cache = (dropped_keys, summary_message)
+        return summary_message
+
+    # ====基础方法。====
+    def _get_num_summarized(
+        self,
+        chat_history: list[BaseMessage],
+    ) -> int:
+        """上一次的总结覆盖 chat_history 开头的消息时，返回覆盖的消息数，否则返回 0 。"""
+        if self._summary_cache is None:
+            return 0
+        summarized_keys = self._summary_cache[0]
+        if len(summarized_keys) > len(chat_history):
+            return 0
+        if [self._get_message_key(message) for message in chat_history[:len(summarized_keys)]] != summarized_keys:
+            return 0
+        return len(summarized_keys)
+
+    # ====基础方法。====
+    @staticmethod
+    def _get_message_key(
+        message: BaseMessage,
+    ) -> tuple[str, str]:
+        if isinstance(message.content, str):
+            text = message.content
+        else:
+            text = json.dumps(message.content, ensure_ascii=False, sort_keys=True)
+        if isinstance(message, AIMessage) and message.tool_calls:
+            text += json.dumps(message.tool_calls, ensure_ascii=False, sort_keys=True)
+        return message.type, text
@@ -0,0 +1,268 @@
+"""
+Sources:
+
+References:
+    https://platform.openai.com/docs/guides/batch
+    https://help.aliyun.com/zh/model-studio/batch-interfaces-compatible-with-openai
+
+Synopsis:
+    使用 OpenAI 兼容的 batch 接口进行数据标注。
+
+Notes:
+    batch 接口是异步的，一般在 24h 内完成，但是价格更低。适合大量、离线的标注任务。
+
+    流程为:
+        - 将所有请求序列化为 batch 输入的 .jsonl 文件，保存在 batch_dir 中。
+        - 上传文件，创建 batch 任务，轮询直到任务结束。
+        - 下载结果文件，使用已有的结构化数据提取工具解析。
+        - 仅对失败的请求重新构建 batch 提交，最多 max_rounds 轮。
+        - 每轮结束后删除 provider 上的输入和输出文件，避免占用文件配额。本地的副本保留在 batch_dir 中。
+
+    2种解析方式，与已有的 labeler 对应:
+        - YuLabeler: 从 markdown-code-cell 中提取 json ，使用 StructuredDataExtractor 。默认方式。
+        - SimpleLabeler: 使用 response_format 指定 json-schema ，直接由 pydantic 加载。
+"""
+
+from __future__ import annotations
+from loguru import logger
+
+# 解析和验证结构化数据的工具。可以是我自构建的，需要在具体项目指定具体路径。
+from _old_or_discarded._llm_methods.llm_output.structured_data_extractor import StructuredDataExtractor
+from langchain_core.messages import convert_to_openai_messages
+from openai import AsyncOpenAI
+
+import asyncio
+import json
+from pathlib import Path
+
+from typing import TYPE_CHECKING, Literal
+if TYPE_CHECKING:
+    from langchain_core.messages import SystemMessage
+    from openai.types import Batch
+    from pydantic import BaseModel
+
+
+class BatchLabeler:
+    """
+    基于 batch 接口的标注器。
+
+    主要方法:
+        - batch_label_datas: 标注所有数据，返回与输入顺序一致的结果。
+        - build_batch_request_line: 构建 batch 输入文件中的一行。
+    """
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        schema_pydantic_base_model: type[BaseModel],
+        system_message: SystemMessage,
+        batch_dir: str | Path,
+        max_rounds: int = 3,
+        poll_interval: float = 30.,
+        output_mode: Literal['markdown_json', 'response_format'] = 'markdown_json',
+        delete_remote_files: bool = True,
+        client: AsyncOpenAI | None = None,
+    ):
+        """
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。
+            api_key (str): api_key 。
+            model (str): 模型名。
+            schema_pydantic_base_model (type[BaseModel]): pydantic定义的数据类。
+            system_message (SystemMessage): 标注任务的 system-message 。
+            batch_dir (Union[str, Path]): 保存 batch 输入和输出文件的文件夹。便于检查和复现。
+            max_rounds (int): 最多提交的 batch 轮数。第一轮之后的每一轮仅包含失败的请求。
+            poll_interval (float): 轮询 batch 状态的间隔，单位为秒。
+            output_mode (Literal['markdown_json', 'response_format']): 解析方式。
+                - markdown_json: 与 YuLabeler 一致。
+                - response_format: 与 SimpleLabeler 一致，需要服务端支持 json_schema 。
+            delete_remote_files (bool): 每轮结束后是否删除 provider 上的输入和输出文件。
+            client (AsyncOpenAI, optional): 可以传入已经构建好的 client 。主要用于测试。
+        """
+        self._client = client or AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+        )
+        self._model = model
+        self._schema_pydantic_base_model = schema_pydantic_base_model
+        self._system_message = system_message
+        self._batch_dir = Path(batch_dir)
+        self._max_rounds = max_rounds
+        self._poll_interval = poll_interval
+        self._output_mode = output_mode
+        self._delete_remote_files = delete_remote_files
+
+    # ====暴露方法。====
+    async def batch_label_datas(
+        self,
+        datas: list[str],
+    ) -> list[BaseModel | None]:
+        """
+        使用 batch 接口标注所有数据。
+
+        Args:
+            datas (list[str]): 需要标注的数据。
+
+        Returns:
+            list[Optional[BaseModel]]: 与输入顺序一致的结果。经过 max_rounds 轮依然失败的为 None 。
+        """
+        results: list[BaseModel | None] = [None] * len(datas)
+        # custom_id 使用数据的索引，重新提交时保持不变。
+        pending_datas = {str(index): data for index, data in enumerate(datas)}
+        for round_index in range(self._max_rounds):
+            if not pending_datas:
+                break
+            logger.info(f"batch round {round_index}: {len(pending_datas)} requests")
+            contents = await self._run_batch_round(
+                pending_datas=pending_datas,
+                round_index=round_index,
+            )
+            for custom_id, content in contents.items():
+                structured_data = self._extract_structured_data(content=content)
+                if structured_data:
+                    results[int(custom_id)] = structured_data
+                    pending_datas.pop(custom_id)
+        if pending_datas:
+            logger.warning(f"{len(pending_datas)} requests failed after {self._max_rounds} rounds.")
+        return results
+
+    # ====主要方法。====
+    def build_batch_request_line(
+        self,
+        custom_id: str,
+        data: str,
+    ) -> dict:
+        """
+        构建 batch 输入文件中的一行。
+
+        Args:
+            custom_id (str): 请求的唯一标识，结果文件中原样返回。
+            data (str): 需要标注的数据。
+
+        Returns:
+            dict: 符合 batch 接口定义的请求。
+        """
+        body = {
+            'model': self._model,
+            'messages': [
+                *convert_to_openai_messages([self._system_message]),
+                {'role': 'user', 'content': data},
+            ],
+        }
+        if self._output_mode == 'response_format':
+            body['response_format'] = {
+                'type': 'json_schema',
+                'json_schema': {
+                    'name': self._schema_pydantic_base_model.__name__,
+                    'schema': self._schema_pydantic_base_model.model_json_schema(),
+                },
+            }
+        return {
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': body,
+        }
+
+    # ====基础方法。====
+    async def _run_batch_round(
+        self,
+        pending_datas: dict[str, str],
+        round_index: int,
+    ) -> dict[str, str]:
+        """
+        提交一轮 batch ，返回成功请求的 custom_id 到模型输出文本的映射。
+        """
+        # 序列化请求。
+        self._batch_dir.mkdir(parents=True, exist_ok=True)
+        input_path = self._batch_dir / f'round_{round_index}_input.jsonl'
+        with input_path.open('w', encoding='utf-8') as input_file:
+            for custom_id, data in pending_datas.items():
+                request_line = self.build_batch_request_line(custom_id=custom_id, data=data)
+                input_file.write(json.dumps(request_line, ensure_ascii=False) + '\n')
+        # 上传文件，创建 batch 任务。
+        input_file_object = await self._client.files.create(
+            file=input_path,
+            purpose='batch',
+        )
+        remote_file_ids = [input_file_object.id]
+        try:
+            batch = await self._client.batches.create(
+                input_file_id=input_file_object.id,
+                endpoint='/v1/chat/completions',
+                completion_window='24h',
+            )
+            batch = await self._wait_for_batch(batch_id=batch.id)
+            remote_file_ids += [file_id for file_id in (batch.output_file_id, batch.error_file_id) if file_id]
+            if batch.status != 'completed' or not batch.output_file_id:
+                logger.error(f"batch {batch.id} ended with status: {batch.status}")
+                return {}
+            # 下载结果。
+            output = await self._client.files.content(batch.output_file_id)
+            output_path = self._batch_dir / f'round_{round_index}_output.jsonl'
+            output_path.write_text(output.text, encoding='utf-8')
+            return self._parse_batch_output(output_text=output.text)
+        finally:
+            if self._delete_remote_files:
+                await self._delete_files(file_ids=remote_file_ids)
+
+    # ====基础方法。====
+    async def _delete_files(
+        self,
+        file_ids: list[str],
+    ) -> None:
+        """删除 provider 上的文件。删除失败不影响标注结果，只记录警告。"""
+        for file_id in file_ids:
+            try:
+                await self._client.files.delete(file_id)
+            except Exception as e:
+                logger.warning(f"failed to delete file {file_id}: {e}")
+
+    # ====基础方法。====
+    async def _wait_for_batch(
+        self,
+        batch_id: str,
+    ) -> Batch:
+        while True:
+            batch = await self._client.batches.retrieve(batch_id)
+            if batch.status in ('completed', 'failed', 'expired', 'cancelled'):
+                return batch
+            logger.trace(f"batch {batch_id} status: {batch.status}")
+            await asyncio.sleep(self._poll_interval)
+
+    # ====基础方法。====
+    @staticmethod
+    def _parse_batch_output(
+        output_text: str,
+    ) -> dict[str, str]:
+        contents = {}
+        for line in output_text.splitlines():
+            if not line.strip():
+                continue
+            output_line = json.loads(line)
+            response = output_line.get('response') or {}
+            if output_line.get('error') or response.get('status_code') != 200:
+                logger.warning(f"request {output_line['custom_id']} failed: {output_line.get('error')}")
+                continue
+            contents[output_line['custom_id']] = response['body']['choices'][0]['message']['content']
+        return contents
+
+    # ====基础方法。====
+    def _extract_structured_data(
+        self,
+        content: str,
+    ) -> BaseModel | None:
+        if self._output_mode == 'response_format':
+            try:
+                return self._schema_pydantic_base_model.model_validate_json(content)
+            except Exception as e:
+                logger.warning(f"未通过schema检验: {e}\n{content}")
+                return None
+        return StructuredDataExtractor.extract_structured_data_from_str(
+            raw_str=content,
+            schema_pydantic_base_model=self._schema_pydantic_base_model,
+            index_to_choose=-1,
+            json_loader_name='json-repair',
+            schema_check_type='dict',
+        )
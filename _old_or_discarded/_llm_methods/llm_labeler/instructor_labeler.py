@@ -1,13 +1,205 @@
 """
 基于instructor构建的labeler。
+
+必要的依赖:
+    - instructor
+    - openai
+    - httpx: 使用 http2 需要额外安装 h2 。
+
+实现:
+    - 使用 instructor 包装 AsyncOpenAI ，由 instructor 完成结构化输出的解析、检验和重试。
+    - 同一个 event-loop 中的所有实例共享一个 httpx.AsyncClient ，复用连接池和 keep-alive 连接。安装了 h2 时使用 http2 。
+    - 每个实例使用 semaphore 限制并发数。
+    - 解析、检验失败和请求失败(包括 openai 重试之后的连接错误、5xx)都返回 None ，不中断 batch 。
+
+注意:
+    - httpx.AsyncClient 和 asyncio.Semaphore 会绑定第一次使用时的 event-loop 。
+        因此共享的 http-client 以 event-loop 为 key 保存在类属性的 WeakKeyDictionary 中，
+        每个 event-loop (例如每次 asyncio.run)使用各自的 http-client 。semaphore 在实例第一次请求时构建。
+    - 共享的 http-client 在 event-loop 结束前使用 InstructorLabeler.aclose_shared 关闭。
+        实例的 aclose 只解除绑定，不关闭共享的 http-client 。传入的 http_client 由调用方关闭。
 """
 
 from __future__ import annotations
+from loguru import logger
+
+import asyncio
+import httpx
+import importlib.util
+import weakref
+from instructor import Mode, from_openai
+from instructor.core import InstructorRetryException
+from langchain_core.messages import convert_to_openai_messages
+from openai import APIError, AsyncOpenAI
 
 from typing import TYPE_CHECKING
-# if TYPE_CHECKING:
+if TYPE_CHECKING:
+    from instructor import AsyncInstructor
+    from langchain_core.messages import SystemMessage
+    from pydantic import BaseModel
 
 
 class InstructorLabeler:
-    ...
+    """
+    基于 instructor 的标注器。
+
+    与 SimpleLabeler 和 YuLabeler 的接口一致，直接使用 OpenAI 兼容接口而不是 langchain 的 BaseChatModel 。
+    """
+
+    # 每个 event-loop 共享的 http-client 。event-loop 被回收后自动移除。
+    _shared_http_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = (
+        weakref.WeakKeyDictionary()
+    )
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        schema_pydantic_base_model: type[BaseModel],
+        system_message: SystemMessage,
+        max_retries: int = 3,
+        max_concurrency: int = 16,
+        mode: Mode = Mode.TOOLS,
+        http_client: httpx.AsyncClient | None = None,
+    ):
+        """
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。
+            api_key (str): api_key 。
+            model (str): 模型名。
+            schema_pydantic_base_model (type[BaseModel]): pydantic定义的数据类。
+            system_message (SystemMessage): 标注任务的 system-message 。
+            max_retries (int): instructor 在解析或检验失败时的重试次数。
+            max_concurrency (int): 该实例同时进行的最大请求数。
+            mode (Mode): instructor 的结构化输出方式。不支持 tools 的服务可以使用 Mode.JSON 或 Mode.MD_JSON 。
+            http_client (httpx.AsyncClient, optional): 指定的 http-client ，由调用方管理。
+                默认使用当前 event-loop 中所有实例共享的 http-client ，由 aclose_shared 关闭。
+        """
+        self._base_url = base_url
+        self._api_key = api_key
+        self._model = model
+        self._schema_pydantic_base_model = schema_pydantic_base_model
+        self._system_message = system_message
+        self._max_retries = max_retries
+        self._max_concurrency = max_concurrency
+        self._mode = mode
+        self._external_http_client = http_client
+        # 以下在第一次请求时，在当前的 event-loop 中构建。
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._http_client: httpx.AsyncClient | None = None
+        self._client: AsyncInstructor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    # ====暴露方法。====
+    async def batch_label_datas(
+        self,
+        datas: list[str],
+    ) -> list[BaseModel | None]:
+        tasks = [self.label_data(data=data) for data in datas]
+        return await asyncio.gather(*tasks)
+
+    # ====主要方法。====
+    async def label_data(
+        self,
+        data: str,
+    ) -> BaseModel | None:
+        self._bind_to_running_loop()
+        async with self._semaphore:
+            try:
+                structured_data = await self._client.chat.completions.create(
+                    model=self._model,
+                    response_model=self._schema_pydantic_base_model,
+                    messages=[
+                        *convert_to_openai_messages([self._system_message]),
+                        {'role': 'user', 'content': data},
+                    ],
+                    max_retries=self._max_retries,
+                )
+            except InstructorRetryException as e:
+                logger.warning(f"label failed after {e.n_attempts} attempts: {e}")
+                return None
+            except APIError as e:
+                # openai 已经按照 max_retries 重试了连接错误、429 和 5xx 。
+                logger.warning(f"label request failed: {e!r}")
+                return None
+        return structured_data
+
+    # ====主要方法。====
+    async def aclose(self) -> None:
+        """解除与 event-loop 的绑定。共享的 http-client 由 aclose_shared 关闭。"""
+        self._loop = None
+        self._http_client = None
+        self._client = None
+        self._semaphore = None
+
+    # ====主要方法。====
+    @classmethod
+    async def aclose_shared(cls) -> None:
+        """关闭当前 event-loop 中共享的 http-client 。"""
+        http_client = cls._shared_http_clients.pop(asyncio.get_running_loop(), None)
+        if http_client is not None:
+            await http_client.aclose()
+
+    # ==== 工具方法。 ====
+    @classmethod
+    def get_shared_http_client(cls) -> httpx.AsyncClient:
+        """获取当前 event-loop 中共享的 http-client 。没有或者已经关闭时构建。"""
+        loop = asyncio.get_running_loop()
+        http_client = cls._shared_http_clients.get(loop)
+        if http_client is None or http_client.is_closed:
+            http_client = cls.build_http_client()
+            cls._shared_http_clients[loop] = http_client
+        return http_client
+
+    # ==== 工具方法。 ====
+    @staticmethod
+    def build_http_client(
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> httpx.AsyncClient:
+        """
+        构建默认的 http-client 。
+
+        Args:
+            max_connections (int): 连接池的最大连接数。
+            max_keepalive_connections (int): 保持 keep-alive 的最大连接数。
+            transport (httpx.AsyncBaseTransport, optional): 指定的 transport 。主要用于测试。
+
+        Returns:
+            httpx.AsyncClient: 新的 http-client 。
+        """
+        return httpx.AsyncClient(
+            # http2 需要 h2 ，没有安装时使用 http1.1 。
+            http2=importlib.util.find_spec('h2') is not None,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(timeout=600., connect=10.),
+            transport=transport,
+        )
 
+    # ====基础方法。====
+    def _bind_to_running_loop(self) -> None:
+        """绑定当前 event-loop 共享的 http-client ，构建 client 和 semaphore 。event-loop 没有改变时不做任何事。"""
+        loop = asyncio.get_running_loop()
+        if loop is self._loop and (self._http_client is None or not self._http_client.is_closed):
+            return
+        self._loop = loop
+        self._http_client = self._external_http_client or InstructorLabeler.get_shared_http_client()
+        self._client = from_openai(
+            AsyncOpenAI(
+                base_url=self._base_url,
+                api_key=self._api_key,
+                http_client=self._http_client,
+            ),
+            mode=self._mode,
+        )
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
@@ -0,0 +1,189 @@
+"""
+Sources:
+
+References:
+
+Synopsis:
+    可断点续跑的流式标注流程。
+
+Notes:
+    YuLabeler.batch_label_datas 需要一次性传入全部数据，并在最后一次性返回所有结果。
+    对于数万条数据的标注任务，中途崩溃会丢失全部结果。
+
+    这里的流程为:
+        - 惰性读取输入。支持 .jsonl 和 .parquet 。
+        - 以有上限的并发调用 labeler 。同一时间只有 max_concurrency 个任务在内存中。
+        - 每完成一条就追加写入输出的 .jsonl 文件。
+        - 重新运行时，跳过输出文件中已经存在的 id 。
+
+    约定:
+        - labeler 需要有 `async label_data(data: str) -> BaseModel | None` 方法。YuLabeler 和 SimpleLabeler 都满足。
+        - 标注失败(None)的数据不写入输出文件，重新运行时会再次标注。
+"""
+
+from __future__ import annotations
+from loguru import logger
+
+import asyncio
+import json
+from pathlib import Path
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from _old_or_discarded._llm_methods.llm_labeler.yu_labeler import YuLabeler
+    from _old_or_discarded._llm_methods.llm_labeler.with_structured_output_llm_labeler import SimpleLabeler
+    from collections.abc import Iterator
+    from pydantic import BaseModel
+
+
+class StreamingLabelPipeline:
+    """
+    流式标注流程。
+
+    主要方法:
+        - run: 运行整个流程，返回统计结果。
+        - iter_records: 惰性读取输入。
+        - load_labeled_ids: 读取输出文件中已经完成的 id 。
+    """
+    def __init__(
+        self,
+        labeler: YuLabeler | SimpleLabeler,
+        input_path: str | Path,
+        output_path: str | Path,
+        id_key: str = 'id',
+        data_key: str = 'data',
+        max_concurrency: int = 16,
+    ):
+        """
+        Args:
+            labeler (Union[YuLabeler, SimpleLabeler]): 具体的标注器。
+            input_path (Union[str, Path]): 输入文件的路径。根据扩展名选择 .jsonl 或 .parquet 。
+            output_path (Union[str, Path]): 输出 .jsonl 文件的路径。每行为 {id_key: ..., 'result': ...} 。
+            id_key (str): 每条记录中唯一标识的字段。
+            data_key (str): 每条记录中需要标注的文本的字段。
+            max_concurrency (int): 同时进行标注的最大数量。
+        """
+        self._labeler = labeler
+        self._input_path = Path(input_path)
+        self._output_path = Path(output_path)
+        self._id_key = id_key
+        self._data_key = data_key
+        self._max_concurrency = max_concurrency
+
+    # ====主要方法。====
+    async def run(self) -> dict:
+        """
+        运行流式标注。
+
+        Returns:
+            dict: 本次运行的统计结果。包括 skipped, succeeded, failed 。
+        """
+        labeled_ids = self.load_labeled_ids()
+        stats = {'skipped': 0, 'succeeded': 0, 'failed': 0}
+        self._output_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._output_path.open('a', encoding='utf-8') as output_file:
+            # 上一次崩溃时最后一行可能不完整，需要先换行，避免和新的结果写在同一行。
+            if not self._is_output_ended_with_newline():
+                output_file.write('\n')
+            pending: set[asyncio.Task] = set()
+            for record in self.iter_records():
+                record_id = record[self._id_key]
+                if str(record_id) in labeled_ids:
+                    stats['skipped'] += 1
+                    continue
+                # 达到并发上限，等待至少一个任务完成，再读取下一条数据。
+                if len(pending) >= self._max_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self._write_done_tasks(done=done, output_file=output_file, stats=stats)
+                pending.add(asyncio.create_task(self._label_record(record_id=record_id, data=record[self._data_key])))
+            # 处理剩余的任务。
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                self._write_done_tasks(done=done, output_file=output_file, stats=stats)
+        logger.info(f"streaming label finished: {stats}")
+        return stats
+
+    # ====主要方法。====
+    def iter_records(self) -> Iterator[dict]:
+        """
+        惰性读取输入文件中的记录。
+
+        - .jsonl: 逐行读取。
+        - .parquet: 逐 batch 读取。需要安装 pyarrow 。
+
+        Yields:
+            dict: 一条记录。
+        """
+        if self._input_path.suffix == '.parquet':
+            # 仅在需要时导入。
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(self._input_path)
+            for record_batch in parquet_file.iter_batches(columns=[self._id_key, self._data_key]):
+                yield from record_batch.to_pylist()
+        else:
+            with self._input_path.open('r', encoding='utf-8') as input_file:
+                for line in input_file:
+                    if line.strip():
+                        yield json.loads(line)
+
+    # ====主要方法。====
+    def load_labeled_ids(self) -> set[str]:
+        """
+        读取输出文件中已经完成标注的 id 。
+
+        崩溃时最后一行可能只写入了一部分，这样的行会被忽略。
+
+        Returns:
+            set[str]: 已经完成标注的 id 。统一转换为 str 。
+        """
+        labeled_ids = set()
+        if not self._output_path.exists():
+            return labeled_ids
+        with self._output_path.open('r', encoding='utf-8') as output_file:
+            for line in output_file:
+                try:
+                    labeled_ids.add(str(json.loads(line)[self._id_key]))
+                except (json.JSONDecodeError, KeyError):
+                    logger.warning(f"skip broken line in output: {line!r}")
+        return labeled_ids
+
+    # ====基础方法。====
+    def _is_output_ended_with_newline(self) -> bool:
+        if not self._output_path.exists() or self._output_path.stat().st_size == 0:
+            return True
+        with self._output_path.open('rb') as output_file:
+            output_file.seek(-1, 2)
+            return output_file.read(1) == b'\n'
+
+    # ====基础方法。====
+    async def _label_record(
+        self,
+        record_id,
+        data: str,
+    ) -> tuple[object, BaseModel | None]:
+        try:
+            structured_data = await self._labeler.label_data(data=data)
+        except Exception as e:
+            logger.error(f"label failed: {record_id}, {e!r}")
+            structured_data = None
+        return record_id, structured_data
+
+    # ====基础方法。====
+    def _write_done_tasks(
+        self,
+        done: set[asyncio.Task],
+        output_file,
+        stats: dict,
+    ) -> None:
+        for task in done:
+            record_id, structured_data = task.result()
+            if structured_data is None:
+                stats['failed'] += 1
+                continue
+            output_file.write(json.dumps(
+                {self._id_key: record_id, 'result': structured_data.model_dump()},
+                ensure_ascii=False,
+            ) + '\n')
+            stats['succeeded'] += 1
+        # 每批完成后立即落盘，崩溃时只会丢失正在进行的任务。
+        output_file.flush()
@@ -4,6 +4,7 @@
 
 from __future__ import annotations
 
+from _old_or_discarded._llm_methods.llm_input.cached_prefix_message_builder import CachedPrefixMessageBuilder
 from langchain_core.messages import HumanMessage
 
 from typing import TYPE_CHECKING, cast
@@ -16,18 +17,26 @@ if TYPE_CHECKING:
 class SimpleLabeler:
     """
     对于本身就具有相关功能的LLM，不需要额外的逻辑。
+
+    指定 message_builder 时，使用固定前缀的 message 布局，并在 prompt_cache_usage 中累计命中缓存的 token 数。
+    此时 system_message 不使用，否则必须指定 system_message 。
     """
     def __init__(
         self,
         llm: BaseChatModel,
         schema_pydantic_base_model: type[BaseModel],
-        system_message: SystemMessage,
+        system_message: SystemMessage | None = None,
+        message_builder: CachedPrefixMessageBuilder | None = None,
     ):
+        if system_message is None and message_builder is None:
+            raise ValueError("Either system_message or message_builder must be given.")
+        self._message_builder = message_builder
         self._structured_llm = self._get_structured_llm(
             llm=llm,
             schema_pydantic_base_model=schema_pydantic_base_model,
         )
         self._system_message = system_message
+        self.prompt_cache_usage = {'cached_tokens': 0, 'uncached_tokens': 0}
 
     async def label_data(
         self,
@@ -42,11 +51,21 @@ class SimpleLabeler:
         self,
         human_message: HumanMessage,
     ) -> BaseModel:
-        response = await self._structured_llm.ainvoke(input=[
-            self._system_message,
-            human_message,
-        ])
-        return response
+        if self._message_builder is None:
+            response = await self._structured_llm.ainvoke(input=[
+                self._system_message,
+                human_message,
+            ])
+            return response
+        # include_raw=True ，需要从原始输出中读取 usage 。
+        response = await self._structured_llm.ainvoke(input=self._message_builder.build_messages(
+            data=human_message.content,
+        ))
+        for key, value in CachedPrefixMessageBuilder.get_cache_usage(response=response['raw']).items():
+            self.prompt_cache_usage[key] += value
+        if response['parsing_error'] is not None:
+            raise response['parsing_error']
+        return response['parsed']
 
     def _get_structured_llm(
         self,
@@ -55,6 +74,7 @@ class SimpleLabeler:
     ) -> BaseChatModel:
         structured_llm = llm.with_structured_output(
             schema=schema_pydantic_base_model,
+            include_raw=self._message_builder is not None,
         )
         structured_llm = cast('BaseChatModel', structured_llm)
         return structured_llm
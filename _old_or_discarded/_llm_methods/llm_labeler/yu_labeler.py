@@ -6,15 +6,21 @@
 
 需要使用的其他我构建的工具:
     - JsonOutputExtractor
+    - JsonInputProcessor: 仅 pack_label_datas 使用。
+    - CachedPrefixMessageBuilder: 可选，对 prompt-prefix-caching 友好的 message 布局。
 
 暂时的实现:
     - 仅基于文本任务。
 """
 
 from __future__ import annotations
+from loguru import logger
 import asyncio
 
 # 解析和验证结构化数据的工具。可以是我自构建的，需要在具体项目指定具体路径。
+from _old_or_discarded._llm_methods.llm_input.cached_prefix_message_builder import CachedPrefixMessageBuilder
+from _old_or_discarded._llm_methods.llm_input.json_input_processor import JsonInputProcessor
+from _old_or_discarded._llm_methods.llm_output.json_output_extractor import JsonOutputExtractor
 from _old_or_discarded._llm_methods.llm_output.structured_data_extractor import StructuredDataExtractor
 from langchain_core.messages import HumanMessage
 
@@ -25,6 +31,17 @@ if TYPE_CHECKING:
     from pydantic import BaseModel
 
 
+# pack_label_datas 中标识每条数据的字段。使用保留的名字，避免与 schema 自身的字段冲突。
+PACK_INDEX_KEY = '__pack_index__'
+# pack_label_datas 中附加在数据前的说明。system-message 中的标注要求对每条数据同样适用。
+PACK_INSTRUCTION = (
+    "下面的 json 列表中有 {num_items} 条数据，每条数据以 " + PACK_INDEX_KEY + " 字段标识。\n"
+    "请按照要求对每一条数据分别进行标注。"
+    "最终结果以 json 列表的形式放在 markdown-code-cell 中，"
+    "列表中的每个元素对应一条数据，需要包含该数据的 " + PACK_INDEX_KEY + " 字段以及标注结果的所有字段。\n"
+)
+
+
 class YuLabeler:
     """
     我实现的标注器。
@@ -35,22 +52,78 @@ class YuLabeler:
         self,
         llm: BaseChatModel,
         schema_pydantic_base_model: type[BaseModel],
-        system_message: SystemMessage,
+        system_message: SystemMessage | None = None,
         max_retries: int = 10,
+        message_builder: CachedPrefixMessageBuilder | None = None,
     ):
+        """
+        Args:
+            llm (BaseChatModel): 进行标注的 LLM 。
+            schema_pydantic_base_model (type[BaseModel]): pydantic定义的数据类。
+            system_message (Optional[SystemMessage]): 标注任务的 system-message 。
+                指定 message_builder 时不使用，否则必须指定。
+            max_retries (int): 解析失败时的最大请求次数。
+            message_builder (CachedPrefixMessageBuilder, optional): 指定时使用固定前缀的 message 布局，
+                并在 prompt_cache_usage 中累计命中缓存的 token 数。
+        """
+        if system_message is None and message_builder is None:
+            raise ValueError("Either system_message or message_builder must be given.")
         self._llm = llm
         self._schema_pydantic_base_model = schema_pydantic_base_model
         self._system_message = system_message
         self._max_retries = max_retries
+        self._message_builder = message_builder
+        self.prompt_cache_usage = {'cached_tokens': 0, 'uncached_tokens': 0}
 
     # ====暴露方法。====
     async def batch_label_datas(
         self,
         datas: list[str],
-    ) -> tuple[str]:
+    ) -> list[BaseModel | None]:
         tasks = [self.label_data(data=data) for data in datas]
         return await asyncio.gather(*tasks)
 
+    # ====暴露方法。====
+    async def pack_label_datas(
+        self,
+        datas: list[str],
+        pack_size: int = 8,
+    ) -> list[BaseModel | None]:
+        """
+        将多条数据打包在一次请求中进行标注。
+
+        对于较短的数据，每次请求的 system-prompt 占了大部分的 token 。
+        打包后请求数和 system-prompt 的 token 数都大约减少为 1/pack_size 。
+
+        实现:
+            - 数据以 [{'__pack_index__': ..., 'data': ...}] 的形式使用 JsonInputProcessor.put_in_markdown 放入 human-message 。
+            - 输出约定为 json 列表，也接受 check_list_schema 约定的 {'items': [...]} 形式。
+            - 每个元素单独使用 schema 检验。缺失、重复或未通过检验的数据视为失败。
+            - 仅对失败的数据重新打包请求，最多 max_retries 轮。
+
+        Args:
+            datas (list[str]): 需要标注的数据。
+            pack_size (int): 每次请求中打包的数据数量。
+
+        Returns:
+            list[Optional[BaseModel]]: 与输入顺序一致的结果。经过 max_retries 轮依然失败的为 None 。
+        """
+        results: list[BaseModel | None] = [None] * len(datas)
+        pending_indexes = list(range(len(datas)))
+        for _ in range(self._max_retries):
+            if not pending_indexes:
+                break
+            packs = [pending_indexes[i:i + pack_size] for i in range(0, len(pending_indexes), pack_size)]
+            pack_results = await asyncio.gather(*[
+                self.label_pack(datas=[datas[index] for index in pack])
+                for pack in packs
+            ])
+            for pack, pack_result in zip(packs, pack_results):
+                for index, structured_data in zip(pack, pack_result):
+                    results[index] = structured_data
+            pending_indexes = [index for index in pending_indexes if results[index] is None]
+        return results
+
     # ====主要方法。====
     async def label_data(
         self,
@@ -70,14 +143,77 @@ class YuLabeler:
             if structured_data:
                 return structured_data
 
+    # ====主要方法。====
+    async def label_pack(
+        self,
+        datas: list[str],
+    ) -> list[BaseModel | None]:
+        """
+        一次请求标注一组数据，不进行重试。
+
+        Args:
+            datas (list[str]): 同一次请求中的数据。
+
+        Returns:
+            list[Optional[BaseModel]]: 与输入顺序一致的结果。缺失或未通过 schema 检验的为 None 。
+        """
+        results: list[BaseModel | None] = [None] * len(datas)
+        packed_data = JsonInputProcessor.put_in_markdown(
+            [{PACK_INDEX_KEY: index, 'data': data} for index, data in enumerate(datas)]
+        )
+        response = await self._call_llm(
+            human_message=HumanMessage(content=PACK_INSTRUCTION.format(num_items=len(datas)) + packed_data),
+        )
+        raw_structured_data = JsonOutputExtractor.extract_json_from_str(
+            raw_str=response.content,
+            index_to_choose=-1,
+            json_loader_name='json-repair',
+        )
+        # 兼容 check_list_schema 约定的 items 字段。
+        if isinstance(raw_structured_data, dict):
+            raw_structured_data = raw_structured_data.get('items')
+        if not isinstance(raw_structured_data, list):
+            return results
+        raw_items: dict[int, dict] = {}
+        duplicate_indexes: set[int] = set()
+        for item in raw_structured_data:
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item[PACK_INDEX_KEY])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if not 0 <= index < len(datas):
+                continue
+            if index in raw_items:
+                duplicate_indexes.add(index)
+            raw_items[index] = {key: value for key, value in item.items() if key != PACK_INDEX_KEY}
+        if duplicate_indexes:
+            # 无法判断哪一个结果是正确的，视为失败，由 pack_label_datas 重新请求。
+            logger.warning(f"duplicate {PACK_INDEX_KEY} in packed output: {sorted(duplicate_indexes)}")
+        for index, item in raw_items.items():
+            if index in duplicate_indexes:
+                continue
+            results[index] = StructuredDataExtractor.get_structured_data(
+                raw_structured_data=item,
+                schema_pydantic_base_model=self._schema_pydantic_base_model,
+                schema_check_type='dict',
+            )
+        return results
+
     # ====基础方法。====
     async def _call_llm(
         self,
         human_message: HumanMessage,
     ) -> AIMessage:
-        response = await self._llm.ainvoke(input=[
-            self._system_message,
-            human_message,
-        ])
+        if self._message_builder is None:
+            response = await self._llm.ainvoke(input=[
+                self._system_message,
+                human_message,
+            ])
+            return response
+        response = await self._llm.ainvoke(input=self._message_builder.build_messages(data=human_message.content))
+        for key, value in CachedPrefixMessageBuilder.get_cache_usage(response=response).items():
+            self.prompt_cache_usage[key] += value
         return response
 
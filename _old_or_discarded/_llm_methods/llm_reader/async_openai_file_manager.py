@@ -0,0 +1,273 @@
+"""
+Sources:
+
+References:
+    https://github.com/openai/openai-python#retries
+    https://www.python-httpx.org/advanced/resource-limits/
+
+Synopsis:
+    基于 OpenAI SDK 的异步文件管理方法。
+
+Notes:
+    OpenAIFileManager 的每个方法都会构建新的 client ，批量方法也是串行执行。
+    上传数千个文件用于长文本阅读时，大部分时间花费在建立连接和等待上。
+
+    这里的约定:
+        - 实例持有一个 AsyncOpenAI client ，所有请求共享同一个连接池。
+        - 批量方法使用 semaphore 限制并发数，连接池的大小与并发数一致。
+        - 暂时性错误(连接错误、408、409、429、5xx)由 client 自身的 max_retries 重试，指数退避并遵循 retry-after 。
+        - 批量方法返回与输入顺序一致的结果，重试后依然失败的为 None ，不影响其他文件。
+        - 可选传入 OpenAIFileIndex ，上传前按照文件内容去重，删除时同步删除索引中的记录。
+            索引的读写(包括 sha256 的计算和 SQLite 的查询)均在线程中执行，不阻塞事件循环。
+"""
+
+from __future__ import annotations
+from loguru import logger
+
+from _old_or_discarded._llm_methods.llm_reader.openai_file_manager import is_file_matched
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+
+import asyncio
+from pathlib import Path
+import time
+
+from typing import TYPE_CHECKING, Any, Sequence
+if TYPE_CHECKING:
+    from _old_or_discarded._llm_methods.llm_reader.openai_file_index import OpenAIFileIndex
+    from collections.abc import AsyncIterator, Awaitable, Callable
+
+
+class AsyncOpenAIFileManager:
+    """
+    异步的文件管理器。
+
+    主要方法:
+        - create_file / create_files: 上传文件。
+        - retrieve_file / retrieve_files: 通过 file-id 检索。
+        - list_files: 列出所有文件。
+        - iter_files: 逐页获取并过滤文件。
+        - purge: 并发删除符合条件的文件。
+        - delete_file / delete_files: 删除文件。
+        - reconcile_file_index: 与 provider 上的文件列表对齐去重索引。
+        - aclose: 关闭连接池。也可以使用 async with 。
+    """
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        max_concurrency: int = 16,
+        max_retries: int = 3,
+        timeout: float = 600.,
+        file_index: OpenAIFileIndex | None = None,
+        client: AsyncOpenAI | None = None,
+    ):
+        """
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。
+            api_key (str): api_key 。
+            max_concurrency (int): 批量方法的最大并发数，同时也是连接池的大小。
+            max_retries (int): 暂时性错误的最大重试次数。
+            timeout (float): 单个请求的超时时间，单位为秒。上传大文件时需要足够长。
+            file_index (OpenAIFileIndex, optional): 上传的去重索引。
+            client (AsyncOpenAI, optional): 可以传入已经构建好的 client 。主要用于测试。
+        """
+        self._client = client or AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=max_retries,
+            timeout=timeout,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                ),
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._file_index = file_index
+
+    async def __aenter__(self) -> AsyncOpenAIFileManager:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    # ====主要方法。====
+    async def create_file(
+        self,
+        file_path: str | Path,
+        purpose: str,
+    ) -> dict:
+        if self._file_index is not None:
+            # 在线程中计算 sha256 和查询索引，不阻塞事件循环。
+            sha256 = await asyncio.to_thread(self._file_index.get_file_sha256, file_path)
+            file_object = await asyncio.to_thread(self._file_index.get, sha256=sha256, purpose=purpose)
+            if file_object is not None:
+                logger.info(f"skip upload of {file_path}: already uploaded as {file_object['id']}.")
+                return file_object
+        async with self._semaphore:
+            file_object = await self._client.files.create(
+                file=Path(file_path),
+                purpose=purpose,
+            )
+        file_object = file_object.model_dump()
+        if self._file_index is not None:
+            await asyncio.to_thread(self._file_index.put, sha256=sha256, purpose=purpose, file_object=file_object)
+        return file_object
+
+    # ====主要方法。====
+    async def create_files(
+        self,
+        file_paths: Sequence[str | Path],
+        purpose: str,
+    ) -> list[dict | None]:
+        """
+        并发上传文件。
+
+        Args:
+            file_paths (Sequence[Union[str, Path]]): 文件路径。
+            purpose (str): 文件的用途。例如 'file-extract', 'batch' 。
+
+        Returns:
+            list[Optional[dict]]: 与输入顺序一致的 file-object 。失败的为 None 。
+        """
+        return await self._gather_in_order(
+            items=file_paths,
+            request=lambda file_path: self.create_file(file_path=file_path, purpose=purpose),
+            action='upload',
+        )
+
+    # ====主要方法。====
+    async def retrieve_file(
+        self,
+        file_id: str,
+    ) -> dict:
+        async with self._semaphore:
+            file_object = await self._client.files.retrieve(
+                file_id=file_id,
+            )
+        return file_object.model_dump()
+
+    # ====主要方法。====
+    async def retrieve_files(
+        self,
+        file_ids: Sequence[str],
+    ) -> list[dict | None]:
+        """并发检索文件。返回与输入顺序一致的 file-object ，失败的为 None 。"""
+        return await self._gather_in_order(
+            items=file_ids,
+            request=lambda file_id: self.retrieve_file(file_id=file_id),
+            action='retrieve',
+        )
+
+    # ====主要方法。====
+    async def list_files(self) -> list[dict]:
+        # 利用自动分页迭代器，循环获取。
+        return [file.model_dump() async for file in self._client.files.list()]
+
+    # ====主要方法。====
+    async def iter_files(
+        self,
+        purpose: str | None = None,
+        older_than: float | None = None,
+        filename_prefix: str | None = None,
+        page_size: int = 1000,
+    ) -> AsyncIterator[dict]:
+        """逐页获取文件，边获取边过滤。参数与 OpenAIFileManager.iter_files 相同。"""
+        list_kwargs = {'limit': page_size}
+        if purpose is not None:
+            list_kwargs['purpose'] = purpose
+        created_before = None if older_than is None else time.time() - older_than
+        async for file in self._client.files.list(**list_kwargs):
+            if is_file_matched(
+                file=file,
+                purpose=purpose,
+                created_before=created_before,
+                filename_prefix=filename_prefix,
+            ):
+                yield file.model_dump()
+
+    # ====主要方法。====
+    async def purge(
+        self,
+        purpose: str | None = None,
+        older_than: float | None = None,
+        filename_prefix: str | None = None,
+        dry_run: bool = True,
+    ) -> dict:
+        """
+        并发删除符合条件的文件。参数和返回的报告与 OpenAIFileManager.purge 相同，并发数为实例的 max_concurrency 。
+        """
+        matched_file_ids = []
+        num_bytes = 0
+        async for file_object in self.iter_files(
+            purpose=purpose,
+            older_than=older_than,
+            filename_prefix=filename_prefix,
+        ):
+            matched_file_ids.append(file_object['id'])
+            num_bytes += file_object.get('bytes') or 0
+        logger.info(f"purge: {len(matched_file_ids)} files matched, {num_bytes} bytes, dry_run={dry_run}.")
+        results = [] if dry_run else await self.delete_files(file_ids=matched_file_ids)
+        return {
+            'num_matched': len(matched_file_ids),
+            'num_bytes': num_bytes,
+            'num_deleted': sum(result is not None for result in results),
+            'failed_file_ids': [file_id for file_id, result in zip(matched_file_ids, results) if result is None],
+            'matched_file_ids': matched_file_ids,
+        }
+
+    # ====主要方法。====
+    async def delete_file(
+        self,
+        file_id: str,
+    ) -> dict:
+        async with self._semaphore:
+            file_object = await self._client.files.delete(
+                file_id=file_id,
+            )
+        if self._file_index is not None:
+            await asyncio.to_thread(self._file_index.remove_file_ids, [file_id])
+        return file_object.model_dump()
+
+    # ====主要方法。====
+    async def delete_files(
+        self,
+        file_ids: Sequence[str],
+    ) -> list[dict | None]:
+        """并发删除文件。返回与输入顺序一致的删除结果，失败的为 None 。"""
+        return await self._gather_in_order(
+            items=file_ids,
+            request=lambda file_id: self.delete_file(file_id=file_id),
+            action='delete',
+        )
+
+    # ====主要方法。====
+    async def reconcile_file_index(self) -> int:
+        """与 provider 上的文件列表对齐，删除索引中已经不存在的记录。返回删除的记录数。"""
+        return await asyncio.to_thread(self._file_index.reconcile, await self.list_files())
+
+    # ====主要方法。====
+    async def aclose(self) -> None:
+        await self._client.close()
+
+    # ==== 工具方法。 ====
+    @staticmethod
+    async def _gather_in_order(
+        items: Sequence[Any],
+        request: Callable[[Any], Awaitable[dict]],
+        action: str,
+    ) -> list[dict | None]:
+        """并发执行请求。并发数由各个方法中的 semaphore 限制。单个请求的失败记录日志并返回 None 。"""
+        async def run_one(item: Any) -> dict | None:
+            try:
+                return await request(item)
+            except Exception as e:
+                logger.error(f"failed to {action} {item}: {e!r}")
+                return None
+
+        results = await asyncio.gather(*(run_one(item) for item in items))
+        num_failed = sum(result is None for result in results)
+        logger.info(f"{action} {len(items)} files, {num_failed} failed.")
+        return list(results)
@@ -0,0 +1,299 @@
+"""
+Sources:
+
+References:
+    https://github.com/openai/tiktoken
+    https://python.langchain.com/docs/how_to/summarize_map_reduce/
+
+Synopsis:
+    在本地切分长文本，以 map-reduce 的方式阅读。
+
+Notes:
+    QwenLongReader 依赖 provider 的长文本能力。文件超出长度限制或者费用过高时，使用这里的方法:
+        - split: 按照 token 数切分为有重叠的 chunk 。
+        - map: 对每个 chunk 并发执行 map_instruction 。可以使用任意 OpenAI 兼容接口。
+        - reduce: 每 reduce_fan_in 个部分结果合并为一个，逐层合并直到只剩一个结果。
+    每个请求的长度有上限，因此单个请求的延迟有上限，文本的长度只影响请求数。
+
+    失败的约定:
+        - 暂时性错误(连接错误、408、409、429、5xx)由 client 自身的 max_retries 重试。
+        - 重试后依然失败的 map 请求记录在 failed_chunk_indexes 中，其余 chunk 的结果继续 reduce 。
+            全部 chunk 都失败时抛出 RuntimeError 。reduce 请求的失败直接抛出。
+        - 没有内容的文本抛出 ValueError 。
+
+    切分的约定:
+        - 以段落(空行分隔)为基本单位组合 chunk ，超过 max_chunk_tokens 的段落按照 token 切分。
+        - chunk 的边界由内容决定: 长度达到一半之后，在哈希满足条件的段落后切分。
+            因此修改某个段落只影响附近的 chunk ，之后的边界会重新对齐，而不是全部移动。
+        - 每个 chunk 的开头加上前一个 chunk 结尾的 overlap_tokens 个 token ，避免信息在边界被截断。
+
+    缓存的约定:
+        - 以 (model, instruction, 输入) 的 sha256 为 key ，每个请求的结果保存为 cache_dir 中的一个 json 文件。
+        - map 和 reduce 的请求都会缓存。修改文本后，只有变化的 chunk 和受影响的 reduce 需要重新请求。
+"""
+
+from __future__ import annotations
+from loguru import logger
+
+# 构建输入的工具。可以是我自构建的，需要在具体项目指定具体路径。
+from _old_or_discarded._llm_methods.llm_input.json_input_processor import JsonInputProcessor
+from openai import APIError, AsyncOpenAI
+
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+import zlib
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    import tiktoken
+
+
+class ChunkMapReduceReader:
+    """
+    map-reduce 阅读器。
+
+    主要方法:
+        - read: 阅读文本，返回最终结果。
+        - read_file: 阅读文本文件。
+        - split_text: 切分文本。
+
+    Attributes:
+        stats (dict[str, int]): 累计的请求数和缓存命中数。
+        failed_chunk_indexes (list[int]): 上一次 read 中 map 失败的 chunk 的序号。
+    """
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        map_instruction: str,
+        reduce_instruction: str,
+        max_chunk_tokens: int = 4000,
+        overlap_tokens: int = 200,
+        reduce_fan_in: int = 8,
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        cache_dir: str | Path | None = None,
+        encoding: tiktoken.Encoding | None = None,
+        client: AsyncOpenAI | None = None,
+    ):
+        """
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。
+            api_key (str): api_key 。
+            model (str): 模型名。
+            map_instruction (str): 对每个 chunk 的指令，作为 system-message 。
+            reduce_instruction (str): 合并部分结果的指令，作为 system-message 。
+            max_chunk_tokens (int): 每个 chunk 的最大 token 数，不包括重叠部分。
+            overlap_tokens (int): 相邻 chunk 重叠的 token 数。
+            reduce_fan_in (int): 每次合并的部分结果数。
+            max_concurrency (int): 最大并发数。
+            max_retries (int): 暂时性错误的最大重试次数。
+            cache_dir (Union[str, Path], optional): 缓存的文件夹。不指定时不缓存。
+            encoding (tiktoken.Encoding, optional): 计算 token 的 encoding 。默认使用 o200k_base 。
+                不同模型的 tokenizer 有差异，max_chunk_tokens 需要留有余量。
+            client (AsyncOpenAI, optional): 可以传入已经构建好的 client 。主要用于测试。
+        """
+        if overlap_tokens >= max_chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_chunk_tokens.")
+        if reduce_fan_in < 2:
+            raise ValueError("reduce_fan_in must be at least 2.")
+        self._client = client or AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=max_retries,
+        )
+        self._model = model
+        self._map_instruction = map_instruction
+        self._reduce_instruction = reduce_instruction
+        self._max_chunk_tokens = max_chunk_tokens
+        self._overlap_tokens = overlap_tokens
+        self._reduce_fan_in = reduce_fan_in
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._cache_dir = None if cache_dir is None else Path(cache_dir)
+        if encoding is None:
+            from _old_or_discarded._llm_methods.llm_input.token_budget_prompt_assembler import get_tiktoken_encoding
+            encoding = get_tiktoken_encoding()
+        self._encoding = encoding
+        self.stats = {'requests': 0, 'cache_hits': 0}
+        self.failed_chunk_indexes: list[int] = []
+
+    # ====主要方法。====
+    async def read(
+        self,
+        text: str,
+    ) -> str:
+        """
+        阅读文本。
+
+        Args:
+            text (str): 文本。
+
+        Returns:
+            str: 最终结果。只有一个 chunk 时为该 chunk 的 map 结果。
+                map 失败的 chunk 不包括在内，见 failed_chunk_indexes 。
+
+        Raises:
+            ValueError: 文本没有内容。
+            RuntimeError: 所有 chunk 的 map 请求都失败。
+        """
+        chunks = self.split_text(text)
+        if not chunks:
+            raise ValueError("text has no content to read.")
+        logger.info(f"split into {len(chunks)} chunks.")
+        map_results = await asyncio.gather(*(
+            self._map(index=index, chunk=chunk) for index, chunk in enumerate(chunks)
+        ))
+        self.failed_chunk_indexes = [index for index, map_result in enumerate(map_results) if map_result is None]
+        if len(self.failed_chunk_indexes) == len(chunks):
+            raise RuntimeError(f"map failed for all {len(chunks)} chunks.")
+        if self.failed_chunk_indexes:
+            logger.warning(f"map failed for chunks {self.failed_chunk_indexes}, reduce the other chunks.")
+        partial_results = [map_result for map_result in map_results if map_result is not None]
+        level = 0
+        while len(partial_results) > 1:
+            level += 1
+            groups = [
+                partial_results[start:start + self._reduce_fan_in]
+                for start in range(0, len(partial_results), self._reduce_fan_in)
+            ]
+            logger.info(f"reduce level {level}: {len(partial_results)} partial results into {len(groups)}.")
+            partial_results = await asyncio.gather(*(self._reduce(group) for group in groups))
+        logger.info(f"read done: {self.stats}")
+        return partial_results[0]
+
+    # ====主要方法。====
+    async def read_file(
+        self,
+        file_path: str | Path,
+    ) -> str:
+        return await self.read(Path(file_path).read_text(encoding='utf-8'))
+
+    # ====主要方法。====
+    def split_text(
+        self,
+        text: str,
+    ) -> list[str]:
+        """
+        切分文本。
+
+        Returns:
+            list[str]: chunk 列表。除第一个以外，每个 chunk 以前一个 chunk 结尾的 overlap_tokens 个 token 开头。
+        """
+        chunks: list[str] = []
+        current_paragraphs: list[str] = []
+        current_tokens = 0
+        separator_tokens = len(self._encode('\n\n'))
+        for paragraph in self._iter_paragraphs(text):
+            paragraph_tokens = len(self._encode(paragraph))
+            if current_paragraphs and current_tokens + separator_tokens + paragraph_tokens > self._max_chunk_tokens:
+                chunks.append('\n\n'.join(current_paragraphs))
+                current_paragraphs, current_tokens = [], 0
+            current_tokens += paragraph_tokens + (separator_tokens if current_paragraphs else 0)
+            current_paragraphs.append(paragraph)
+            # 由内容决定的边界。
+            if current_tokens >= self._max_chunk_tokens // 2 and zlib.crc32(paragraph.encode('utf-8')) % 4 == 0:
+                chunks.append('\n\n'.join(current_paragraphs))
+                current_paragraphs, current_tokens = [], 0
+        if current_paragraphs:
+            chunks.append('\n\n'.join(current_paragraphs))
+        if self._overlap_tokens <= 0:
+            return chunks
+        overlapped_chunks = chunks[:1]
+        for previous_chunk, chunk in zip(chunks, chunks[1:]):
+            overlap = self._encoding.decode(self._encode(previous_chunk)[-self._overlap_tokens:])
+            overlapped_chunks.append(f"{overlap}\n\n{chunk}")
+        return overlapped_chunks
+
+    # ====基础方法。====
+    def _iter_paragraphs(
+        self,
+        text: str,
+    ) -> Iterator[str]:
+        """以空行分隔段落。超过 max_chunk_tokens 的段落按照 token 切分。"""
+        for paragraph in text.split('\n\n'):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = self._encode(paragraph)
+            if len(tokens) <= self._max_chunk_tokens:
+                yield paragraph
+                continue
+            for start in range(0, len(tokens), self._max_chunk_tokens):
+                yield self._encoding.decode(tokens[start:start + self._max_chunk_tokens])
+
+    # ====基础方法。====
+    async def _map(
+        self,
+        index: int,
+        chunk: str,
+    ) -> str | None:
+        """对一个 chunk 执行 map 。重试后依然失败时记录日志并返回 None 。"""
+        try:
+            return await self._complete(instruction=self._map_instruction, content=chunk)
+        except APIError as e:
+            logger.error(f"map of chunk {index} failed: {e!r}")
+            return None
+
+    # ====基础方法。====
+    async def _reduce(
+        self,
+        partial_results: list[str],
+    ) -> str:
+        if len(partial_results) == 1:
+            return partial_results[0]
+        content = JsonInputProcessor.put_in_markdown(
+            [{'index': index, 'partial_result': partial_result} for index, partial_result in enumerate(partial_results)]
+        )
+        return await self._complete(instruction=self._reduce_instruction, content=content)
+
+    # ====基础方法。====
+    async def _complete(
+        self,
+        instruction: str,
+        content: str,
+    ) -> str:
+        """发送一个请求。有缓存时直接返回缓存的结果。"""
+        cache_path = self._get_cache_path(instruction=instruction, content=content)
+        if cache_path is not None and cache_path.exists():
+            self.stats['cache_hits'] += 1
+            return json.loads(cache_path.read_text(encoding='utf-8'))['content']
+        async with self._semaphore:
+            completion = await self._client.chat.completions.create(
+                model=self._model,
+                messages=[
+                    {'role': 'system', 'content': instruction},
+                    {'role': 'user', 'content': content},
+                ],
+            )
+        self.stats['requests'] += 1
+        result = completion.choices[0].message.content or ''
+        if cache_path is not None:
+            # 先写入临时文件再 os.replace ，中断时不会留下不完整的缓存。
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f'.{cache_path.name}.{os.getpid()}.tmp')
+            tmp_path.write_text(json.dumps({'content': result}, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, cache_path)
+        return result
+
+    # ====基础方法。====
+    def _get_cache_path(
+        self,
+        instruction: str,
+        content: str,
+    ) -> Path | None:
+        if self._cache_dir is None:
+            return None
+        key_str = json.dumps([self._model, instruction, content], ensure_ascii=False)
+        return self._cache_dir / f"{hashlib.sha256(key_str.encode('utf-8')).hexdigest()}.json"
+
+    # ====基础方法。====
+    def _encode(
+        self,
+        text: str,
+    ) -> list[int]:
+        return self._encoding.encode(text, disallowed_special=())
@@ -12,21 +12,56 @@ Notes:
     对于极长文本，dashscope 需要上传文件并处理。
 
     默认支持的模型为 qwen-long ，目前做对于该模型的适配。
+
+    大量 (file_id, question) 任务使用 AsyncQwenLongReader :
+        - 所有任务共享一个 AsyncOpenAI client ，使用 semaphore 限制并发数。
+        - 结果文件中记录 file_id 和 prompt 的哈希。重新运行时，结果有效且哈希一致的任务直接跳过，因此可以中断后继续。
+        - 结果先写入临时文件再 os.replace ，中断时不会留下不完整的结果文件。
+
+    同一个文件有多个问题时，使用 read_file_questions :
+        - 每次请求 provider 都需要重新 prefill 整个文件，问题越多，重复的 prefill 越多。
+        - 因此将所有问题以 json 列表放在一个请求中，答案以 json 列表返回，使用 JsonOutputExtractor 提取。
+        - 缺失或无法解析的答案，对对应的问题单独请求。
+
+    需要观察延迟时，使用 stream_read_file :
+        - 逐段 yield 生成的内容，记录首 token 延迟(ttft)、生成速度(tokens/sec)和总延迟。
+        - 生成过程中内容追加写入 .part 文件，结束后原子写入与 read_file 格式一致的结果文件，并删除 .part 文件。
+        - stream 在单独的 task 中读取并持有 semaphore ，调用方处理内容片段的时间不占用并发数。
+            调用方提前停止迭代时，取消请求并关闭 stream 。
 """
 
 from __future__ import annotations
 from loguru import logger
 
-from openai import OpenAI
+# 构建输入和解析输出的工具。可以是我自构建的，需要在具体项目指定具体路径。
+from _old_or_discarded._llm_methods.llm_input.json_input_processor import JsonInputProcessor
+from _old_or_discarded._llm_methods.llm_output.json_output_extractor import JsonOutputExtractor
+from openai import AsyncOpenAI, OpenAI
 
+import asyncio
+import contextlib
+from dataclasses import dataclass
+import hashlib
 import os
 from pathlib import Path
 import json
+import tempfile
+import time
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable
     from pydantic import BaseModel
 
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+QUESTIONS_INSTRUCTION = (
+    "下面的 json 列表中有 {num_questions} 个关于文件的问题，每个问题以 index 字段标识。\n"
+    "请根据文件内容分别回答每一个问题。"
+    "最终结果以 json 列表的形式放在 markdown-code-cell 中，"
+    "列表中的每个元素对应一个问题，包含该问题的 index 字段和字符串形式的 answer 字段。\n"
+)
+
 
 class QwenLongReader:
     @staticmethod
@@ -39,7 +74,7 @@ class QwenLongReader:
         # 构造client，使用OpenAI Client兼容方法。
         client = OpenAI(
             # HARDCODED
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            base_url=DASHSCOPE_BASE_URL,
             api_key=os.getenv("DASHSCOPE_API_KEY"),
         )
         completion = client.chat.completions.create(
@@ -65,3 +100,493 @@ class QwenLongReader:
         )
         return completion
 
+
+@dataclass
+class QwenLongReadJob:
+    """
+    一次长文本阅读任务。
+
+    Attributes:
+        file_id (str): 已经上传的文件的 file-id 。
+        system_message_content (str): 指令。
+        human_message_content (str): 问题。
+        result_path (Union[str, Path]): 结果文件的路径。
+    """
+    file_id: str
+    system_message_content: str
+    human_message_content: str
+    result_path: str | Path
+
+
+@dataclass
+class QwenLongQuestionsJob:
+    """
+    对同一个文件的多个问题。
+
+    Attributes:
+        file_id (str): 已经上传的文件的 file-id 。
+        system_message_content (str): 指令。
+        questions (list[str]): 问题列表。
+        result_path (Union[str, Path]): 结果文件的路径。
+    """
+    file_id: str
+    system_message_content: str
+    questions: list[str]
+    result_path: str | Path
+
+
+class AsyncQwenLongReader:
+    """
+    并发的长文本阅读器。
+
+    主要方法:
+        - read_files: 并发执行多个任务，跳过已有有效结果的任务。
+        - read_file: 执行一个任务。
+        - stream_read_file: 以流式方式执行一个任务，记录延迟指标。
+        - read_files_questions: 并发执行多个多问题任务。
+        - read_file_questions: 在一个请求中回答同一个文件的多个问题。
+        - load_valid_result: 读取有效的已有结果。
+
+    结果文件的格式为:
+        - read_file: {"file_id": ..., "prompt_hash": ..., "completion": completion.model_dump()} 。
+        - read_file_questions: {"file_id": ..., "prompt_hash": ..., "answers": [...], "completions": [...]} 。
+        - stream_read_file: 与 read_file 相同，另有 "metrics" 。completion 由流式的 chunk 组合而成。
+    """
+    def __init__(
+        self,
+        base_url: str = DASHSCOPE_BASE_URL,
+        api_key: str | None = None,
+        model: str = 'qwen-long',
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        timeout: float = 600.,
+        client: AsyncOpenAI | None = None,
+    ):
+        """
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。默认为 DashScope 。
+            api_key (str, optional): api_key 。默认使用环境变量 DASHSCOPE_API_KEY 。
+            model (str): 模型名。
+            max_concurrency (int): 最大并发数。
+            max_retries (int): client 对暂时性错误的最大重试次数。
+            timeout (float): 单个请求的超时时间，单位为秒。长文本的 prefill 较慢，需要足够长。
+            client (AsyncOpenAI, optional): 可以传入已经构建好的 client 。主要用于测试。
+        """
+        self._client = client or AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key or os.getenv("DASHSCOPE_API_KEY"),
+            max_retries=max_retries,
+            timeout=timeout,
+        )
+        self._model = model
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # stream_read_file 每次请求的延迟指标。
+        self.stream_metrics: list[dict] = []
+
+    # ====主要方法。====
+    async def read_files(
+        self,
+        jobs: list[QwenLongReadJob],
+    ) -> list[dict | None]:
+        """
+        并发执行多个任务。
+
+        Args:
+            jobs (list[QwenLongReadJob]): 任务列表。
+
+        Returns:
+            list[Optional[dict]]: 与输入顺序一致的 completion 。失败的为 None 。
+        """
+        return await self._gather_in_order(jobs=jobs, read=self.read_file)
+
+    # ====主要方法。====
+    async def read_file(
+        self,
+        job: QwenLongReadJob,
+    ) -> dict:
+        """
+        执行一个任务。已有有效结果时直接返回，不发送请求。
+
+        Returns:
+            dict: completion 。
+        """
+        messages = self.build_messages(
+            file_id=job.file_id,
+            system_message_content=job.system_message_content,
+            human_message_content=job.human_message_content,
+        )
+        prompt_hash = self.get_prompt_hash(model=self._model, messages=messages)
+        completion = self.load_valid_result(result_path=job.result_path, file_id=job.file_id, prompt_hash=prompt_hash)
+        if completion is not None:
+            logger.debug(f"skip {job.result_path}: valid result exists.")
+            return completion
+        completion = await self._create_completion(messages=messages)
+        self._write_json_atomically(
+            result_path=job.result_path,
+            result={'file_id': job.file_id, 'prompt_hash': prompt_hash, 'completion': completion},
+        )
+        return completion
+
+    # ====主要方法。====
+    async def stream_read_file(
+        self,
+        job: QwenLongReadJob,
+    ) -> AsyncIterator[str]:
+        """
+        以流式方式执行一个任务。已有有效结果时一次性 yield 全部内容，不发送请求。
+
+        延迟指标追加到 stream_metrics ，同时写入结果文件:
+            - ttft: 从发送请求到收到第一段内容的秒数。
+            - latency: 从发送请求到结束的秒数。
+            - completion_tokens: 生成的 token 数。服务端不返回 usage 时为收到的内容段数。
+            - tokens_per_second: 第一段内容之后的生成速度。
+
+        Yields:
+            str: 生成的内容片段。
+        """
+        messages = self.build_messages(
+            file_id=job.file_id,
+            system_message_content=job.system_message_content,
+            human_message_content=job.human_message_content,
+        )
+        prompt_hash = self.get_prompt_hash(model=self._model, messages=messages)
+        completion = self.load_valid_result(result_path=job.result_path, file_id=job.file_id, prompt_hash=prompt_hash)
+        if completion is not None:
+            logger.debug(f"skip {job.result_path}: valid result exists.")
+            yield completion['choices'][0]['message']['content']
+            return
+        result_path = Path(job.result_path)
+        result_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = result_path.with_name(f'{result_path.name}.part')
+        # 请求在单独的 task 中读取 stream 并持有 semaphore ，调用方处理内容的时间不占用并发数。
+        delta_queue: asyncio.Queue[str | None] = asyncio.Queue()
+        stream_task = asyncio.create_task(
+            self._consume_stream(messages=messages, part_path=part_path, delta_queue=delta_queue)
+        )
+        try:
+            while (delta := await delta_queue.get()) is not None:
+                yield delta
+            stream_result = await stream_task
+        finally:
+            # 调用方提前停止迭代时，取消请求并关闭 stream 。
+            if not stream_task.done():
+                stream_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await stream_task
+        contents, num_deltas, finish_reason, usage, ttft, latency = stream_result
+        completion_tokens = usage['completion_tokens'] if usage else num_deltas
+        generation_time = latency - (ttft or 0.)
+        metrics = {
+            'file_id': job.file_id,
+            'ttft': ttft,
+            'latency': latency,
+            'completion_tokens': completion_tokens,
+            'tokens_per_second': completion_tokens / generation_time if generation_time > 0 else None,
+        }
+        self.stream_metrics.append(metrics)
+        logger.info(f"stream {job.file_id}: {metrics}")
+        self._write_json_atomically(
+            result_path=result_path,
+            result={
+                'file_id': job.file_id,
+                'prompt_hash': prompt_hash,
+                'completion': {
+                    'model': self._model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': ''.join(contents)},
+                        'finish_reason': finish_reason,
+                    }],
+                    'usage': usage,
+                },
+                'metrics': metrics,
+            },
+        )
+        part_path.unlink(missing_ok=True)
+
+    # ====主要方法。====
+    async def read_files_questions(
+        self,
+        jobs: list[QwenLongQuestionsJob],
+    ) -> list[list[str | None] | None]:
+        """
+        并发执行多个多问题任务。
+
+        Returns:
+            list[Optional[list[Optional[str]]]]: 与输入顺序一致的答案列表。请求失败的任务为 None 。
+        """
+        return await self._gather_in_order(jobs=jobs, read=self.read_file_questions)
+
+    # ====主要方法。====
+    async def read_file_questions(
+        self,
+        job: QwenLongQuestionsJob,
+    ) -> list[str | None]:
+        """
+        在一个请求中回答同一个文件的多个问题。已有有效结果时直接返回，不发送请求。
+
+        Returns:
+            list[Optional[str]]: 与 questions 顺序一致的答案。单独请求后依然没有答案的为 None 。
+        """
+        human_message_content = QUESTIONS_INSTRUCTION.format(num_questions=len(job.questions)) + (
+            JsonInputProcessor.put_in_markdown(
+                [{'index': index, 'question': question} for index, question in enumerate(job.questions)]
+            )
+        )
+        messages = self.build_messages(
+            file_id=job.file_id,
+            system_message_content=job.system_message_content,
+            human_message_content=human_message_content,
+        )
+        prompt_hash = self.get_prompt_hash(model=self._model, messages=messages)
+        answers = self._load_valid_answers(result_path=job.result_path, file_id=job.file_id, prompt_hash=prompt_hash)
+        if answers is not None:
+            logger.debug(f"skip {job.result_path}: valid result exists.")
+            return answers
+        completion = await self._create_completion(messages=messages)
+        answers = self._extract_answers(
+            content=completion['choices'][0]['message']['content'] or '',
+            num_questions=len(job.questions),
+        )
+        completions = [completion]
+        # 缺失的答案单独请求。
+        missing_indexes = [index for index, answer in enumerate(answers) if answer is None]
+        if missing_indexes:
+            logger.info(f"{job.file_id}: {len(missing_indexes)} of {len(job.questions)} answers missing, ask one by one.")
+
+            async def ask_one(index: int) -> dict | None:
+                try:
+                    return await self._create_completion(messages=self.build_messages(
+                        file_id=job.file_id,
+                        system_message_content=job.system_message_content,
+                        human_message_content=job.questions[index],
+                    ))
+                except Exception as e:
+                    logger.error(f"failed to ask question {index} of {job.file_id}: {e!r}")
+                    return None
+
+            for index, fallback_completion in zip(
+                missing_indexes,
+                await asyncio.gather(*(ask_one(index) for index in missing_indexes)),
+            ):
+                if fallback_completion is not None:
+                    answers[index] = fallback_completion['choices'][0]['message']['content'] or None
+                    completions.append(fallback_completion)
+        self._write_json_atomically(
+            result_path=job.result_path,
+            result={
+                'file_id': job.file_id,
+                'prompt_hash': prompt_hash,
+                'answers': answers,
+                'completions': completions,
+            },
+        )
+        return answers
+
+    # ====主要方法。====
+    @staticmethod
+    def load_valid_result(
+        result_path: str | Path,
+        file_id: str,
+        prompt_hash: str,
+    ) -> dict | None:
+        """
+        读取已有的结果。结果需要能够解析、file_id 和 prompt_hash 一致、并且正常结束。
+
+        Returns:
+            Optional[dict]: 有效的 completion 。否则为 None 。
+        """
+        result_path = Path(result_path)
+        if not result_path.exists():
+            return None
+        try:
+            result = json.loads(result_path.read_text(encoding='utf-8'))
+            completion = result['completion']
+            is_valid = (
+                result['file_id'] == file_id
+                and result['prompt_hash'] == prompt_hash
+                and completion['choices'][0]['finish_reason'] == 'stop'
+                and bool(completion['choices'][0]['message']['content'])
+            )
+        except (ValueError, KeyError, IndexError, TypeError):
+            logger.warning(f"invalid result file {result_path}, read again.")
+            return None
+        return completion if is_valid else None
+
+    # ==== 基础方法。 ====
+    async def _consume_stream(
+        self,
+        messages: list[dict],
+        part_path: Path,
+        delta_queue: asyncio.Queue[str | None],
+    ) -> tuple[list[str], int, str | None, dict | None, float | None, float]:
+        """
+        发送流式请求，将内容片段放入 delta_queue ，结束或出错时放入 None 。
+
+        Returns:
+            tuple: (内容片段, 内容段数, finish_reason, usage, ttft, latency) 。
+        """
+        contents: list[str] = []
+        num_deltas = 0
+        finish_reason = None
+        usage = None
+        ttft = None
+        try:
+            async with self._semaphore:
+                start_time = time.perf_counter()
+                stream = await self._client.chat.completions.create(
+                    model=self._model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={'include_usage': True},
+                )
+                async with stream:
+                    with open(part_path, 'w', encoding='utf-8') as part_file:
+                        async for chunk in stream:
+                            if chunk.usage is not None:
+                                usage = chunk.usage.model_dump()
+                            if not chunk.choices:
+                                continue
+                            finish_reason = chunk.choices[0].finish_reason or finish_reason
+                            delta = chunk.choices[0].delta.content
+                            if not delta:
+                                continue
+                            if ttft is None:
+                                ttft = time.perf_counter() - start_time
+                            num_deltas += 1
+                            contents.append(delta)
+                            part_file.write(delta)
+                            part_file.flush()
+                            delta_queue.put_nowait(delta)
+                latency = time.perf_counter() - start_time
+        finally:
+            delta_queue.put_nowait(None)
+        return contents, num_deltas, finish_reason, usage, ttft, latency
+
+    # ==== 基础方法。 ====
+    async def _create_completion(
+        self,
+        messages: list[dict],
+    ) -> dict:
+        async with self._semaphore:
+            completion = await self._client.chat.completions.create(
+                model=self._model,
+                messages=messages,
+            )
+        logger.trace(f"completion: \n{completion}")
+        return completion.model_dump()
+
+    # ==== 基础方法。 ====
+    @staticmethod
+    async def _gather_in_order(
+        jobs: list[Any],
+        read: Callable[[Any], Awaitable[Any]],
+    ) -> list[Any | None]:
+        """并发执行任务。单个任务的失败记录日志并返回 None 。"""
+        async def run_one(job: Any) -> Any | None:
+            try:
+                return await read(job)
+            except Exception as e:
+                logger.error(f"failed to read {job.file_id} for {job.result_path}: {e!r}")
+                return None
+
+        results = await asyncio.gather(*(run_one(job) for job in jobs))
+        logger.info(f"read {len(jobs)} jobs, {sum(result is None for result in results)} failed.")
+        return list(results)
+
+    # ==== 基础方法。 ====
+    @staticmethod
+    def _extract_answers(
+        content: str,
+        num_questions: int,
+    ) -> list[str | None]:
+        """从 json 列表中按照 index 提取答案。没有出现或者答案为空的问题为 None 。"""
+        answers: list[str | None] = [None] * num_questions
+        raw_structured_data = JsonOutputExtractor.extract_json_from_str(
+            raw_str=content,
+            index_to_choose=-1,
+            json_loader_name='json-repair',
+        )
+        if not isinstance(raw_structured_data, list):
+            return answers
+        for item in raw_structured_data:
+            if not isinstance(item, dict):
+                continue
+            index, answer = item.get('index'), item.get('answer')
+            if isinstance(index, int) and 0 <= index < num_questions and answer:
+                answers[index] = answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)
+        return answers
+
+    # ==== 基础方法。 ====
+    @staticmethod
+    def _load_valid_answers(
+        result_path: str | Path,
+        file_id: str,
+        prompt_hash: str,
+    ) -> list[str | None] | None:
+        """读取已有的多问题结果。哈希一致并且所有问题都有答案时有效。"""
+        result_path = Path(result_path)
+        if not result_path.exists():
+            return None
+        try:
+            result = json.loads(result_path.read_text(encoding='utf-8'))
+            is_valid = (
+                result['file_id'] == file_id
+                and result['prompt_hash'] == prompt_hash
+                and all(result['answers'])
+            )
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"invalid result file {result_path}, read again.")
+            return None
+        return result['answers'] if is_valid else None
+
+    # ==== 工具方法。 ====
+    @staticmethod
+    def build_messages(
+        file_id: str,
+        system_message_content: str,
+        human_message_content: str,
+    ) -> list[dict]:
+        return [
+            # System1: instruction
+            {'role': 'system', 'content': system_message_content},
+            # System2: file content
+            {'role': 'system', 'content': f'fileid://{file_id}'},
+            # Human Message: task
+            {'role': 'user', 'content': human_message_content},
+        ]
+
+    # ==== 工具方法。 ====
+    @staticmethod
+    def get_prompt_hash(
+        model: str,
+        messages: list[dict],
+    ) -> str:
+        """model 和 messages 的 sha256 。file_id 包含在 messages 中。"""
+        prompt_str = json.dumps({'model': model, 'messages': messages}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(prompt_str.encode('utf-8')).hexdigest()
+
+    # ==== 工具方法。 ====
+    @staticmethod
+    def _write_json_atomically(
+        result_path: str | Path,
+        result: dict,
+    ) -> None:
+        """先写入同一文件夹中的临时文件，再 os.replace 。临时文件名唯一，同一进程中的并发写入不会冲突。"""
+        result_path = Path(result_path)
+        result_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = tempfile.NamedTemporaryFile(
+            mode='w',
+            encoding='utf-8',
+            dir=result_path.parent,
+            prefix=f'.{result_path.name}.',
+            suffix='.tmp',
+            delete=False,
+        )
+        try:
+            with tmp_file:
+                json.dump(result, tmp_file, ensure_ascii=False, indent=4)
+            os.replace(tmp_file.name, result_path)
+        except BaseException:
+            Path(tmp_file.name).unlink(missing_ok=True)
+            raise
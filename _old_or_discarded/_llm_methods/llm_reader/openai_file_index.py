@@ -0,0 +1,164 @@
+"""
+Sources:
+
+References:
+    https://docs.python.org/3/library/sqlite3.html
+
+Synopsis:
+    上传文件的本地去重索引。
+
+Notes:
+    OpenAIFileManager 不知道哪些文件已经在 provider 上，重复的任务会重复上传相同的文件。
+
+    这里的约定:
+        - 使用 SQLite 保存 (文件内容的 sha256, purpose) 到 file-object 的映射。只依赖内容，与文件路径无关。
+        - 上传前先查询索引，命中时直接返回已有的 file-object 。
+        - 删除文件时同时删除索引中的记录。
+        - provider 上的文件可能过期或者被其他方式删除，使用 reconcile 与 list_files 的结果对齐。
+        - file-id 只在同一个 provider 中有效，不同的 provider 使用不同的索引文件。
+        - 同一批并发上传中内容相同的文件在写入索引前都会上传，之后的任务才会命中。
+"""
+
+from __future__ import annotations
+from loguru import logger
+
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+class OpenAIFileIndex:
+    """
+    基于 SQLite 的去重索引。
+
+    主要方法:
+        - get_file_sha256: 计算文件内容的 sha256 。
+        - get: 查询已经上传的 file-object 。
+        - put: 记录上传的 file-object 。
+        - remove_file_ids: 删除 file-id 对应的记录。
+        - reconcile: 与 provider 上的文件列表对齐，删除已经不存在的记录。
+    """
+    def __init__(
+        self,
+        db_path: str | Path,
+    ):
+        """
+        Args:
+            db_path (Union[str, Path]): SQLite 文件的路径。不存在时自动创建。
+        """
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # 异步的管理器在线程中计算 sha256 ，因此允许跨线程使用，写操作由锁保护。
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploaded_files (
+                    sha256 TEXT NOT NULL,
+                    purpose TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    file_object TEXT NOT NULL,
+                    uploaded_at REAL NOT NULL,
+                    PRIMARY KEY (sha256, purpose)
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS uploaded_files_file_id ON uploaded_files (file_id)"
+            )
+
+    # ====主要方法。====
+    @staticmethod
+    def get_file_sha256(
+        file_path: str | Path,
+        chunk_size: int = 1 << 20,
+    ) -> str:
+        """分块读取，计算文件内容的 sha256 。"""
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    # ====主要方法。====
+    def get(
+        self,
+        sha256: str,
+        purpose: str,
+    ) -> dict | None:
+        """
+        查询已经上传的 file-object 。
+
+        Returns:
+            Optional[dict]: 上传时的 file-object 。没有记录时为 None 。
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT file_object FROM uploaded_files WHERE sha256 = ? AND purpose = ?",
+                (sha256, purpose),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    # ====主要方法。====
+    def put(
+        self,
+        sha256: str,
+        purpose: str,
+        file_object: dict,
+    ) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO uploaded_files VALUES (?, ?, ?, ?, ?)",
+                (sha256, purpose, file_object['id'], json.dumps(file_object, ensure_ascii=False), time.time()),
+            )
+
+    # ====主要方法。====
+    def remove_file_ids(
+        self,
+        file_ids: Iterable[str],
+    ) -> int:
+        """
+        删除 file-id 对应的记录。
+
+        Returns:
+            int: 删除的记录数。
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.executemany(
+                "DELETE FROM uploaded_files WHERE file_id = ?",
+                ((file_id,) for file_id in file_ids),
+            )
+        return cursor.rowcount
+
+    # ====主要方法。====
+    def reconcile(
+        self,
+        remote_files: Iterable[dict],
+    ) -> int:
+        """
+        与 provider 上的文件列表对齐。删除索引中 provider 上已经不存在的记录。
+
+        Args:
+            remote_files (Iterable[dict]): list_files 的结果。
+
+        Returns:
+            int: 删除的记录数。
+        """
+        remote_file_ids = {file_object['id'] for file_object in remote_files}
+        with self._lock:
+            local_file_ids = [row[0] for row in self._connection.execute("SELECT file_id FROM uploaded_files")]
+        stale_file_ids = [file_id for file_id in local_file_ids if file_id not in remote_file_ids]
+        num_removed = self.remove_file_ids(stale_file_ids)
+        logger.info(f"reconcile file index: {len(local_file_ids)} records, {num_removed} stale records removed.")
+        return num_removed
+
+    # ====主要方法。====
+    def close(self) -> None:
+        self._connection.close()
@@ -10,6 +10,8 @@ Synopsis:
 Notes:
     封装了基础的增删改查方法。
     添加了批量处理方法。
+    可选传入 OpenAIFileIndex ，上传前按照文件内容去重，删除时同步删除索引中的记录。
+    文件数量很多时，使用 iter_files 逐页获取并过滤，使用 purge 并发清理。
 """
 
 from __future__ import annotations
@@ -17,11 +19,45 @@ from loguru import logger
 
 from openai import OpenAI
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 from pathlib import Path
+import time
 
 from typing import TYPE_CHECKING, Sequence
-# if TYPE_CHECKING:
+if TYPE_CHECKING:
+    from _old_or_discarded._llm_methods.llm_reader.openai_file_index import OpenAIFileIndex
+    from collections.abc import Iterator
+    from openai.types import FileObject
+
+
+def is_file_matched(
+    file: FileObject,
+    purpose: str | None = None,
+    created_before: float | None = None,
+    filename_prefix: str | None = None,
+) -> bool:
+    """
+    判断文件是否符合过滤条件。OpenAIFileManager 和 AsyncOpenAIFileManager 的 iter_files 共用。
+
+    在 model_dump 之前过滤。服务端不支持 purpose 参数时也能得到正确的结果。
+
+    Args:
+        file (FileObject): list 返回的 file-object 。
+        purpose (str, optional): 文件的用途需要一致。
+        created_before (float, optional): 创建时间需要早于该时间戳。
+        filename_prefix (str, optional): 文件名需要以该前缀开头。
+
+    Returns:
+        bool: 是否符合所有指定的条件。
+    """
+    if purpose is not None and file.purpose != purpose:
+        return False
+    if created_before is not None and file.created_at >= created_before:
+        return False
+    if filename_prefix is not None and not (file.filename or '').startswith(filename_prefix):
+        return False
+    return True
 
 
 class OpenAIFileManager:
@@ -31,6 +67,7 @@ class OpenAIFileManager:
         api_key: str,
         file_path: str | Path,
         purpose: str,
+        file_index: OpenAIFileIndex | None = None,
     ) -> dict:
         # 构建client。
         client = OpenAIFileManager.create_openai_client(
@@ -38,11 +75,12 @@ class OpenAIFileManager:
             api_key=api_key,
         )
         # 上传文件。
-        file_object = client.files.create(
-            file=file_path,
+        return OpenAIFileManager._create_file_with_index(
+            client=client,
+            file_path=file_path,
             purpose=purpose,
+            file_index=file_index,
         )
-        return file_object.model_dump()
 
     @staticmethod
     def create_files(
@@ -50,6 +88,7 @@ class OpenAIFileManager:
         api_key: str,
         file_paths: Sequence[str | Path],
         purpose: str,
+        file_index: OpenAIFileIndex | None = None,
     ) -> list[dict]:
         # 构建client。
         client = OpenAIFileManager.create_openai_client(
@@ -59,11 +98,13 @@ class OpenAIFileManager:
         # 批量上传。
         file_object_results = []
         for file_path in file_paths:
-            file_object = client.files.create(
-                file=file_path,
+            file_object = OpenAIFileManager._create_file_with_index(
+                client=client,
+                file_path=file_path,
                 purpose=purpose,
+                file_index=file_index,
             )
-            file_object_results.append(file_object.model_dump())
+            file_object_results.append(file_object)
         return file_object_results
 
     @staticmethod
@@ -101,11 +142,131 @@ class OpenAIFileManager:
         all_files = [file.model_dump() for file in all_files]
         return all_files
 
+    @staticmethod
+    def iter_files(
+        base_url: str,
+        api_key: str,
+        purpose: str | None = None,
+        older_than: float | None = None,
+        filename_prefix: str | None = None,
+        page_size: int = 1000,
+    ) -> Iterator[dict]:
+        """
+        逐页获取文件，边获取边过滤。不会在内存中保存完整的文件列表。
+
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。
+            api_key (str): api_key 。
+            purpose (str, optional): 只保留该用途的文件。作为请求参数由服务端过滤。
+            older_than (float, optional): 只保留创建时间早于该秒数之前的文件。
+            filename_prefix (str, optional): 只保留文件名以该前缀开头的文件。
+            page_size (int): 每页的文件数。
+
+        Yields:
+            dict: 符合条件的 file-object 。
+        """
+        # 构建client。
+        client = OpenAIFileManager.create_openai_client(
+            base_url=base_url,
+            api_key=api_key,
+        )
+        list_kwargs = {'limit': page_size}
+        if purpose is not None:
+            list_kwargs['purpose'] = purpose
+        created_before = None if older_than is None else time.time() - older_than
+        # 自动分页迭代器在当前页用完后才请求下一页。
+        for file in client.files.list(**list_kwargs):
+            if is_file_matched(
+                file=file,
+                purpose=purpose,
+                created_before=created_before,
+                filename_prefix=filename_prefix,
+            ):
+                yield file.model_dump()
+
+    @staticmethod
+    def purge(
+        base_url: str,
+        api_key: str,
+        purpose: str | None = None,
+        older_than: float | None = None,
+        filename_prefix: str | None = None,
+        dry_run: bool = True,
+        max_concurrency: int = 16,
+        file_index: OpenAIFileIndex | None = None,
+    ) -> dict:
+        """
+        并发删除符合条件的文件。
+
+        Args:
+            base_url (str): OpenAI 兼容接口的 base_url 。
+            api_key (str): api_key 。
+            purpose (str, optional): 与 iter_files 相同。
+            older_than (float, optional): 与 iter_files 相同。
+            filename_prefix (str, optional): 与 iter_files 相同。
+            dry_run (bool): 只统计，不删除。默认为 True ，避免误删。
+            max_concurrency (int): 删除请求的最大并发数。
+            file_index (OpenAIFileIndex, optional): 同步删除去重索引中的记录。
+
+        Returns:
+            dict: 清理报告。
+                - num_matched, num_bytes: 符合条件的文件数和总字节数。
+                - num_deleted, failed_file_ids: 删除成功的数量和失败的 file-id 。dry_run 时为 0 和空列表。
+                - matched_file_ids: 符合条件的 file-id 。
+        """
+        matched_file_ids = []
+        num_bytes = 0
+        for file_object in OpenAIFileManager.iter_files(
+            base_url=base_url,
+            api_key=api_key,
+            purpose=purpose,
+            older_than=older_than,
+            filename_prefix=filename_prefix,
+        ):
+            matched_file_ids.append(file_object['id'])
+            num_bytes += file_object.get('bytes') or 0
+        report = {
+            'num_matched': len(matched_file_ids),
+            'num_bytes': num_bytes,
+            'num_deleted': 0,
+            'failed_file_ids': [],
+            'matched_file_ids': matched_file_ids,
+        }
+        logger.info(f"purge: {len(matched_file_ids)} files matched, {num_bytes} bytes, dry_run={dry_run}.")
+        if dry_run or not matched_file_ids:
+            return report
+        # 构建client。client 是线程安全的，所有线程共享连接池。
+        client = OpenAIFileManager.create_openai_client(
+            base_url=base_url,
+            api_key=api_key,
+        )
+
+        def delete_one(file_id: str) -> bool:
+            try:
+                client.files.delete(file_id=file_id)
+            except Exception as e:
+                logger.error(f"failed to delete {file_id}: {e!r}")
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            is_deleted_list = list(executor.map(delete_one, matched_file_ids))
+        deleted_file_ids = [file_id for file_id, is_deleted in zip(matched_file_ids, is_deleted_list) if is_deleted]
+        if file_index is not None:
+            file_index.remove_file_ids(deleted_file_ids)
+        report['num_deleted'] = len(deleted_file_ids)
+        report['failed_file_ids'] = [
+            file_id for file_id, is_deleted in zip(matched_file_ids, is_deleted_list) if not is_deleted
+        ]
+        logger.info(f"purge: {report['num_deleted']} deleted, {len(report['failed_file_ids'])} failed.")
+        return report
+
     @staticmethod
     def delete_file(
         base_url: str,
         api_key: str,
         file_id: str,
+        file_index: OpenAIFileIndex | None = None,
     ) -> dict:
         # 构建client。
         client = OpenAIFileManager.create_openai_client(
@@ -116,6 +277,8 @@ class OpenAIFileManager:
         file_object = client.files.delete(
             file_id=file_id,
         )
+        if file_index is not None:
+            file_index.remove_file_ids([file_id])
         return file_object.model_dump()
 
     @staticmethod
@@ -123,6 +286,7 @@ class OpenAIFileManager:
         base_url: str,
         api_key: str,
         file_ids: Sequence[str],
+        file_index: OpenAIFileIndex | None = None,
     ) -> list[dict]:
         # 构建client。
         client = OpenAIFileManager.create_openai_client(
@@ -135,9 +299,44 @@ class OpenAIFileManager:
             file_object = client.files.delete(
                 file_id=file_id,
             )
+            if file_index is not None:
+                file_index.remove_file_ids([file_id])
             file_object_results.append(file_object.model_dump())
         return file_object_results
 
+    @staticmethod
+    def reconcile_file_index(
+        base_url: str,
+        api_key: str,
+        file_index: OpenAIFileIndex,
+    ) -> int:
+        """与 provider 上的文件列表对齐，删除索引中已经不存在的记录。返回删除的记录数。"""
+        remote_files = OpenAIFileManager.list_files(
+            base_url=base_url,
+            api_key=api_key,
+        )
+        return file_index.reconcile(remote_files)
+
+    # ==== 工具方法。 ====
+    @staticmethod
+    def _create_file_with_index(
+        client: OpenAI,
+        file_path: str | Path,
+        purpose: str,
+        file_index: OpenAIFileIndex | None,
+    ) -> dict:
+        """上传文件。有索引时，内容相同的文件只上传一次。"""
+        if file_index is None:
+            return client.files.create(file=Path(file_path), purpose=purpose).model_dump()
+        sha256 = file_index.get_file_sha256(file_path)
+        file_object = file_index.get(sha256=sha256, purpose=purpose)
+        if file_object is not None:
+            logger.info(f"skip upload of {file_path}: already uploaded as {file_object['id']}.")
+            return file_object
+        file_object = client.files.create(file=Path(file_path), purpose=purpose).model_dump()
+        file_index.put(sha256=sha256, purpose=purpose, file_object=file_object)
+        return file_object
+
     # ==== 工具方法。 ====
     @staticmethod
     def create_openai_client(
@@ -2,6 +2,8 @@
 Sources:
 
 References:
+    https://pytorch.org/docs/stable/notes/cuda.html#use-pinned-memory-buffers
+    https://huggingface.co/docs/safetensors/index
 
 Synopsis:
 
@@ -12,37 +14,93 @@ Notes:
     设计了没有 scheduler 的情况，但是按照我的 trainer 的设计，scheduler 是一定有的。
 
     后来这里主要的方法被 lightning 中的 ModelCheckpoint 替代了，不过我依然会再加入一些特定情况的功能。
+
+    AsyncCheckpointWriter: 不阻塞训练的保存。
+        - 在训练线程中只做 state_dict 的快照: GPU 上的 tensor 异步复制到 pinned memory ，CPU 上的 tensor 复制一份。
+        - 在后台线程中写入临时文件，完成后 os.replace ，中断时不会留下不完整的 checkpoint 。
+        - 只保留最新的 keep_last_k 个 checkpoint 。
+        - 同时只有一个写入。下一次保存会先等待上一次写入完成，pinned memory 的缓冲区因此可以复用。
+
+    3种格式:
+        - torch: torch.save 的 pickle 。加载时使用 mmap 和 weights_only ，只有用到的 tensor 才会读入内存。
+        - safetensors: 所有 tensor 以 '{model|optimizer|scheduler}/...' 为 key 平铺保存，
+            其余的嵌套结构(param_groups 、int 作为 key 的 optimizer state 等)以 json 保存在 metadata 的 skeleton 中。
+            加载时按需 mmap 读取，只加载 model 时不会读取 optimizer 的 tensor 。共享存储的 tensor (例如 tied weights)只保存一次。
+        - sharded: 一个文件夹，包括 index.json 和多个 safetensors 的 shard 。
+            - tensor 按照顺序装入 shard ，每个 shard 不超过 max_shard_size 字节(单个更大的 tensor 独占一个 shard)。
+            - 使用线程池并行写入和读取 shard ，吞吐量可以随磁盘带宽增长。
+            - index.json 中记录 skeleton 、每个 tensor 所在的 shard 和每个 shard 的 sha256 。
+            - 读取时只打开需要的 shard ，例如只加载 model 时不会读取只包含 optimizer 的 shard 。
+            - 写入临时文件夹，完成后替换。
+
+    delta: 只保存相对于 base 变化的 tensor 。例如 LoRA 训练只有 adapter 和 optimizer 的 state 在变化。
+        - 文件为 safetensors 格式，metadata 中额外记录所有 tensor 的 sha256 和 base 的相对路径。
+        - 与 base 的 sha256 一致的 tensor 不写入，加载时沿着 base 链查找。使用 read_checkpoint/load_checkpoint 正常加载。
+        - 链的长度超过 max_chain_length 时自动写入完整的 checkpoint 。也可以使用 compact_delta_checkpoint 手动合并。
+        - base 链上的文件被删除后无法加载，清理旧 checkpoint 前需要先合并。
 """
 
 import torch
 
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import copy
+import hashlib
+import json
+import os
 from pathlib import Path
+import shutil
 
+_SAFETENSORS_SUFFIX = '.safetensors'
+_SHARDED_INDEX_NAME = 'index.json'
 
-def save_checkpoint(path_to_save: str, model: torch.nn.Module, optimizer: torch.optim, scheduler=None):
-    """保存需要继续训练的相关状态。"""
-    # 自动处理路径文件夹情况。
-    file_path = Path(path_to_save)
-    file_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # 对于scheduler的额外处理。
-    if scheduler is not None:
-        torch.save({
-            'model': model.state_dict(),
-            'optimizer': optimizer.state_dict(),
-            'scheduler': scheduler.state_dict(),
-        }, file_path)
-    else:
-        torch.save({
-            'model': model.state_dict(),
-            'optimizer': optimizer.state_dict(),
-        }, file_path)
+def save_checkpoint(path_to_save: str, model: torch.nn.Module, optimizer: torch.optim, scheduler=None, async_writer=None,
+                    checkpoint_format: str = None, delta_base: str = None):
+    """
+    保存需要继续训练的相关状态。
+
+    checkpoint_format 为 'torch' 、 'safetensors' 、 'sharded' 或 'delta' 。默认为 'torch' 。
+        - sharded: path_to_save 为文件夹。
+        - delta: 只保存相对于 delta_base 变化的 tensor 。没有 delta_base 时保存完整的 checkpoint ，作为之后的 base 。
+    指定 async_writer (AsyncCheckpointWriter) 时在后台写入，立即返回。
+        checkpoint_format 默认使用 writer 的格式。不支持 delta ，因为 keep_last_k 可能删除 base 链上的文件。
+    """
+    if async_writer is not None:
+        if checkpoint_format == 'delta' or delta_base is not None:
+            raise ValueError("delta checkpoint is not supported with async_writer.")
+        async_writer.save(path_to_save, model=model, optimizer=optimizer, scheduler=scheduler,
+                          checkpoint_format=checkpoint_format)
+        return
+    if checkpoint_format is None:
+        checkpoint_format = 'torch'
+    state = get_training_state(model, optimizer, scheduler)
+    if checkpoint_format == 'delta':
+        write_delta_checkpoint(state, path_to_save, delta_base=delta_base)
+        return
+    write_checkpoint(state, path_to_save, checkpoint_format=checkpoint_format)
 
 
-def load_checkpoint(path_to_checkpoint: str, model: torch.nn.Module, optimizer: torch.optim, scheduler=None):
-    """加载需要继续训练的相关状态。"""
-    checkpoint = torch.load(path_to_checkpoint)
+def load_checkpoint(path_to_checkpoint: str, model: torch.nn.Module, optimizer: torch.optim = None, scheduler=None,
+                    map_location=None, checkpoint_format: str = None):
+    """
+    加载需要继续训练的相关状态。
+
+    只传入 model 时只加载 model ，用于推理，不会读取 optimizer 和 scheduler 的 tensor 。
+    map_location 与 torch.load 一致，safetensors 格式只支持 device 。
+    checkpoint_format 默认由 detect_checkpoint_format 根据文件内容判断，与文件名无关。
+    """
+    keys = ['model']
+    if optimizer is not None:
+        keys.append('optimizer')
+    if scheduler is not None:
+        keys.append('scheduler')
+    checkpoint = read_checkpoint(path_to_checkpoint, keys=keys, map_location=map_location,
+                                 checkpoint_format=checkpoint_format)
     model.load_state_dict(checkpoint['model'])
+    if optimizer is None:
+        return model
     optimizer.load_state_dict(checkpoint['optimizer'])
     # 对于scheduler的额外处理。
     if scheduler is not None:
@@ -52,5 +110,440 @@ def load_checkpoint(path_to_checkpoint: str, model: torch.nn.Module, optimizer:
         return model, optimizer
 
 
+def get_training_state(model: torch.nn.Module, optimizer: torch.optim, scheduler=None) -> dict:
+    """save_checkpoint 保存的结构。"""
+    state = {
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+    }
+    # 对于scheduler的额外处理。
+    if scheduler is not None:
+        state['scheduler'] = scheduler.state_dict()
+    return state
+
+
+def write_checkpoint(state: dict, path_to_save: str, checkpoint_format: str = 'torch'):
+    """写入临时文件，完成后 os.replace 。"""
+    if checkpoint_format == 'sharded':
+        write_sharded_checkpoint(state, path_to_save)
+        return
+    # 自动处理路径文件夹情况。
+    file_path = Path(path_to_save)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f'.{file_path.name}.tmp')
+    if checkpoint_format == 'torch':
+        torch.save(state, tmp_path)
+    elif checkpoint_format == 'safetensors':
+        from safetensors.torch import save_file
+        tensors = {}
+        skeleton = _to_skeleton(state, key_path='', tensors=tensors, seen_views={}, seen_storages=set())
+        save_file(tensors, tmp_path, metadata={'skeleton': json.dumps(skeleton)})
+    else:
+        raise ValueError(f"unknown checkpoint_format: {checkpoint_format}")
+    os.replace(tmp_path, file_path)
+
+
+def read_checkpoint(path_to_checkpoint: str, keys=None, map_location=None, checkpoint_format: str = None) -> dict:
+    """
+    读取 checkpoint 。
+
+    keys 为需要读取的顶层 key ，例如 ['model'] 。默认全部读取。
+    """
+    if checkpoint_format is None:
+        checkpoint_format = detect_checkpoint_format(path_to_checkpoint)
+    if checkpoint_format == 'sharded':
+        return read_sharded_checkpoint(path_to_checkpoint, keys=keys, map_location=map_location)
+    if checkpoint_format == 'torch':
+        # mmap: 不需要一次性读入整个文件。 weights_only: 不执行任意的 pickle 。
+        checkpoint = torch.load(path_to_checkpoint, map_location=map_location, mmap=True, weights_only=True)
+        return checkpoint if keys is None else {key: checkpoint[key] for key in keys}
+    if checkpoint_format == 'safetensors':
+        from safetensors import safe_open
+        device = 'cpu' if map_location is None else str(map_location)
+        with ExitStack() as stack:
+            # delta checkpoint 沿着 base 链依次打开，tensor 从最新的文件开始查找。
+            handles = []
+            file_path = Path(path_to_checkpoint)
+            visited_paths = set()
+            while True:
+                real_path = os.path.realpath(file_path)
+                if real_path in visited_paths:
+                    raise ValueError(f"delta base chain of {path_to_checkpoint} has a cycle at {file_path}")
+                visited_paths.add(real_path)
+                f = stack.enter_context(safe_open(file_path, framework='pt', device=device))
+                handles.append((f, set(f.keys())))
+                delta_base = f.metadata().get('delta_base')
+                if delta_base is None:
+                    break
+                file_path = file_path.parent / delta_base
+
+            def get_tensor(tensor_key):
+                for handle, handle_keys in handles:
+                    if tensor_key in handle_keys:
+                        return handle.get_tensor(tensor_key)
+                raise KeyError(f"tensor {tensor_key} not found in {path_to_checkpoint} or its delta bases")
+
+            skeleton = json.loads(handles[0][0].metadata()['skeleton'])
+            if keys is not None:
+                skeleton = {key: skeleton[key] for key in keys}
+            return _from_skeleton(skeleton, get_tensor=get_tensor)
+    raise ValueError(f"unknown checkpoint_format: {checkpoint_format}")
+
+
+def detect_checkpoint_format(path_to_checkpoint: str) -> str:
+    """
+    由文件内容判断格式，与文件名无关。例如以 .pt 命名的 safetensors 或 delta checkpoint 也可以正确加载。
+
+    - 包含 index.json 的文件夹: sharded 。
+    - 以 8 字节的 header 长度和 json 的 header 开头: safetensors (包括 delta)。
+    - 其他: torch 。
+    """
+    path = Path(path_to_checkpoint)
+    if (path / _SHARDED_INDEX_NAME).exists():
+        return 'sharded'
+    with open(path, 'rb') as f:
+        prefix = f.read(9)
+    if len(prefix) == 9 and prefix[8:9] == b'{':
+        header_size = int.from_bytes(prefix[:8], 'little')
+        if header_size <= path.stat().st_size - 8:
+            return 'safetensors'
+    return 'torch'
+
+
+def write_delta_checkpoint(state: dict, path_to_save: str, delta_base: str = None, max_chain_length: int = 8):
+    """
+    写入 delta checkpoint 。只写入与 delta_base 的 sha256 不一致的 tensor 。
+
+    delta_base 为 None 或者链的长度将超过 max_chain_length 时，写入完整的 checkpoint 。
+    delta_base 或其 base 链上的文件与 path_to_save 相同时抛出 ValueError ，否则会覆盖 base 并形成循环。
+    """
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+
+    file_path = Path(path_to_save)
+    if delta_base is not None and os.path.realpath(file_path) in _get_delta_chain_real_paths(delta_base):
+        raise ValueError(f"delta_base {delta_base} or its base chain contains path_to_save {path_to_save}")
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tensors = {}
+    skeleton = _to_skeleton(state, key_path='', tensors=tensors, seen_views={}, seen_storages=set())
+    tensor_hashes = {tensor_key: _get_tensor_sha256(tensor) for tensor_key, tensor in tensors.items()}
+    metadata = {'skeleton': json.dumps(skeleton), 'tensor_hashes': json.dumps(tensor_hashes)}
+    if delta_base is not None:
+        with safe_open(delta_base, framework='pt') as f:
+            base_metadata = f.metadata()
+            chain_length = int(base_metadata.get('chain_length', 0)) + 1
+            if 'tensor_hashes' in base_metadata:
+                base_hashes = json.loads(base_metadata['tensor_hashes'])
+            else:
+                # 普通的 safetensors checkpoint 作为 base 时，读取并计算 sha256 。
+                base_hashes = {tensor_key: _get_tensor_sha256(f.get_tensor(tensor_key)) for tensor_key in f.keys()}
+        if chain_length <= max_chain_length:
+            tensors = {
+                tensor_key: tensor for tensor_key, tensor in tensors.items()
+                if base_hashes.get(tensor_key) != tensor_hashes[tensor_key]
+            }
+            metadata['delta_base'] = os.path.relpath(delta_base, file_path.parent)
+            metadata['chain_length'] = str(chain_length)
+    tmp_path = file_path.with_name(f'.{file_path.name}.tmp')
+    save_file(tensors, tmp_path, metadata=metadata)
+    os.replace(tmp_path, file_path)
+
+
+def _get_delta_chain_real_paths(path_to_checkpoint: str) -> set:
+    """delta checkpoint 和其 base 链上所有文件的 realpath 。只读取 metadata 。"""
+    from safetensors import safe_open
+
+    real_paths = set()
+    file_path = Path(path_to_checkpoint)
+    while True:
+        real_path = os.path.realpath(file_path)
+        if real_path in real_paths:
+            raise ValueError(f"delta base chain of {path_to_checkpoint} has a cycle at {file_path}")
+        real_paths.add(real_path)
+        with safe_open(file_path, framework='pt') as f:
+            delta_base = f.metadata().get('delta_base')
+        if delta_base is None:
+            return real_paths
+        file_path = file_path.parent / delta_base
+
+
+def compact_delta_checkpoint(path_to_checkpoint: str, path_to_save: str):
+    """将 delta checkpoint 与其 base 链合并为完整的 checkpoint 。可以作为之后的 delta_base 。"""
+    write_delta_checkpoint(read_checkpoint(path_to_checkpoint, checkpoint_format='safetensors'), path_to_save)
+
+
+def _get_tensor_sha256(tensor: torch.Tensor) -> str:
+    """包括 dtype 和 shape 的 sha256 。"""
+    sha256 = hashlib.sha256(f'{tensor.dtype}{tuple(tensor.shape)}'.encode('utf-8'))
+    sha256.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+    return sha256.hexdigest()
+
+
+def write_sharded_checkpoint(state: dict, path_to_save: str, max_shard_size: int = 2 ** 30, num_workers: int = 8):
+    """
+    写入 sharded 格式的 checkpoint 。
+
+    path_to_save 为文件夹。先写入同级的临时文件夹，完成后替换，已有的同名文件夹会被删除。
+    """
+    from safetensors.torch import save as save_to_bytes
+
+    dir_path = Path(path_to_save)
+    dir_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir_path = dir_path.with_name(f'.{dir_path.name}.tmp')
+    shutil.rmtree(tmp_dir_path, ignore_errors=True)
+    tmp_dir_path.mkdir()
+
+    tensors = {}
+    skeleton = _to_skeleton(state, key_path='', tensors=tensors, seen_views={}, seen_storages=set())
+    shards = _split_into_shards(tensors, max_shard_size=max_shard_size)
+    shard_names = [f'shard-{index + 1:05d}-of-{len(shards):05d}{_SAFETENSORS_SUFFIX}' for index in range(len(shards))]
+
+    def write_shard(shard_name, shard_tensors):
+        # 序列化为 bytes ，一次完成 sha256 和写入，不需要再读取文件。
+        shard_bytes = save_to_bytes(shard_tensors)
+        (tmp_dir_path / shard_name).write_bytes(shard_bytes)
+        return {'sha256': hashlib.sha256(shard_bytes).hexdigest(), 'size': len(shard_bytes)}
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        shard_infos = list(executor.map(write_shard, shard_names, shards))
+    index = {
+        'skeleton': skeleton,
+        'weight_map': {key: shard_name for shard_name, shard in zip(shard_names, shards) for key in shard},
+        'shards': dict(zip(shard_names, shard_infos)),
+    }
+    (tmp_dir_path / _SHARDED_INDEX_NAME).write_text(json.dumps(index), encoding='utf-8')
+
+    # 文件夹不能直接 os.replace 到非空文件夹，先移走旧的。
+    old_dir_path = dir_path.with_name(f'.{dir_path.name}.old')
+    if dir_path.exists():
+        shutil.rmtree(old_dir_path, ignore_errors=True)
+        os.replace(dir_path, old_dir_path)
+    os.replace(tmp_dir_path, dir_path)
+    shutil.rmtree(old_dir_path, ignore_errors=True)
+
+
+def read_sharded_checkpoint(path_to_checkpoint: str, keys=None, map_location=None, num_workers: int = 8,
+                            verify: bool = True) -> dict:
+    """
+    读取 sharded 格式的 checkpoint 。只打开 keys 需要的 shard ，并行读取。
+
+    verify 为 True 时检查每个需要的 shard 的 sha256 ，不一致时抛出 ValueError 。
+    """
+    from safetensors import safe_open
+
+    dir_path = Path(path_to_checkpoint)
+    index = json.loads((dir_path / _SHARDED_INDEX_NAME).read_text(encoding='utf-8'))
+    skeleton = index['skeleton']
+    if keys is not None:
+        skeleton = {key: skeleton[key] for key in keys}
+    needed_tensor_keys = _get_tensor_keys(skeleton)
+    tensor_keys_by_shard = {}
+    for tensor_key in needed_tensor_keys:
+        tensor_keys_by_shard.setdefault(index['weight_map'][tensor_key], []).append(tensor_key)
+    device = 'cpu' if map_location is None else str(map_location)
+
+    def read_shard(shard_name):
+        shard_path = dir_path / shard_name
+        if verify:
+            sha256 = hashlib.sha256()
+            with open(shard_path, 'rb') as f:
+                while chunk := f.read(1 << 24):
+                    sha256.update(chunk)
+            if sha256.hexdigest() != index['shards'][shard_name]['sha256']:
+                raise ValueError(f"sha256 mismatch for shard {shard_path}")
+        with safe_open(shard_path, framework='pt', device=device) as f:
+            return {tensor_key: f.get_tensor(tensor_key) for tensor_key in tensor_keys_by_shard[shard_name]}
+
+    tensors = {}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for shard_tensors in executor.map(read_shard, tensor_keys_by_shard):
+            tensors.update(shard_tensors)
+    return _from_skeleton(skeleton, get_tensor=tensors.__getitem__)
+
+
+def _split_into_shards(tensors: dict, max_shard_size: int) -> list:
+    """按照顺序装入 shard 。单个超过 max_shard_size 的 tensor 独占一个 shard 。"""
+    shards = [{}]
+    shard_size = 0
+    for key, tensor in tensors.items():
+        tensor_size = tensor.numel() * tensor.element_size()
+        if shards[-1] and shard_size + tensor_size > max_shard_size:
+            shards.append({})
+            shard_size = 0
+        shards[-1][key] = tensor
+        shard_size += tensor_size
+    return shards
+
+
+def _get_tensor_keys(skeleton) -> set:
+    """skeleton 中引用的 tensor 的 key 。"""
+    tensor_keys = set()
+    _from_skeleton(skeleton, get_tensor=tensor_keys.add)
+    return tensor_keys
+
+
+def _to_skeleton(obj, key_path: str, tensors: dict, seen_views: dict, seen_storages: set):
+    """
+    将嵌套结构中的 tensor 放入 tensors ，返回可以 json 序列化的结构。
+
+    - tensor: {'__tensor__': key} 。与已有 tensor 完全相同的视图时复用 key ，部分共享存储时复制一份。
+    - tuple: {'__tuple__': [...]} 。
+    - key 不全是 str 的 dict: {'__items__': [[key, value], ...]} 。例如 optimizer 的 state 。
+    """
+    if isinstance(obj, torch.Tensor):
+        tensor = obj.detach()
+        storage_ptr = tensor.untyped_storage().data_ptr()
+        view_key = (storage_ptr, tensor.storage_offset(), tuple(tensor.shape), tuple(tensor.stride()), tensor.dtype)
+        if tensor.numel() > 0 and view_key in seen_views:
+            return {'__tensor__': seen_views[view_key]}
+        if tensor.numel() > 0 and storage_ptr in seen_storages:
+            tensor = tensor.clone()
+        tensors[key_path] = tensor.contiguous()
+        if tensor.numel() > 0:
+            seen_views[view_key] = key_path
+            seen_storages.add(storage_ptr)
+        return {'__tensor__': key_path}
+    if isinstance(obj, dict):
+        items = [
+            [key, _to_skeleton(value, f'{key_path}/{key}'.lstrip('/'), tensors, seen_views, seen_storages)]
+            for key, value in obj.items()
+        ]
+        if all(isinstance(key, str) for key in obj):
+            return dict(items)
+        return {'__items__': items}
+    if isinstance(obj, (list, tuple)):
+        values = [
+            _to_skeleton(value, f'{key_path}/{index}', tensors, seen_views, seen_storages)
+            for index, value in enumerate(obj)
+        ]
+        return {'__tuple__': values} if isinstance(obj, tuple) else values
+    return obj
+
+
+def _from_skeleton(skeleton, get_tensor):
+    if isinstance(skeleton, dict):
+        if '__tensor__' in skeleton:
+            return get_tensor(skeleton['__tensor__'])
+        if '__tuple__' in skeleton:
+            return tuple(_from_skeleton(value, get_tensor) for value in skeleton['__tuple__'])
+        if '__items__' in skeleton:
+            return {key: _from_skeleton(value, get_tensor) for key, value in skeleton['__items__']}
+        return {key: _from_skeleton(value, get_tensor) for key, value in skeleton.items()}
+    if isinstance(skeleton, list):
+        return [_from_skeleton(value, get_tensor) for value in skeleton]
+    return skeleton
+
+
+class AsyncCheckpointWriter:
+    """
+    在后台线程中保存 checkpoint 。
+
+    主要方法:
+        - save: 快照当前状态并提交后台写入，立即返回。
+        - wait: 等待所有写入完成。写入失败时抛出异常。
+        - close: 等待写入完成并关闭后台线程。也可以使用 with 。
+
+    注意:
+        - 训练结束或者退出前需要调用 wait 或 close ，否则最后一个 checkpoint 可能没有写完。
+        - keep_last_k 只管理由该 writer 写入的 checkpoint 。
+    """
+    def __init__(self, keep_last_k: int | None = None, use_pinned_memory: bool = True, checkpoint_format: str = 'torch'):
+        """
+        Args:
+            keep_last_k (int, optional): 保留的 checkpoint 数量。默认全部保留。
+            use_pinned_memory (bool): GPU 上的 tensor 是否复制到 pinned memory 。只在 cuda 可用时生效。
+            checkpoint_format (str): 'torch' 、 'safetensors' 或 'sharded' 。
+        """
+        self._keep_last_k = keep_last_k
+        self._checkpoint_format = checkpoint_format
+        self._use_pinned_memory = use_pinned_memory and torch.cuda.is_available()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+        self._future = None
+        self._saved_paths = deque()
+        # 以 state_dict 中的位置为 key 复用的 CPU 缓冲区。
+        self._buffers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def save(self, path_to_save: str, model: torch.nn.Module, optimizer: torch.optim, scheduler=None,
+             checkpoint_format: str = None):
+        """
+        快照当前状态并提交后台写入。格式与 save_checkpoint 一致，可以直接使用 load_checkpoint 加载。
+
+        checkpoint_format 默认使用 writer 的格式。
+        """
+        if checkpoint_format is None:
+            checkpoint_format = self._checkpoint_format
+        if checkpoint_format not in ('torch', 'safetensors', 'sharded'):
+            raise ValueError(f"unsupported checkpoint_format for AsyncCheckpointWriter: {checkpoint_format}")
+        # 缓冲区在上一次写入完成之后才能复用。
+        self.wait()
+        snapshot = self._snapshot(get_training_state(model, optimizer, scheduler), key_path=())
+        copy_done_event = None
+        if self._use_pinned_memory:
+            # GPU 到 pinned memory 的复制是异步的，在后台线程中等待完成，训练线程不阻塞。
+            copy_done_event = torch.cuda.Event()
+            copy_done_event.record()
+        self._future = self._executor.submit(self._write, snapshot, Path(path_to_save), checkpoint_format,
+                                             copy_done_event)
+
+    def wait(self):
+        """等待写入完成。"""
+        if self._future is not None:
+            future, self._future = self._future, None
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _snapshot(self, obj, key_path):
+        """递归复制 dict/list/tuple 中的 tensor ，其他值原样保留。保留 state_dict 的 _metadata 。"""
+        if isinstance(obj, torch.Tensor):
+            return self._copy_tensor(obj, key_path)
+        if isinstance(obj, dict):
+            snapshot = OrderedDict(
+                (key, self._snapshot(value, key_path + (key,))) for key, value in obj.items()
+            )
+            metadata = getattr(obj, '_metadata', None)
+            if metadata is not None:
+                # 各个 module 的版本，load_state_dict 时用于兼容旧的 state_dict 。
+                snapshot._metadata = copy.deepcopy(metadata)
+            return snapshot
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(value, key_path + (index,)) for index, value in enumerate(obj))
+        return obj
+
+    def _copy_tensor(self, tensor, key_path):
+        tensor = tensor.detach()
+        buffer = self._buffers.get(key_path)
+        if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+            pin_memory = self._use_pinned_memory and tensor.is_cuda
+            buffer = torch.empty(tensor.shape, dtype=tensor.dtype, device='cpu', pin_memory=pin_memory)
+            self._buffers[key_path] = buffer
+        buffer.copy_(tensor, non_blocking=buffer.is_pinned())
+        return buffer
+
+    def _write(self, snapshot, file_path, checkpoint_format, copy_done_event):
+        if copy_done_event is not None:
+            copy_done_event.synchronize()
+        write_checkpoint(snapshot, file_path, checkpoint_format=checkpoint_format)
+        if file_path in self._saved_paths:
+            self._saved_paths.remove(file_path)
+        self._saved_paths.append(file_path)
+        while self._keep_last_k is not None and len(self._saved_paths) > self._keep_last_k:
+            old_path = self._saved_paths.popleft()
+            if old_path.is_dir():
+                shutil.rmtree(old_path, ignore_errors=True)
+            else:
+                old_path.unlink(missing_ok=True)
+
+
 if __name__ == '__main__':
     pass
@@ -1,3 +1,27 @@
+"""
+Sources:
+
+References:
+    https://github.com/Dao-AILab/flash-attention (flash_attn_varlen_func 的 cu_seqlens)
+    https://pytorch.org/docs/stable/data.html#torch.utils.data.Sampler
+
+Synopsis:
+    获得原本序列的长度，以及 padded 和 packed 表示的互相转换。
+
+Notes:
+    最初的方法只处理单个序列，并且使用 .item() 返回 python 数值。这里的 batch 方法:
+        - 一次向量化操作得到整个 batch 的长度，不逐个样本调用 .item() ，不同步 cuda 。
+        - padded <-> packed: packed 为 (total_tokens, ...) ，由 cu_seqlens (batch_size + 1,) 记录每个序列的起点，
+            与 flash-attention 的 varlen 接口一致。packed 中没有 padding ，计算量只取决于有效 token 数。
+        - LengthBucketSampler: 在随机打乱后的桶内按长度排序再分 batch ，同一 batch 的长度接近，padding 减少。
+
+    约定:
+        - batch_first=True 时为 (batch_size, max_length, ...) ，否则为 (max_length, batch_size, ...) 。
+        - 按照 padding_value 计算长度时，padding 只出现在序列末尾，长度为非 padding 的位置数。
+            多于 2 维时，某个位置的所有特征都等于 padding_value 才视为 padding 。
+        - 布尔索引和 max_seqlen 需要知道输出的大小，每个 batch 会同步一次。
+"""
+
 import torch
 
 
@@ -12,5 +36,204 @@ def get_sequence_length_from_num_faces_vector(sequence: torch.Tensor, padding_va
     return (sequence != padding_value).sum().item()
 
 
+def get_batch_sequence_lengths(
+    sequences: torch.Tensor = None,
+    sequence_mask: torch.Tensor = None,
+    padding_value=0,
+    batch_first: bool = True,
+) -> torch.Tensor:
+    """
+    获得 padded batch 中每个序列原本的长度。
+
+    Args:
+        sequences (torch.Tensor, optional): padded batch 。没有 sequence_mask 时按照 padding_value 计算。
+        sequence_mask (torch.Tensor, optional): (batch_size, max_length) 的 mask ，有效位置为 True 或 1 。
+        padding_value: padding 的值。
+        batch_first (bool): 第一维是否为 batch 。
+
+    Returns:
+        torch.Tensor: (batch_size,) 的 int64 长度，与输入在同一个 device 。
+    """
+    if sequence_mask is None:
+        if sequences is None:
+            raise ValueError("Either sequences or sequence_mask must be given.")
+        sequence_mask = sequences != padding_value
+        if sequence_mask.dim() > 2:
+            sequence_mask = sequence_mask.flatten(start_dim=2).any(dim=2)
+    return sequence_mask.sum(dim=1 if batch_first else 0, dtype=torch.int64)
+
+
+def get_cu_seqlens(lengths: torch.Tensor) -> torch.Tensor:
+    """由长度获得 cu_seqlens ，(batch_size + 1,) 的 int32 ，第一个元素为 0 。"""
+    return torch.nn.functional.pad(lengths.cumsum(dim=0, dtype=torch.int32), (1, 0))
+
+
+def padded_to_packed(
+    sequences: torch.Tensor,
+    lengths: torch.Tensor,
+    batch_first: bool = True,
+):
+    """
+    将 padded batch 转换为 packed 表示。
+
+    Args:
+        sequences (torch.Tensor): padded batch 。
+        lengths (torch.Tensor): (batch_size,) 的长度，例如 get_batch_sequence_lengths 的结果。
+        batch_first (bool): 第一维是否为 batch 。
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor, int]:
+            - packed: (total_tokens, ...) ，按照样本顺序拼接的有效 token 。
+            - cu_seqlens: (batch_size + 1,) 的 int32 。
+            - max_seqlen: 最大长度。
+    """
+    if not batch_first:
+        sequences = sequences.transpose(0, 1)
+    lengths = lengths.to(sequences.device)
+    positions = torch.arange(sequences.size(1), device=sequences.device)
+    packed = sequences[positions.unsqueeze(0) < lengths.unsqueeze(1)]
+    max_seqlen = int(lengths.max()) if lengths.numel() else 0
+    return packed, get_cu_seqlens(lengths), max_seqlen
+
+
+def packed_to_padded(
+    packed: torch.Tensor,
+    cu_seqlens: torch.Tensor,
+    max_seqlen: int = None,
+    padding_value=0,
+    batch_first: bool = True,
+) -> torch.Tensor:
+    """
+    将 packed 表示转换为 padded batch 。padded_to_packed 的逆操作。
+
+    Args:
+        packed (torch.Tensor): (total_tokens, ...) 。
+        cu_seqlens (torch.Tensor): (batch_size + 1,) 。
+        max_seqlen (int, optional): 输出的长度。不指定时使用最大长度，需要同步一次。
+        padding_value: padding 的值。
+        batch_first (bool): 输出的第一维是否为 batch 。
+
+    Returns:
+        torch.Tensor: padded batch 。
+    """
+    cu_seqlens = cu_seqlens.to(device=packed.device, dtype=torch.int64)
+    lengths = cu_seqlens[1:] - cu_seqlens[:-1]
+    if max_seqlen is None:
+        max_seqlen = int(lengths.max()) if lengths.numel() else 0
+    batch_size = lengths.numel()
+    # 每个 token 所在的样本和在样本中的位置。
+    batch_indices = torch.repeat_interleave(
+        torch.arange(batch_size, device=packed.device), lengths, output_size=packed.size(0)
+    )
+    positions = torch.arange(packed.size(0), device=packed.device) - cu_seqlens[batch_indices]
+    padded = packed.new_full((batch_size, max_seqlen, *packed.shape[1:]), padding_value)
+    padded[batch_indices, positions] = packed
+    return padded if batch_first else padded.transpose(0, 1)
+
+
+class LengthBucketSampler(torch.utils.data.Sampler):
+    """
+    按长度分桶的 batch-sampler 。用作 DataLoader 的 batch_sampler 。
+
+    每个 epoch:
+        - 随机打乱所有样本，每 batch_size * num_batches_per_bucket 个样本为一个桶。
+        - 桶内按照长度排序后切分为 batch ，再随机打乱 batch 的顺序。
+    桶越大，batch 内的长度越接近，随机性越低。
+
+    使用:
+        ```python
+        sampler = LengthBucketSampler(lengths, batch_size=32, seed=0)
+        data_loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn)
+        for epoch in range(num_epochs):
+            sampler.set_epoch(epoch)
+            ...
+        ```
+    """
+    def __init__(
+        self,
+        lengths,
+        batch_size: int,
+        num_batches_per_bucket: int = 100,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            lengths: 每个样本的长度，list 或 tensor 。需要事先计算，不在迭代时读取 Dataset 。
+            batch_size (int): batch 的样本数。
+            num_batches_per_bucket (int): 每个桶包含的 batch 数。
+            shuffle (bool): 是否打乱。为 False 时整个数据集按长度排序，顺序固定。
+            drop_last (bool): 是否丢弃最后不足 batch_size 的 batch 。
+            seed (int): 随机种子，与 set_epoch 的 epoch 一起决定顺序。
+        """
+        super().__init__()
+        self._lengths = torch.as_tensor(lengths, dtype=torch.int64).cpu()
+        self._batch_size = batch_size
+        self._bucket_size = batch_size * num_batches_per_bucket
+        self._shuffle = shuffle
+        self._drop_last = drop_last
+        self._seed = seed
+        self._epoch = 0
+
+    def __len__(self):
+        if self._drop_last:
+            return len(self._lengths) // self._batch_size
+        return (len(self._lengths) + self._batch_size - 1) // self._batch_size
+
+    def __iter__(self):
+        yield from self.get_batches()
+
+    def set_epoch(self, epoch: int):
+        self._epoch = epoch
+
+    def get_batches(self) -> list:
+        """获得当前 epoch 的所有 batch 。每个 batch 为样本下标的 list 。没有样本时为空 list 。"""
+        num_samples = len(self._lengths)
+        if num_samples == 0:
+            return []
+        if not self._shuffle:
+            order = torch.argsort(self._lengths, stable=True)
+            return self._split_into_batches(order)
+        generator = torch.Generator().manual_seed(self._seed + self._epoch)
+        permutation = torch.randperm(num_samples, generator=generator)
+        # 以 (桶, 长度) 为 key 的一次排序，完成所有桶的桶内排序。
+        bucket_indices = torch.arange(num_samples) // self._bucket_size
+        keys = bucket_indices * (int(self._lengths.max()) + 1) + self._lengths[permutation]
+        order = permutation[torch.argsort(keys, stable=True)]
+        batches = self._split_into_batches(order)
+        batch_order = torch.randperm(len(batches), generator=generator).tolist()
+        return [batches[index] for index in batch_order]
+
+    def _split_into_batches(self, order: torch.Tensor) -> list:
+        batches = [batch.tolist() for batch in torch.split(order, self._batch_size)]
+        if self._drop_last and batches and len(batches[-1]) < self._batch_size:
+            batches.pop()
+        return batches
+
+
+def get_padding_ratio(lengths: torch.Tensor, batches: list) -> float:
+    """padding 占 padded batch 的比例。用于比较不同的采样方式。"""
+    lengths = torch.as_tensor(lengths, dtype=torch.int64)
+    batch_lengths = [lengths[batch] for batch in batches]
+    num_valid = sum(int(batch.sum()) for batch in batch_lengths)
+    num_padded = sum(int(batch.max()) * len(batch) for batch in batch_lengths)
+    return 1 - num_valid / num_padded
+
+
 if __name__ == '__main__':
-    pass
+    # 长尾的长度分布下，比较随机 batch 与按长度分桶的 padding 比例。
+    example_lengths = torch.distributions.LogNormal(5., 0.8).sample((20000,)).long().clamp(1, 4096)
+    random_batches = torch.split(torch.randperm(len(example_lengths)), 32)
+    bucket_batches = LengthBucketSampler(example_lengths, batch_size=32).get_batches()
+    print(f"random batches padding: {get_padding_ratio(example_lengths, random_batches):.1%}")
+    print(f"bucketed batches padding: {get_padding_ratio(example_lengths, bucket_batches):.1%}")
+
+    example_sequences = torch.zeros(4, 6, dtype=torch.long)
+    for row, length in enumerate([6, 2, 4, 1]):
+        example_sequences[row, :length] = torch.arange(1, length + 1)
+    example_packed, example_cu_seqlens, example_max_seqlen = padded_to_packed(
+        example_sequences, get_batch_sequence_lengths(example_sequences)
+    )
+    print(example_packed, example_cu_seqlens, example_max_seqlen)
+    assert torch.equal(packed_to_padded(example_packed, example_cu_seqlens, example_max_seqlen), example_sequences)
@@ -0,0 +1,97 @@
+"""
+本地模拟的 BaseChatModel 。
+
+与 FakeOpenAITransport 使用相同的 FakeLLMProfile ，但是不经过 http 层，
+用于单独测量 labeler 自身的开销。输出为 markdown-code-cell 中的 json ，与 YuLabeler 的约定一致。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable
+import json
+import time
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import ConfigDict, Field
+from tests.fixtures.fake_openai_transport import FakeLLMProfile
+
+from typing import TYPE_CHECKING, Any
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+
+class FakeRateLimitError(Exception):
+    """模拟 provider 返回的 429 。"""
+
+
+class FakeServerError(Exception):
+    """模拟 provider 返回的 500 。"""
+
+
+class FakeLabelChatModel(BaseChatModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    response_factory: Callable[[str], dict]
+    profile: FakeLLMProfile = Field(default_factory=FakeLLMProfile)
+    num_requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-label-chat-model'
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        latency, outcome = self.profile.sample()
+        time.sleep(latency)
+        return self._build_chat_result(messages=messages, outcome=outcome)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        latency, outcome = self.profile.sample()
+        await asyncio.sleep(latency)
+        return self._build_chat_result(messages=messages, outcome=outcome)
+
+    def _build_chat_result(
+        self,
+        messages: list[BaseMessage],
+        outcome: str,
+    ) -> ChatResult:
+        self.num_requests += 1
+        if outcome == 'rate_limit':
+            raise FakeRateLimitError('429: rate limit exceeded')
+        if outcome == 'error':
+            raise FakeServerError('500: internal error')
+        if outcome == 'malformed':
+            content = '```json\n{"broken json\n```'
+        else:
+            structured_dict = self.response_factory(messages[-1].content)
+            content = f"```json\n{json.dumps(structured_dict, ensure_ascii=False)}\n```"
+        # 以字符数近似 token 数。
+        prompt_tokens = sum(len(str(message.content)) for message in messages)
+        completion_tokens = len(content)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                'input_tokens': prompt_tokens,
+                'output_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,147 @@
+"""
+本地模拟的 OpenAI 兼容 chat-completions 接口。
+
+使用 httpx.MockTransport 在进程内处理请求，不需要网络和 api_key 。
+根据请求体返回不同形式的结构化结果:
+    - tools: 返回 tool_calls 。instructor 默认的方式。
+    - response_format: 返回 json 字符串。with_structured_output 的方式。
+    - 其他: 返回 markdown-code-cell 中的 json 。YuLabeler 的方式。
+
+通过 FakeLLMProfile 配置延迟分布和故障注入，FakeLabelChatModel 使用同样的配置。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+import httpx
+import json
+import random
+import time
+
+from typing import TYPE_CHECKING, Literal
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+@dataclass
+class FakeLLMProfile:
+    """
+    模拟 LLM 的延迟和故障。
+
+    Attributes:
+        latency_median (float): 延迟的中位数，单位为秒。
+        latency_sigma (float): 对数正态分布的 sigma 。为 0 时延迟固定为 latency_median 。
+        error_rate (float): 返回 500 的概率。
+        malformed_json_rate (float): 返回无法解析的内容的概率。
+        rate_limit_rate (float): 返回 429 的概率。
+        seed (int): 随机数种子。
+    """
+    latency_median: float = 0.
+    latency_sigma: float = 0.
+    error_rate: float = 0.
+    malformed_json_rate: float = 0.
+    rate_limit_rate: float = 0.
+    seed: int = 0
+    _random: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    def sample(self) -> tuple[float, Literal['ok', 'error', 'malformed', 'rate_limit']]:
+        """采样一次请求的延迟和结果。"""
+        latency = self.latency_median * self._random.lognormvariate(0., self.latency_sigma)
+        outcome_random = self._random.random()
+        if outcome_random < self.rate_limit_rate:
+            return latency, 'rate_limit'
+        outcome_random -= self.rate_limit_rate
+        if outcome_random < self.error_rate:
+            return latency, 'error'
+        outcome_random -= self.error_rate
+        if outcome_random < self.malformed_json_rate:
+            return latency, 'malformed'
+        return latency, 'ok'
+
+
+class FakeOpenAITransport:
+    def __init__(
+        self,
+        response_factory: Callable[[str], dict],
+        profile: FakeLLMProfile | None = None,
+    ):
+        """
+        Args:
+            response_factory (Callable[[str], dict]): 由最后一条 user-message 的内容生成结构化结果。
+            profile (FakeLLMProfile, optional): 延迟和故障的配置。默认无延迟、无故障。
+        """
+        self._response_factory = response_factory
+        self._profile = profile or FakeLLMProfile()
+        self.num_requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.num_requests += 1
+        body = json.loads(request.content)
+        latency, outcome = self._profile.sample()
+        await asyncio.sleep(latency)
+        if outcome == 'rate_limit':
+            return httpx.Response(429, json={'error': {'message': 'rate limit exceeded', 'type': 'rate_limit'}})
+        if outcome == 'error':
+            return httpx.Response(500, json={'error': {'message': 'internal error', 'type': 'server_error'}})
+        structured_dict = self._response_factory(body['messages'][-1]['content'])
+        chat_completion = self.build_chat_completion(
+            body=body,
+            structured_dict=structured_dict,
+            content='{"broken json' if outcome == 'malformed' else None,
+        )
+        self.prompt_tokens += chat_completion['usage']['prompt_tokens']
+        self.completion_tokens += chat_completion['usage']['completion_tokens']
+        return httpx.Response(200, json=chat_completion)
+
+    @staticmethod
+    def build_chat_completion(
+        body: dict,
+        structured_dict: dict,
+        content: str | None = None,
+    ) -> dict:
+        if content is not None:
+            message = {'role': 'assistant', 'content': content}
+        elif body.get('tools'):
+            message = {
+                'role': 'assistant',
+                'content': None,
+                'tool_calls': [{
+                    'id': 'call_0',
+                    'type': 'function',
+                    'function': {
+                        'name': body['tools'][0]['function']['name'],
+                        'arguments': json.dumps(structured_dict, ensure_ascii=False),
+                    },
+                }],
+            }
+        elif body.get('response_format'):
+            message = {'role': 'assistant', 'content': json.dumps(structured_dict, ensure_ascii=False)}
+        else:
+            message = {
+                'role': 'assistant',
+                'content': f"```json\n{json.dumps(structured_dict, ensure_ascii=False)}\n```",
+            }
+        # 以字符数近似 token 数。
+        prompt_tokens = sum(len(str(message['content'])) for message in body['messages'])
+        completion_tokens = len(str(message.get('content') or message.get('tool_calls')))
+        return {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
@@ -0,0 +1,153 @@
+"""
+labeler 的基准测试工具。
+
+对一个 labeler 并发标注一组数据，统计:
+    - items/sec
+    - 每条数据标注耗时的 p50 和 p99 (包括 labeler 内部的重试)
+    - 请求数和重试数 (请求数 - 数据数)
+    - prompt 和 completion 的 token 数
+
+请求数和 token 数从 FakeOpenAITransport 或 FakeLabelChatModel 的计数中读取。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, replace
+import time
+
+from typing import TYPE_CHECKING, Protocol
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+    from tests.fixtures.fake_openai_transport import FakeLLMProfile
+
+
+class RequestCounter(Protocol):
+    num_requests: int
+    prompt_tokens: int
+    completion_tokens: int
+
+
+@dataclass
+class LabelerBenchmarkReport:
+    name: str
+    num_items: int
+    num_succeeded: int
+    elapsed: float
+    p50_latency: float
+    p99_latency: float
+    num_requests: int
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def items_per_sec(self) -> float:
+        return self.num_items / self.elapsed
+
+    @property
+    def num_retries(self) -> int:
+        return self.num_requests - self.num_items
+
+    def to_line(self) -> str:
+        return (
+            f"{self.name:<24} items/sec={self.items_per_sec:8.1f} "
+            f"p50={self.p50_latency * 1000:7.1f}ms p99={self.p99_latency * 1000:7.1f}ms "
+            f"succeeded={self.num_succeeded}/{self.num_items} retries={self.num_retries} "
+            f"prompt_tokens={self.prompt_tokens} completion_tokens={self.completion_tokens}"
+        )
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_labeler_benchmark(
+    name: str,
+    label_data: Callable,
+    datas: list[str],
+    counter: RequestCounter,
+) -> LabelerBenchmarkReport:
+    """
+    并发标注所有数据并统计。
+
+    Args:
+        name (str): 报告中的名称。
+        label_data (Callable): labeler 的 label_data 方法。抛出的异常计为失败。
+        datas (list[str]): 需要标注的数据。
+        counter (RequestCounter): 记录请求数和 token 数的模拟服务。
+
+    Returns:
+        LabelerBenchmarkReport: 统计结果。
+    """
+    latencies = []
+
+    async def timed_label_data(data: str):
+        start = time.perf_counter()
+        try:
+            return await label_data(data=data)
+        except Exception:
+            return None
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[timed_label_data(data) for data in datas])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return LabelerBenchmarkReport(
+        name=name,
+        num_items=len(datas),
+        num_succeeded=sum(result is not None for result in results),
+        elapsed=elapsed,
+        p50_latency=get_percentile(latencies, 50),
+        p99_latency=get_percentile(latencies, 99),
+        num_requests=counter.num_requests,
+        prompt_tokens=counter.prompt_tokens,
+        completion_tokens=counter.completion_tokens,
+    )
+
+
+def get_expected_request_counts(
+    profile: FakeLLMProfile,
+    num_items: int,
+    terminal_outcomes: set[str],
+) -> tuple[int, int]:
+    """
+    使用相同的种子重放 profile ，计算期望的请求数和失败数。
+
+    第 k 个请求总是得到第 k 个采样结果，与请求的顺序无关:
+        - 'ok' 和 terminal_outcomes 中的结果结束一条数据。后者计为失败。
+        - 其他结果由 labeler 重试，产生一个新的请求。
+    假设没有数据用尽重试次数。
+
+    Returns:
+        tuple[int, int]: (请求数, 失败数)。
+    """
+    replayed_profile = replace(profile)
+    num_requests = num_finished = num_failed = 0
+    while num_finished < num_items:
+        _, outcome = replayed_profile.sample()
+        num_requests += 1
+        if outcome == 'ok' or outcome in terminal_outcomes:
+            num_finished += 1
+            num_failed += outcome != 'ok'
+    return num_requests, num_failed
+
+
+def run_extractor_benchmark(
+    name: str,
+    extract: Callable[[str], object],
+    raw_strs: Iterable[str],
+) -> str:
+    """
+    同步测量提取工具的吞吐量。
+
+    Returns:
+        str: 一行报告。
+    """
+    raw_strs = list(raw_strs)
+    start = time.perf_counter()
+    num_succeeded = sum(extract(raw_str) is not None for raw_str in raw_strs)
+    elapsed = time.perf_counter() - start
+    return f"{name:<24} items/sec={len(raw_strs) / elapsed:8.1f} succeeded={num_succeeded}/{len(raw_strs)}"
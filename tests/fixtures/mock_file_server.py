@@ -0,0 +1,102 @@
+"""
+本地模拟的 OpenAI 兼容 files 接口。
+
+使用 httpx.MockTransport 在进程内处理请求，OpenAIFileManager 和 AsyncOpenAIFileManager 的测试共用。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import httpx
+import threading
+import time
+
+# if TYPE_CHECKING:
+
+
+class MockFileServer:
+    """
+    模拟 files 接口。
+
+    每个文件名第一次上传时返回 500 ，之后正常返回。记录同时处理中的请求数的最大值。
+    异步的 client 使用 handler ，同步的 client 使用 sync_handler 。
+    """
+    def __init__(self, latency: float = 0.01):
+        self.files: dict[str, dict] = {}
+        self.num_requests = 0
+        self.num_list_requests = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._latency = latency
+        self._seen_filenames: set[str] = set()
+        # 同步的 client 可能在多个线程中使用。
+        self._lock = threading.Lock()
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self._enter()
+        try:
+            await asyncio.sleep(self._latency)
+            return self._handle(request)
+        finally:
+            self._exit()
+
+    def sync_handler(self, request: httpx.Request) -> httpx.Response:
+        self._enter()
+        try:
+            time.sleep(self._latency)
+            with self._lock:
+                return self._handle(request)
+        finally:
+            self._exit()
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.num_requests += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == 'POST' and path.endswith('/files'):
+            content = request.content.decode('utf-8', errors='ignore')
+            filename = content.split('filename="', 1)[1].split('"', 1)[0]
+            if filename not in self._seen_filenames:
+                self._seen_filenames.add(filename)
+                # retry-after-ms 使 client 立即重试。
+                return httpx.Response(500, headers={'retry-after-ms': '1'}, json={'error': {'message': 'internal'}})
+            file_id = f'file-{filename}-{self.num_requests}'
+            self.files[file_id] = {
+                'id': file_id, 'object': 'file', 'bytes': 0, 'created_at': 0,
+                'filename': filename, 'purpose': 'file-extract', 'status': 'processed',
+            }
+            return httpx.Response(200, json=self.files[file_id])
+        if request.method == 'GET' and path.endswith('/files'):
+            return self._list(request)
+        file_id = path.rsplit('/', 1)[-1]
+        if file_id not in self.files:
+            return httpx.Response(404, json={'error': {'message': 'not found'}})
+        if request.method == 'GET':
+            return httpx.Response(200, json=self.files[file_id])
+        if request.method == 'DELETE':
+            del self.files[file_id]
+            return httpx.Response(200, json={'id': file_id, 'object': 'file', 'deleted': True})
+        return httpx.Response(404)
+
+    def _list(self, request: httpx.Request) -> httpx.Response:
+        """按照 after 和 limit 分页，按照 purpose 过滤。"""
+        self.num_list_requests += 1
+        params = request.url.params
+        file_objects = list(self.files.values())
+        if 'purpose' in params:
+            file_objects = [file_object for file_object in file_objects if file_object['purpose'] == params['purpose']]
+        if 'after' in params:
+            file_ids = [file_object['id'] for file_object in file_objects]
+            file_objects = file_objects[file_ids.index(params['after']) + 1:]
+        limit = int(params.get('limit', 10000))
+        return httpx.Response(200, json={
+            'object': 'list', 'data': file_objects[:limit], 'has_more': len(file_objects) > limit,
+        })
@@ -0,0 +1,148 @@
+"""
+labeler 的基准测试。部署 labeler 的改动前作为回归检查。
+
+所有标注器都请求本地模拟的 LLM ，通过 FakeLLMProfile 配置延迟分布和故障注入。
+使用 `pytest -s` 查看每个标注器的 items/sec 、p50/p99 、重试数和 token 数。
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import io
+import json
+import pytest
+
+from _old_or_discarded._llm_methods.llm_labeler.instructor_labeler import InstructorLabeler
+from _old_or_discarded._llm_methods.llm_labeler.with_structured_output_llm_labeler import SimpleLabeler
+from _old_or_discarded._llm_methods.llm_labeler.yu_labeler import YuLabeler
+from _old_or_discarded._llm_methods.llm_output.json_output_extractor import JsonOutputExtractor
+from _old_or_discarded._llm_methods.llm_output.structured_data_extractor import StructuredDataExtractor
+from langchain_core.messages import SystemMessage
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+from tests.fixtures.fake_chat_model import FakeLabelChatModel
+from tests.fixtures.fake_openai_transport import FakeLLMProfile, FakeOpenAITransport
+from tests.fixtures.labeler_benchmark import (
+    get_expected_request_counts,
+    run_extractor_benchmark,
+    run_labeler_benchmark,
+)
+
+# if TYPE_CHECKING:
+
+
+class Label(BaseModel):
+    label: str
+
+
+NUM_ITEMS = 200
+
+PROFILES = {
+    'clean': dict(latency_median=0.01, latency_sigma=0.5),
+    'faulty': dict(
+        latency_median=0.01, latency_sigma=0.5,
+        error_rate=0.02, malformed_json_rate=0.05, rate_limit_rate=0.02,
+    ),
+}
+
+LABELER_NAMES = ['yu-fake-chat-model', 'yu', 'simple', 'instructor']
+
+# 每个标注器不重试、直接计为失败的故障。其他故障由 labeler 、openai 或 instructor 重试。
+TERMINAL_OUTCOMES = {
+    # FakeLabelChatModel 直接抛出 429 和 500 ，YuLabeler 只重试解析失败。
+    'yu-fake-chat-model': {'error', 'rate_limit'},
+    'yu': set(),
+    # json_schema 的解析错误由 openai 抛出，SimpleLabeler 不重试。
+    'simple': {'malformed'},
+    'instructor': set(),
+}
+
+
+def response_factory(data: str) -> dict:
+    return {'label': data.upper()}
+
+
+def build_labeler_and_counter(labeler_name: str, profile: FakeLLMProfile):
+    system_message = SystemMessage(content='label the data.')
+    if labeler_name == 'yu-fake-chat-model':
+        llm = FakeLabelChatModel(response_factory=response_factory, profile=profile)
+        return YuLabeler(llm=llm, schema_pydantic_base_model=Label, system_message=system_message), llm
+    transport = FakeOpenAITransport(response_factory=response_factory, profile=profile)
+    if labeler_name == 'instructor':
+        labeler = InstructorLabeler(
+            base_url='http://fake/v1',
+            api_key='fake',
+            model='fake-model',
+            schema_pydantic_base_model=Label,
+            system_message=system_message,
+            max_concurrency=64,
+            http_client=transport.get_async_client(),
+        )
+        return labeler, transport
+    llm = ChatOpenAI(
+        model='fake-model',
+        base_url='http://fake/v1',
+        api_key='fake',
+        http_async_client=transport.get_async_client(),
+    )
+    if labeler_name == 'simple':
+        return SimpleLabeler(llm=llm, schema_pydantic_base_model=Label, system_message=system_message), transport
+    return YuLabeler(llm=llm, schema_pydantic_base_model=Label, system_message=system_message), transport
+
+
+class TestLabelerBenchmark:
+    @pytest.mark.parametrize('profile_name', list(PROFILES))
+    @pytest.mark.parametrize('labeler_name', LABELER_NAMES)
+    def test_labeler_benchmark(
+        self,
+        labeler_name: str,
+        profile_name: str,
+    ) -> None:
+        profile = FakeLLMProfile(**PROFILES[profile_name])
+        labeler, counter = build_labeler_and_counter(labeler_name=labeler_name, profile=profile)
+        datas = [f'data-{i}' for i in range(NUM_ITEMS)]
+        # 提取工具在失败时会 print ，这里不需要。
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = asyncio.run(run_labeler_benchmark(
+                name=f'{labeler_name}[{profile_name}]',
+                label_data=labeler.label_data,
+                datas=datas,
+                counter=counter,
+            ))
+        print(f"\n{report.to_line()}")
+        if profile_name == 'clean':
+            assert report.num_succeeded == NUM_ITEMS
+            assert report.num_retries == 0
+        else:
+            expected_num_requests, expected_num_failed = get_expected_request_counts(
+                profile=FakeLLMProfile(**PROFILES[profile_name]),
+                num_items=NUM_ITEMS,
+                terminal_outcomes=TERMINAL_OUTCOMES[labeler_name],
+            )
+            assert report.num_retries > 0
+            assert report.num_requests == expected_num_requests
+            assert report.num_succeeded == NUM_ITEMS - expected_num_failed
+
+    def test_extractor_benchmark(self) -> None:
+        raw_strs = [
+            f"分析如下。\n```json\n{json.dumps(response_factory(f'data-{i}'))}\n```" if i % 10 else '```json\n{"broken'
+            for i in range(5000)
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            lines = [
+                run_extractor_benchmark(
+                    name='StructuredDataExtractor',
+                    extract=lambda raw_str: StructuredDataExtractor.extract_structured_data_from_str(
+                        raw_str=raw_str, schema_pydantic_base_model=Label,
+                    ),
+                    raw_strs=raw_strs,
+                ),
+                run_extractor_benchmark(
+                    name='JsonOutputExtractor',
+                    extract=lambda raw_str: JsonOutputExtractor.extract_json_from_str(
+                        raw_str=raw_str, schema_pydantic_base_model=Label,
+                    ),
+                    raw_strs=raw_strs,
+                ),
+            ]
+        print('\n' + '\n'.join(lines))
@@ -0,0 +1,74 @@
+"""
+对 prompt-prefix-caching 友好的 message 构建方法的测试。
+"""
+
+from __future__ import annotations
+
+from _old_or_discarded._llm_methods.llm_input.cached_prefix_message_builder import CachedPrefixMessageBuilder
+from langchain_core.messages import AIMessage, SystemMessage, convert_to_openai_messages
+from pydantic import BaseModel
+import json
+
+# if TYPE_CHECKING:
+
+
+class Label(BaseModel):
+    label: str
+    score: float
+
+
+def build_builder(use_cache_control: bool = False) -> CachedPrefixMessageBuilder:
+    return CachedPrefixMessageBuilder(
+        system_prompt='label the data.',
+        schema_pydantic_base_model=Label,
+        few_shot_examples=[('example', '```json\n{"label": "EXAMPLE", "score": 1}\n```')],
+        use_cache_control=use_cache_control,
+    )
+
+
+class TestCachedPrefixMessageBuilder:
+    def test_prefix_is_byte_stable(
+        self,
+    ) -> None:
+        builder = build_builder()
+        first = convert_to_openai_messages(builder.build_messages(data='a'))
+        second = convert_to_openai_messages(builder.build_messages(data='b'))
+        # 只有最后的 human-message 不同。
+        assert json.dumps(first[:-1]) == json.dumps(second[:-1])
+        assert [message['content'] for message in (first[-1], second[-1])] == ['a', 'b']
+        # 不同的实例也得到相同的前缀。
+        assert json.dumps(convert_to_openai_messages(build_builder().prefix_messages)) == json.dumps(first[:-1])
+        assert isinstance(builder.prefix_messages[0], SystemMessage)
+        assert json.dumps(Label.model_json_schema(), ensure_ascii=False, sort_keys=True) in first[0]['content']
+
+    def test_cache_control_on_last_prefix_message(
+        self,
+    ) -> None:
+        prefix_messages = build_builder(use_cache_control=True).prefix_messages
+        assert prefix_messages[-1].content == [{
+            'type': 'text',
+            'text': '```json\n{"label": "EXAMPLE", "score": 1}\n```',
+            'cache_control': {'type': 'ephemeral'},
+        }]
+        # 其他 message 保持字符串形式。
+        assert all(isinstance(message.content, str) for message in prefix_messages[:-1])
+
+    def test_get_cache_usage(
+        self,
+    ) -> None:
+        usage_metadata_response = AIMessage(content='', usage_metadata={
+            'input_tokens': 100, 'output_tokens': 5, 'total_tokens': 105,
+            'input_token_details': {'cache_read': 80},
+        })
+        assert CachedPrefixMessageBuilder.get_cache_usage(usage_metadata_response) == {
+            'cached_tokens': 80, 'uncached_tokens': 20,
+        }
+        token_usage_response = AIMessage(content='', response_metadata={'token_usage': {
+            'prompt_tokens': 50, 'prompt_tokens_details': {'cached_tokens': 30},
+        }})
+        assert CachedPrefixMessageBuilder.get_cache_usage(token_usage_response) == {
+            'cached_tokens': 30, 'uncached_tokens': 20,
+        }
+        assert CachedPrefixMessageBuilder.get_cache_usage(AIMessage(content='')) == {
+            'cached_tokens': 0, 'uncached_tokens': 0,
+        }
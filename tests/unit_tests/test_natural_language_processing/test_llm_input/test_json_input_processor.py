@@ -0,0 +1,249 @@
+"""
+对结构化数据转换为 markdown-code-cell 的测试。orjson 和标准库 json 两种方式的输出需要一致。
+"""
+
+from __future__ import annotations
+import dataclasses
+import datetime
+import enum
+import io
+import json
+import uuid
+
+from _old_or_discarded._llm_methods.llm_input import json_input_processor
+from _old_or_discarded._llm_methods.llm_input.json_input_processor import JsonInputProcessor
+import pytest
+
+# if TYPE_CHECKING:
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def serializer(request, monkeypatch) -> str:
+    """分别使用 orjson 和标准库 json 。"""
+    if request.param == 'json':
+        monkeypatch.setattr(json_input_processor, 'orjson', None)
+    elif json_input_processor.orjson is None:
+        pytest.skip('orjson is not installed.')
+    return request.param
+
+
+DATA = {'标题': '第1条新闻', 'id': 1, 'score': 0.5, 'tags': ['经济', '科技'], 'extra': None, 'flag': True}
+
+
+class TestPutInMarkdown:
+    def test_pinned_format(
+        self,
+        serializer: str,
+    ) -> None:
+        # 有意使用不转义中文的紧凑格式，NaN 和 Infinity 输出为 null 。修改格式时需要同时修改这里。
+        assert JsonInputProcessor.put_in_markdown(DATA) == (
+            '```json\n'
+            '{"标题":"第1条新闻","id":1,"score":0.5,"tags":["经济","科技"],"extra":null,"flag":true}'
+            '\n```'
+        )
+        assert JsonInputProcessor.put_in_markdown([float('nan'), float('inf'), {'x': -float('inf')}]) == (
+            '```json\n[null,null,{"x":null}]\n```'
+        )
+
+    def test_round_trip(
+        self,
+        serializer: str,
+    ) -> None:
+        result = JsonInputProcessor.put_in_markdown(DATA)
+        assert json.loads(result.removeprefix('```json\n').removesuffix('\n```')) == DATA
+
+    def test_big_int_falls_back_to_json(
+        self,
+    ) -> None:
+        # orjson 不支持超过 64 位的整数。
+        assert JsonInputProcessor._dumps_to_bytes([2**70]) is None
+        assert JsonInputProcessor.put_in_markdown([2**70, float('nan')]) == f'```json\n[{2**70},null]\n```'
+
+    def test_dumps_to_bytes(
+        self,
+        serializer: str,
+    ) -> None:
+        json_bytes = JsonInputProcessor._dumps_to_bytes(DATA)
+        if serializer == 'json':
+            assert json_bytes is None
+        else:
+            assert json_bytes.decode('utf-8') == JsonInputProcessor.get_json_str_from_python_structured_data(DATA)
+
+
+class Color(enum.Enum):
+    RED = 'red'
+
+
+@dataclasses.dataclass
+class Point:
+    x: float
+    created_at: datetime.date
+
+
+class TestNonJsonTypes:
+    DATA = {
+        'datetime': datetime.datetime(2024, 1, 2, 3, 4, 5, 6),
+        'aware': datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc),
+        'date': datetime.date(2024, 1, 2),
+        'uuid': uuid.UUID(int=1),
+        'color': Color.RED,
+        'point': Point(x=float('nan'), created_at=datetime.date(2024, 1, 2)),
+    }
+
+    def test_same_output_for_both_serializers(
+        self,
+        serializer: str,
+    ) -> None:
+        assert JsonInputProcessor.get_json_str_from_python_structured_data(self.DATA) == (
+            '{"datetime":"2024-01-02T03:04:05.000006","aware":"2024-01-02T00:00:00+00:00","date":"2024-01-02",'
+            '"uuid":"00000000-0000-0000-0000-000000000001","color":"red",'
+            '"point":{"x":null,"created_at":"2024-01-02"}}'
+        )
+        stream = io.BytesIO()
+        JsonInputProcessor.write_in_markdown(self.DATA, stream)
+        assert stream.getvalue().decode('utf-8') == JsonInputProcessor.put_in_markdown(self.DATA)
+
+    def test_unsupported_type_raises_for_both_serializers(
+        self,
+        serializer: str,
+    ) -> None:
+        with pytest.raises(TypeError):
+            JsonInputProcessor.put_in_markdown({'value': object()})
+
+
+class TestWriteInMarkdown:
+    @pytest.mark.parametrize('data', [DATA, [DATA, {'nan': float('nan')}], [2**70]])
+    def test_same_as_put_in_markdown(
+        self,
+        serializer: str,
+        data,
+    ) -> None:
+        stream = io.BytesIO()
+        JsonInputProcessor.write_in_markdown(data, stream)
+        assert stream.getvalue().decode('utf-8') == JsonInputProcessor.put_in_markdown(data)
+
+
+class TestSplitInMarkdown:
+    RECORDS = [{'id': i, '正文': '中文' * (i % 7)} for i in range(50)]
+
+    @staticmethod
+    def load_chunks(chunks: list[str]) -> list:
+        records = []
+        for chunk in chunks:
+            records.extend(json.loads(chunk.removeprefix('```json\n').removesuffix('\n```')))
+        return records
+
+    def test_no_budget(
+        self,
+    ) -> None:
+        assert JsonInputProcessor.split_in_markdown(self.RECORDS) == [JsonInputProcessor.put_in_markdown(self.RECORDS)]
+
+    def test_max_bytes(
+        self,
+        serializer: str,
+    ) -> None:
+        chunks = JsonInputProcessor.split_in_markdown(self.RECORDS, max_bytes=200)
+        assert len(chunks) > 1
+        assert all(len(chunk.encode('utf-8')) <= 200 for chunk in chunks)
+        assert self.load_chunks(chunks) == self.RECORDS
+
+    def test_max_tokens(
+        self,
+    ) -> None:
+        chunks = JsonInputProcessor.split_in_markdown(self.RECORDS, max_tokens=100, token_counter=len)
+        assert len(chunks) > 1
+        # 每条 record 的 token 数加上分隔符，再加上格式的近似开销 8 。
+        for chunk in chunks:
+            assert sum(len(JsonInputProcessor.get_json_str_from_python_structured_data(record)) + 1
+                       for record in self.load_chunks([chunk])) + 8 <= 100
+        assert self.load_chunks(chunks) == self.RECORDS
+
+    def test_single_record_over_budget(
+        self,
+    ) -> None:
+        records = [{'id': 0}, {'正文': '很长' * 100}, {'id': 2}]
+        chunks = JsonInputProcessor.split_in_markdown(records, max_bytes=40)
+        assert [self.load_chunks([chunk]) for chunk in chunks] == [[record] for record in records]
+
+
+class TestRecordEncodings:
+    RECORDS = [
+        {'公司': '甲', '年份': 2020, '指标': {'收入': 1.5}},
+        {'公司': '乙, 有限', '年份': None},
+        {'公司': '丙', '备注': 'x'},
+    ]
+
+    def test_columnar(
+        self,
+    ) -> None:
+        assert JsonInputProcessor.put_in_markdown(self.RECORDS, encoding='columnar') == (
+            '```json\n'
+            '{"公司":["甲","乙, 有限","丙"],"年份":[2020,null,null],"指标":[{"收入":1.5},null,null],'
+            '"备注":[null,null,"x"]}'
+            '\n```'
+        )
+
+    def test_minified_keys(
+        self,
+    ) -> None:
+        result = JsonInputProcessor.put_in_markdown(self.RECORDS, encoding='minified_keys')
+        minified_data = json.loads(result.removeprefix('```json\n').removesuffix('\n```'))
+        assert minified_data['keys'] == {'a': '公司', 'b': '年份', 'c': '指标', 'd': '备注'}
+        assert [
+            {minified_data['keys'][key]: value for key, value in record.items()}
+            for record in minified_data['records']
+        ] == self.RECORDS
+
+    def test_csv_and_tsv(
+        self,
+    ) -> None:
+        # null 和缺失的值均为空。
+        assert JsonInputProcessor.put_in_markdown(self.RECORDS, encoding='csv') == (
+            '```csv\n'
+            '公司,年份,指标,备注\n'
+            '甲,2020,"{""收入"":1.5}",\n'
+            '"乙, 有限",,,\n'
+            '丙,,,x'
+            '\n```'
+        )
+        assert JsonInputProcessor.put_in_markdown(self.RECORDS, encoding='tsv') == (
+            '```tsv\n'
+            '公司\t年份\t指标\t备注\n'
+            '甲\t2020\t"{""收入"":1.5}"\t\n'
+            '乙, 有限\t\t\t\n'
+            '丙\t\t\tx'
+            '\n```'
+        )
+
+    def test_short_key(
+        self,
+    ) -> None:
+        assert [JsonInputProcessor._get_short_key(index) for index in (0, 25, 26, 27, 701, 702)] == [
+            'a', 'z', 'aa', 'ab', 'zz', 'aaa',
+        ]
+
+    @pytest.mark.parametrize('encoding', ['columnar', 'csv', 'tsv', 'minified_keys'])
+    @pytest.mark.parametrize('data', [{'a': 1}, [1, 2], [{'a': 1}, 'b']])
+    def test_not_records(
+        self,
+        encoding: str,
+        data,
+    ) -> None:
+        with pytest.raises(ValueError):
+            JsonInputProcessor.put_in_markdown(data, encoding=encoding)
+
+    def test_unknown_encoding(
+        self,
+    ) -> None:
+        with pytest.raises(ValueError):
+            JsonInputProcessor.put_in_markdown(self.RECORDS, encoding='yaml')
+
+    def test_compare_encoding_token_counts(
+        self,
+    ) -> None:
+        token_counts = JsonInputProcessor.compare_encoding_token_counts(self.RECORDS, token_counter=len)
+        assert token_counts == {
+            encoding: len(JsonInputProcessor.put_in_markdown(self.RECORDS, encoding=encoding))
+            for encoding in ('records', 'columnar', 'csv', 'tsv', 'minified_keys')
+        }
+        assert token_counts['csv'] < token_counts['records']
@@ -0,0 +1,78 @@
+"""
+对 prompt-template 批量渲染的测试。
+"""
+
+from __future__ import annotations
+import json
+
+from _old_or_discarded._llm_methods.llm_input.prompt_template_loader import PromptTemplateLoader
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import HumanMessagePromptTemplate, SystemMessagePromptTemplate
+import pytest
+
+# if TYPE_CHECKING:
+
+
+def build_message_prompt_templates() -> list:
+    return [
+        SystemMessagePromptTemplate.from_template(
+            template="你是一个标注助手。{% for rule in rules %}\n- {{ rule }}{% endfor %}",
+            template_format='jinja2',
+        ),
+        HumanMessagePromptTemplate.from_template(template="{{ data }}", template_format='jinja2'),
+    ]
+
+
+RECORDS = [{'id': f'item-{index}', 'rules': ['规则一', f'规则{index}'], 'data': f'数据{index}'} for index in range(50)]
+
+
+class TestRenderMany:
+    def test_pooled_matches_in_process(
+        self,
+    ) -> None:
+        for output_format in ('messages', 'jsonl'):
+            kwargs = dict(output_format=output_format, model='fake-model', chunk_size=7)
+            in_process = list(PromptTemplateLoader.render_many(build_message_prompt_templates(), RECORDS, **kwargs))
+            pooled = list(PromptTemplateLoader.render_many(
+                build_message_prompt_templates(), iter(RECORDS), num_workers=2, **kwargs,
+            ))
+            assert len(in_process) == len(RECORDS)
+            assert pooled == in_process
+        assert in_process[3] == json.dumps({
+            'custom_id': '3',
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {'model': 'fake-model', 'messages': [
+                {'role': 'system', 'content': '你是一个标注助手。\n- 规则一\n- 规则3'},
+                {'role': 'user', 'content': '数据3'},
+            ]},
+        }, ensure_ascii=False)
+
+    def test_jsonl_shape(
+        self,
+    ) -> None:
+        lines = list(PromptTemplateLoader.render_many(
+            build_message_prompt_templates(),
+            RECORDS[:3],
+            output_format='jsonl',
+            model='fake-model',
+            custom_id_key='id',
+        ))
+        request_lines = [json.loads(line) for line in lines]
+        assert all('\n' not in line for line in lines)
+        assert [request_line['custom_id'] for request_line in request_lines] == ['item-0', 'item-1', 'item-2']
+        assert all(request_line['body']['model'] == 'fake-model' for request_line in request_lines)
+        assert [request_line['body']['messages'][-1] for request_line in request_lines] == [
+            {'role': 'user', 'content': f'数据{index}'} for index in range(3)
+        ]
+
+    def test_messages_and_errors(
+        self,
+    ) -> None:
+        messages = next(PromptTemplateLoader.render_many(build_message_prompt_templates(), RECORDS))
+        assert messages[1] == HumanMessage(content='数据0')
+        # jsonl 需要模型名，在调用时检查。
+        with pytest.raises(ValueError):
+            PromptTemplateLoader.render_many(build_message_prompt_templates(), RECORDS, output_format='jsonl')
+        with pytest.raises(KeyError):
+            list(PromptTemplateLoader.render_many(build_message_prompt_templates(), [{'data': 'x'}]))
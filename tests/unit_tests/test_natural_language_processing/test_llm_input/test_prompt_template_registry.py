@@ -0,0 +1,101 @@
+"""
+对 prompt-template 缓存的测试。
+"""
+
+from __future__ import annotations
+import os
+
+from _old_or_discarded._llm_methods.llm_input.prompt_template_registry import PromptTemplateRegistry
+import pytest
+
+# if TYPE_CHECKING:
+
+
+class CountingCompiler:
+    """记录构建次数，返回 (构建次数, 文件内容)。"""
+    def __init__(self):
+        self.num_compiles = 0
+
+    def __call__(self, template_str: str) -> tuple[int, str]:
+        self.num_compiles += 1
+        return self.num_compiles, template_str
+
+
+@pytest.fixture(autouse=True)
+def clear_registry(monkeypatch):
+    monkeypatch.setattr(PromptTemplateRegistry, 'stat_interval', 0.)
+    PromptTemplateRegistry.clear()
+    yield
+    PromptTemplateRegistry.clear()
+
+
+def touch(path, content: str, mtime_ns: int) -> None:
+    path.write_text(content, encoding='utf-8')
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class TestPromptTemplateRegistry:
+    def test_hit_and_miss(
+        self,
+        tmp_path,
+    ) -> None:
+        template_path = tmp_path / 'prompt.j2'
+        touch(template_path, 'hello {{ name }}', mtime_ns=10**18)
+        compiler = CountingCompiler()
+        first = PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler)
+        second = PromptTemplateRegistry.get_or_compile(str(template_path), 'prompt', compiler)
+        assert first is second and first == (1, 'hello {{ name }}')
+        # 同一个文件的不同类型分别缓存。
+        assert PromptTemplateRegistry.get_or_compile(template_path, 'chat', compiler) == (2, 'hello {{ name }}')
+        assert PromptTemplateRegistry.get_stats() == {'hits': 1, 'misses': 2, 'reloads': 0, 'size': 2}
+
+    def test_reload_after_mtime_or_size_change(
+        self,
+        tmp_path,
+    ) -> None:
+        template_path = tmp_path / 'prompt.j2'
+        touch(template_path, 'v1', mtime_ns=10**18)
+        compiler = CountingCompiler()
+        PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler)
+        # 内容和大小不变，只有 mtime 变化。
+        touch(template_path, 'v2', mtime_ns=10**18 + 1)
+        assert PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler) == (2, 'v2')
+        # mtime 不变，只有大小变化。
+        touch(template_path, 'v3-longer', mtime_ns=10**18 + 1)
+        assert PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler) == (3, 'v3-longer')
+        assert PromptTemplateRegistry.get_stats() == {'hits': 0, 'misses': 1, 'reloads': 2, 'size': 1}
+
+    def test_stat_interval_suppresses_checks(
+        self,
+        tmp_path,
+        monkeypatch,
+    ) -> None:
+        template_path = tmp_path / 'prompt.j2'
+        touch(template_path, 'v1', mtime_ns=10**18)
+        compiler = CountingCompiler()
+        PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler)
+        monkeypatch.setattr(PromptTemplateRegistry, 'stat_interval', 3600.)
+        touch(template_path, 'v2-changed', mtime_ns=10**18 + 1)
+        # 间隔内不检查文件，继续使用缓存。
+        assert PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler) == (1, 'v1')
+        monkeypatch.setattr(PromptTemplateRegistry, 'stat_interval', 0.)
+        assert PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler) == (2, 'v2-changed')
+        assert PromptTemplateRegistry.get_stats() == {'hits': 1, 'misses': 1, 'reloads': 1, 'size': 1}
+
+    def test_disabled_and_clear(
+        self,
+        tmp_path,
+        monkeypatch,
+    ) -> None:
+        template_path = tmp_path / 'prompt.j2'
+        touch(template_path, 'v1', mtime_ns=10**18)
+        compiler = CountingCompiler()
+        monkeypatch.setattr(PromptTemplateRegistry, 'enabled', False)
+        PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler)
+        PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler)
+        assert compiler.num_compiles == 2
+        assert PromptTemplateRegistry.get_stats() == {'hits': 0, 'misses': 0, 'reloads': 0, 'size': 0}
+        monkeypatch.setattr(PromptTemplateRegistry, 'enabled', True)
+        PromptTemplateRegistry.get_or_compile(template_path, 'prompt', compiler)
+        PromptTemplateRegistry.clear()
+        assert PromptTemplateRegistry.get_stats() == {'hits': 0, 'misses': 0, 'reloads': 0, 'size': 0}
@@ -0,0 +1,90 @@
+"""
+对 message-prompt-template 安全 format 方法的测试。
+"""
+
+from __future__ import annotations
+import pickle
+
+from _old_or_discarded._llm_methods.llm_input.safe_format_message_prompt_template import (
+    CompiledMessagePromptTemplates,
+    safe_format_message_prompt_template,
+)
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import (
+    AIMessagePromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+import pytest
+
+# if TYPE_CHECKING:
+
+
+def build_message_prompt_templates() -> list:
+    return [
+        SystemMessagePromptTemplate.from_template(
+            template="你是一个标注助手。{% for rule in rules %}\n- {{ rule }}{% endfor %}",
+            template_format='jinja2',
+        ),
+        HumanMessage(content="请标注下面的数据。"),
+        MessagesPlaceholder(variable_name='history'),
+        HumanMessagePromptTemplate.from_template(template="```json\n{{ data }}\n```", template_format='jinja2'),
+        # f-string 格式使用原本的方法。
+        AIMessagePromptTemplate.from_template(template="收到 {data}"),
+    ]
+
+
+FORMAT_KWARGS = {
+    'rules': ['规则一', '规则二'],
+    'data': '{"text": "一段文本"}',
+    'history': [HumanMessage(content='之前的问题'), AIMessage(content='之前的回答')],
+    'unused': '多余的变量忽略',
+}
+
+
+class TestCompiledMessagePromptTemplates:
+    def test_output_matches_langchain(
+        self,
+    ) -> None:
+        message_prompt_templates = build_message_prompt_templates()
+        compiled = CompiledMessagePromptTemplates(message_prompt_templates)
+        expected = safe_format_message_prompt_template(
+            message_prompt_templates=message_prompt_templates,
+            format_kwargs=FORMAT_KWARGS,
+        )
+        assert compiled.format(FORMAT_KWARGS) == expected
+        assert compiled.input_variables == ['data', 'history', 'rules']
+        # MessagesPlaceholder 展开为 history 中的 message 。
+        assert [message.content for message in expected[2:4]] == ['之前的问题', '之前的回答']
+        # 在其他进程中重新编译。
+        assert pickle.loads(pickle.dumps(compiled)).format(FORMAT_KWARGS) == expected
+
+    @pytest.mark.parametrize('missing_variable', ['rules', 'data', 'history'])
+    def test_missing_variable_raises_key_error(
+        self,
+        missing_variable: str,
+    ) -> None:
+        message_prompt_templates = build_message_prompt_templates()
+        format_kwargs = {key: value for key, value in FORMAT_KWARGS.items() if key != missing_variable}
+        with pytest.raises(KeyError):
+            safe_format_message_prompt_template(message_prompt_templates, format_kwargs)
+        with pytest.raises(KeyError, match=missing_variable):
+            CompiledMessagePromptTemplates(message_prompt_templates).format(format_kwargs)
+
+    def test_partial_variables(
+        self,
+    ) -> None:
+        human_message_prompt_template = HumanMessagePromptTemplate.from_template(
+            template="{{ greeting }}, {{ name }}",
+            template_format='jinja2',
+            partial_variables={'greeting': lambda: 'hello'},
+        )
+        compiled = CompiledMessagePromptTemplates([human_message_prompt_template])
+        assert compiled.input_variables == ['name']
+        assert compiled.format({'name': 'yu'}) == [HumanMessage(content='hello, yu')]
+        # 传入的变量优先于 partial 的变量。
+        assert compiled.format({'name': 'yu', 'greeting': 'hi'}) == [HumanMessage(content='hi, yu')]
+        assert compiled.format({'name': 'yu'}) == safe_format_message_prompt_template(
+            [human_message_prompt_template], {'name': 'yu'},
+        )
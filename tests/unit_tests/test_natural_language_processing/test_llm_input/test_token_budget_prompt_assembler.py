@@ -0,0 +1,112 @@
+"""
+对 token 预算内组装 chat-prompt 的测试。使用字符数作为 token 数，不需要下载 tiktoken 的 encoding 。
+"""
+
+from __future__ import annotations
+
+from _old_or_discarded._llm_methods.llm_input.token_budget_prompt_assembler import TokenBudgetPromptAssembler
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+import pytest
+
+# if TYPE_CHECKING:
+
+
+def build_assembler(max_prompt_tokens: int, **kwargs) -> TokenBudgetPromptAssembler:
+    chat_prompt_template = ChatPromptTemplate([('system', '{system}'), MessagesPlaceholder('chat_history')])
+    return TokenBudgetPromptAssembler(
+        chat_prompt_template=chat_prompt_template,
+        max_prompt_tokens=max_prompt_tokens,
+        token_counter=len,
+        tokens_per_message=0,
+        **kwargs,
+    )
+
+
+def build_chat_history(num_turns: int) -> list:
+    chat_history = []
+    for index in range(num_turns):
+        chat_history.append(HumanMessage(content=f'q{index:03d}'))
+        chat_history.append(AIMessage(content=f'a{index:03d}'))
+    return chat_history
+
+
+class SummaryRecorder:
+    """总结为 'summary-{被总结的消息数}' ，记录每次总结的输入。"""
+    def __init__(self, summary_length: int = 0):
+        self.calls: list[list] = []
+        self._summary_length = summary_length
+
+    def __call__(self, messages: list) -> SystemMessage:
+        self.calls.append(messages)
+        return SystemMessage(content=f'summary-{len(messages)}'.ljust(self._summary_length, '.'))
+
+
+class TestTokenBudgetPromptAssembler:
+    def test_keeps_recent_messages_within_budget(
+        self,
+    ) -> None:
+        assembler = build_assembler(max_prompt_tokens=3 + 4 * 5)
+        messages = assembler.assemble({'system': 'sys', 'chat_history': build_chat_history(5)})
+        assert [message.content for message in messages] == ['sys', 'a002', 'q003', 'a003', 'q004', 'a004']
+        assert sum(len(message.content) for message in messages) <= 23
+
+    def test_incremental_summary(
+        self,
+    ) -> None:
+        summarize_messages = SummaryRecorder()
+        assembler = build_assembler(max_prompt_tokens=3 + 4 * 5, summarize_messages=summarize_messages)
+        chat_history = build_chat_history(5)
+        messages = assembler.assemble({'system': 'sys', 'chat_history': chat_history})
+        # 总结占 9 个 token ，为此再丢弃 3 条消息，这 3 条消息与上一次的总结一起总结。
+        assert [message.content for message in messages] == ['sys', 'summary-4', 'q004', 'a004']
+        assert [message.content for message in summarize_messages.calls[-1]] == ['summary-5', 'a002', 'q003', 'a003']
+        # 相同的输入直接使用缓存的总结。
+        num_calls = len(summarize_messages.calls)
+        assert assembler.assemble({'system': 'sys', 'chat_history': chat_history}) == messages
+        assert len(summarize_messages.calls) == num_calls
+        # 新的一轮对话只总结上一次的总结和新丢弃的消息。
+        chat_history = [*chat_history, HumanMessage(content='q005'), AIMessage(content='a005')]
+        messages = assembler.assemble({'system': 'sys', 'chat_history': chat_history})
+        assert [message.content for message in messages] == ['sys', 'summary-3', 'q005', 'a005']
+        assert [message.content for message in summarize_messages.calls[-1]] == ['summary-4', 'q004', 'a004']
+        assert len(summarize_messages.calls) == num_calls + 1
+
+    def test_fixed_messages_over_budget(
+        self,
+    ) -> None:
+        assembler = build_assembler(max_prompt_tokens=10)
+        with pytest.raises(ValueError):
+            assembler.assemble({'system': 'a long system prompt', 'chat_history': []})
+
+    def test_summary_over_budget_is_not_used(
+        self,
+    ) -> None:
+        summarize_messages = SummaryRecorder(summary_length=100)
+        assembler = build_assembler(max_prompt_tokens=3 + 4 * 5, summarize_messages=summarize_messages)
+        messages = assembler.assemble({'system': 'sys', 'chat_history': build_chat_history(5)})
+        # 不使用总结时，保留截断的消息，而不是丢弃所有的消息。
+        assert [message.content for message in messages] == ['sys', 'a002', 'q003', 'a003', 'q004', 'a004']
+        assert len(summarize_messages.calls) == 1
+
+    def test_tool_calls_are_kept_with_tool_messages(
+        self,
+    ) -> None:
+        tool_call_message = AIMessage(content='', tool_calls=[{'name': 'f', 'args': {}, 'id': 'call_0'}])
+        chat_history = [
+            HumanMessage(content='q000'),
+            tool_call_message,
+            ToolMessage(content='r000', tool_call_id='call_0'),
+            ToolMessage(content='r001', tool_call_id='call_0'),
+            AIMessage(content='a000'),
+        ]
+        assembler = build_assembler(max_prompt_tokens=1000)
+        tool_call_tokens = assembler.count_message_tokens(tool_call_message)
+        assert tool_call_tokens > 0
+        # 预算可以容纳 2 条 ToolMessage 和最后的回答，但不能容纳 tool_calls ，因此整组丢弃。
+        assembler = build_assembler(max_prompt_tokens=3 + 4 * 3 + tool_call_tokens - 1)
+        messages = assembler.assemble({'system': 'sys', 'chat_history': chat_history})
+        assert [message.content for message in messages] == ['sys', 'a000']
+        assembler = build_assembler(max_prompt_tokens=3 + 4 * 3 + tool_call_tokens)
+        messages = assembler.assemble({'system': 'sys', 'chat_history': chat_history})
+        assert messages[1:] == chat_history[1:]
@@ -0,0 +1,122 @@
+"""
+对 batch 接口标注器的测试。使用本地 mock 的 OpenAI 兼容接口。
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+
+from _old_or_discarded._llm_methods.llm_labeler.batch_labeler import BatchLabeler
+from langchain_core.messages import SystemMessage
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+import httpx
+
+# if TYPE_CHECKING:
+
+
+class Label(BaseModel):
+    label: str
+
+
+class MockBatchServer:
+    """
+    模拟 files 和 batches 接口。
+
+    第一次出现的 'flaky' 数据返回无法解析的内容，之后正常返回。
+    """
+    def __init__(self):
+        self.files: dict[str, str] = {}
+        self.submitted_custom_ids: list[list[str]] = []
+        self._seen_flaky = False
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == 'POST' and path.endswith('/files'):
+            content = request.content.decode('utf-8')
+            file_id = f'file-{len(self.files)}'
+            self.files[file_id] = content[content.index('{"custom_id"'):content.rindex('}') + 1]
+            return httpx.Response(200, json=self._file_object(file_id, 'batch'))
+        if request.method == 'POST' and path.endswith('/batches'):
+            input_file_id = json.loads(request.content)['input_file_id']
+            output_file_id = self._run_batch(input_file_id)
+            return httpx.Response(200, json=self._batch_object(input_file_id, output_file_id))
+        if request.method == 'GET' and '/batches/' in path:
+            batch_id = path.rsplit('/', 1)[-1]
+            input_file_id = batch_id.removeprefix('batch-')
+            return httpx.Response(200, json=self._batch_object(input_file_id, f'{input_file_id}-output'))
+        if request.method == 'GET' and path.endswith('/content'):
+            return httpx.Response(200, text=self.files[path.split('/')[-2]])
+        if request.method == 'DELETE' and '/files/' in path:
+            file_id = path.rsplit('/', 1)[-1]
+            del self.files[file_id]
+            return httpx.Response(200, json={'id': file_id, 'object': 'file', 'deleted': True})
+        return httpx.Response(404)
+
+    def _run_batch(self, input_file_id: str) -> str:
+        output_lines = []
+        custom_ids = []
+        for line in self.files[input_file_id].splitlines():
+            request_line = json.loads(line)
+            custom_ids.append(request_line['custom_id'])
+            data = request_line['body']['messages'][-1]['content']
+            if data == 'flaky' and not self._seen_flaky:
+                self._seen_flaky = True
+                content = 'no json here'
+            else:
+                content = f'```json\n{{"label": "{data.upper()}"}}\n```'
+            output_lines.append(json.dumps({
+                'custom_id': request_line['custom_id'],
+                'response': {'status_code': 200, 'body': {'choices': [{'message': {'content': content}}]}},
+                'error': None,
+            }))
+        self.submitted_custom_ids.append(custom_ids)
+        output_file_id = f'{input_file_id}-output'
+        self.files[output_file_id] = '\n'.join(output_lines)
+        return output_file_id
+
+    @staticmethod
+    def _file_object(file_id: str, purpose: str) -> dict:
+        return {
+            'id': file_id, 'object': 'file', 'bytes': 0, 'created_at': 0,
+            'filename': 'input.jsonl', 'purpose': purpose, 'status': 'processed',
+        }
+
+    @staticmethod
+    def _batch_object(input_file_id: str, output_file_id: str) -> dict:
+        return {
+            'id': f'batch-{input_file_id}', 'object': 'batch', 'endpoint': '/v1/chat/completions',
+            'input_file_id': input_file_id, 'completion_window': '24h', 'status': 'completed',
+            'created_at': 0, 'output_file_id': output_file_id,
+        }
+
+
+class TestBatchLabeler:
+    def test_resubmit_only_failed_requests(
+        self,
+        tmp_path,
+    ) -> None:
+        server = MockBatchServer()
+        client = AsyncOpenAI(
+            base_url='http://mock/v1',
+            api_key='mock',
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handler)),
+        )
+        labeler = BatchLabeler(
+            base_url='http://mock/v1',
+            api_key='mock',
+            model='mock-model',
+            schema_pydantic_base_model=Label,
+            system_message=SystemMessage(content='label the data.'),
+            batch_dir=tmp_path,
+            poll_interval=0,
+            client=client,
+        )
+        results = asyncio.run(labeler.batch_label_datas(['a', 'flaky', 'c']))
+        assert [result.label for result in results] == ['A', 'FLAKY', 'C']
+        assert server.submitted_custom_ids == [['0', '1', '2'], ['1']]
+        # provider 上的输入和输出文件在每轮结束后删除，本地副本保留。
+        assert server.files == {}
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            'round_0_input.jsonl', 'round_0_output.jsonl', 'round_1_input.jsonl', 'round_1_output.jsonl',
+        ]
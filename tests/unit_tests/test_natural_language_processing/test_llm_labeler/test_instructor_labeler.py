@@ -0,0 +1,84 @@
+"""
+对 InstructorLabeler 的测试。使用本地模拟的 OpenAI 兼容接口。
+"""
+
+from __future__ import annotations
+import asyncio
+import functools
+
+from _old_or_discarded._llm_methods.llm_labeler.instructor_labeler import InstructorLabeler
+from langchain_core.messages import SystemMessage
+from pydantic import BaseModel
+from tests.fixtures.fake_openai_transport import FakeOpenAITransport
+import httpx
+
+# if TYPE_CHECKING:
+
+
+class Label(BaseModel):
+    label: str
+
+
+def build_labeler(**kwargs) -> InstructorLabeler:
+    return InstructorLabeler(
+        base_url='http://fake/v1',
+        api_key='fake',
+        model='fake-model',
+        schema_pydantic_base_model=Label,
+        system_message=SystemMessage(content='label the data.'),
+        **kwargs,
+    )
+
+
+class TestInstructorLabeler:
+    def test_shared_http_client_per_event_loop(
+        self,
+        monkeypatch,
+    ) -> None:
+        transport = FakeOpenAITransport(response_factory=lambda data: {'label': data.upper()})
+        built_http_clients: list[httpx.AsyncClient] = []
+
+        def build_http_client(**kwargs) -> httpx.AsyncClient:
+            http_client = build_mock_http_client(**kwargs)
+            built_http_clients.append(http_client)
+            return http_client
+
+        build_mock_http_client = functools.partial(
+            InstructorLabeler.build_http_client,
+            transport=httpx.MockTransport(transport.handler),
+        )
+        monkeypatch.setattr(InstructorLabeler, 'build_http_client', staticmethod(build_http_client))
+        labelers = [build_labeler(), build_labeler()]
+
+        async def run(datas: list[str]) -> list[list[str]]:
+            try:
+                results = await asyncio.gather(*(labeler.batch_label_datas(datas) for labeler in labelers))
+                # 同一个 event-loop 中的实例共享 http-client 。
+                assert labelers[0]._http_client is labelers[1]._http_client
+                return [[result.label for result in labeler_results] for labeler_results in results]
+            finally:
+                await InstructorLabeler.aclose_shared()
+
+        # 每次 asyncio.run 都是新的 event-loop ，使用各自的 http-client 。
+        assert asyncio.run(run(['a', 'b'])) == [['A', 'B'], ['A', 'B']]
+        assert asyncio.run(run(['c'])) == [['C'], ['C']]
+        assert len(built_http_clients) == 2
+        assert all(http_client.is_closed for http_client in built_http_clients)
+
+    def test_transport_errors_return_none(
+        self,
+    ) -> None:
+        def handler(request: httpx.Request) -> httpx.Response:
+            # retry-after-ms 使 openai 立即重试。
+            return httpx.Response(500, headers={'retry-after-ms': '1'}, json={'error': {'message': 'internal'}})
+
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        labeler = build_labeler(http_client=http_client)
+
+        async def run() -> list[Label | None]:
+            async with labeler:
+                return await labeler.batch_label_datas(['a', 'b'])
+
+        assert asyncio.run(run()) == [None, None]
+        # 传入的 http-client 由调用方关闭。
+        assert not http_client.is_closed
@@ -0,0 +1,57 @@
+"""
+对流式标注流程的测试。
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+
+from _old_or_discarded._llm_methods.llm_labeler.streaming_label_pipeline import (
+    StreamingLabelPipeline,
+)
+from pydantic import BaseModel
+
+# if TYPE_CHECKING:
+
+
+class Label(BaseModel):
+    label: str
+
+
+class FakeLabeler:
+    """按照数据内容返回结果，'bad' 开头的数据标注失败。"""
+    def __init__(self):
+        self.called_datas = []
+
+    async def label_data(self, data: str) -> Label | None:
+        self.called_datas.append(data)
+        await asyncio.sleep(0)
+        if data.startswith('bad'):
+            return None
+        return Label(label=data.upper())
+
+
+class TestStreamingLabelPipeline:
+    def test_resume_skips_labeled_ids(
+        self,
+        tmp_path,
+    ) -> None:
+        input_path = tmp_path / 'input.jsonl'
+        input_path.write_text(
+            '\n'.join(json.dumps({'id': i, 'data': data}) for i, data in enumerate(['a', 'bad', 'c', 'd'])),
+            encoding='utf-8',
+        )
+        output_path = tmp_path / 'output.jsonl'
+        # 模拟上一次运行完成了 id=0 ，并在写入 id=2 时崩溃。
+        output_path.write_text('{"id": 0, "result": {"label": "A"}}\n{"id": 2, "res', encoding='utf-8')
+        labeler = FakeLabeler()
+        pipeline = StreamingLabelPipeline(
+            labeler=labeler,
+            input_path=input_path,
+            output_path=output_path,
+            max_concurrency=2,
+        )
+        stats = asyncio.run(pipeline.run())
+        assert stats == {'skipped': 1, 'succeeded': 2, 'failed': 1}
+        assert sorted(labeler.called_datas) == ['bad', 'c', 'd']
+        assert pipeline.load_labeled_ids() == {'0', '2', '3'}
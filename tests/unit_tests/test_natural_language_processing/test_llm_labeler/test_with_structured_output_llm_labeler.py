@@ -0,0 +1,108 @@
+"""
+对 SimpleLabeler 的测试。使用本地模拟的 OpenAI 兼容接口。
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+
+from _old_or_discarded._llm_methods.llm_input.cached_prefix_message_builder import CachedPrefixMessageBuilder
+from _old_or_discarded._llm_methods.llm_labeler.with_structured_output_llm_labeler import SimpleLabeler
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+from tests.fixtures.fake_openai_transport import FakeOpenAITransport
+import httpx
+import pytest
+
+# if TYPE_CHECKING:
+
+
+class Label(BaseModel):
+    label: str
+
+
+class ParsingErrorChatModel(FakeListChatModel):
+    """with_structured_output(include_raw=True) 返回解析失败的结果。"""
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs):
+        raw = AIMessage(content='{"broken json', usage_metadata={
+            'input_tokens': 10, 'output_tokens': 3, 'total_tokens': 13, 'input_token_details': {'cache_read': 6},
+        })
+        return RunnableLambda(lambda messages: {'raw': raw, 'parsed': None, 'parsing_error': ValueError('broken')})
+
+
+class CachedPrefixTransport:
+    """
+    在 usage 中返回 prompt_tokens_details.cached_tokens 。第一次请求没有命中缓存，之后前缀全部命中。
+    """
+    def __init__(self):
+        self.request_bodies: list[dict] = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        data = body['messages'][-1]['content']
+        chat_completion = FakeOpenAITransport.build_chat_completion(body=body, structured_dict={'label': data.upper()})
+        prefix_tokens = sum(len(str(message['content'])) for message in body['messages'][:-1])
+        chat_completion['usage']['prompt_tokens_details'] = {
+            'cached_tokens': prefix_tokens if self.request_bodies else 0,
+        }
+        self.request_bodies.append(body)
+        return httpx.Response(200, json=chat_completion)
+
+
+def build_labeler(transport: CachedPrefixTransport) -> SimpleLabeler:
+    llm = ChatOpenAI(
+        model='fake-model',
+        base_url='http://fake/v1',
+        api_key='fake',
+        max_retries=0,
+        http_async_client=httpx.AsyncClient(transport=httpx.MockTransport(transport.handler)),
+    )
+    return SimpleLabeler(
+        llm=llm,
+        schema_pydantic_base_model=Label,
+        message_builder=CachedPrefixMessageBuilder(system_prompt='label the data.'),
+    )
+
+
+class TestSimpleLabeler:
+    def test_message_builder_counts_cached_tokens(
+        self,
+    ) -> None:
+        transport = CachedPrefixTransport()
+        labeler = build_labeler(transport)
+
+        async def run() -> list[Label]:
+            return [await labeler.label_data(data) for data in ['a', 'b']]
+
+        assert asyncio.run(run()) == [Label(label='A'), Label(label='B')]
+        assert transport.request_bodies[0]['messages'][:-1] == transport.request_bodies[1]['messages'][:-1]
+        prompt_tokens = [
+            sum(len(str(message['content'])) for message in body['messages']) for body in transport.request_bodies
+        ]
+        prefix_tokens = prompt_tokens[1] - len('b')
+        assert labeler.prompt_cache_usage == {
+            'cached_tokens': prefix_tokens,
+            'uncached_tokens': sum(prompt_tokens) - prefix_tokens,
+        }
+
+    def test_parsing_error_is_raised(
+        self,
+    ) -> None:
+        labeler = SimpleLabeler(
+            llm=ParsingErrorChatModel(responses=[]),
+            schema_pydantic_base_model=Label,
+            message_builder=CachedPrefixMessageBuilder(system_prompt='label the data.'),
+        )
+        with pytest.raises(ValueError, match='broken'):
+            asyncio.run(labeler.label_data('a'))
+        # 解析失败的请求也统计 usage 。
+        assert labeler.prompt_cache_usage == {'cached_tokens': 6, 'uncached_tokens': 4}
+
+    def test_requires_system_message_or_message_builder(
+        self,
+    ) -> None:
+        with pytest.raises(ValueError):
+            SimpleLabeler(llm=ChatOpenAI(model='fake-model', api_key='fake'), schema_pydantic_base_model=Label)
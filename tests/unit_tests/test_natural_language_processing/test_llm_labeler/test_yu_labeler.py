@@ -0,0 +1,135 @@
+"""
+对 YuLabeler 的测试。使用本地模拟的 BaseChatModel 。
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+
+from _old_or_discarded._llm_methods.llm_input.cached_prefix_message_builder import CachedPrefixMessageBuilder
+from _old_or_discarded._llm_methods.llm_labeler.yu_labeler import PACK_INDEX_KEY, YuLabeler
+from langchain_core.messages import SystemMessage
+from pydantic import BaseModel
+from tests.fixtures.fake_chat_model import FakeLabelChatModel
+import pytest
+
+# if TYPE_CHECKING:
+
+
+class IndexedLabel(BaseModel):
+    """schema 自身也有 index 字段。"""
+    index: int
+    label: str
+
+
+def get_packed_items(content: str) -> list[dict]:
+    """从 pack 请求的 human-message 中取出打包的数据。"""
+    return json.loads(content.split('```json\n', 1)[1].rsplit('\n```', 1)[0])
+
+
+class PackResponseFactory:
+    """
+    按照打包的数据生成结果。
+
+    - 'bad' 开头的数据第一次缺少 label 字段。
+    - 'missing' 开头的数据第一次不返回。
+    - 'duplicate' 开头的数据第一次返回两个结果。
+    """
+    def __init__(self):
+        self.pack_sizes: list[int] = []
+        self._seen_datas: set[str] = set()
+
+    def __call__(self, content: str) -> list[dict]:
+        items = get_packed_items(content)
+        self.pack_sizes.append(len(items))
+        results = []
+        for item in items:
+            data = item['data']
+            first_time = data not in self._seen_datas
+            self._seen_datas.add(data)
+            result = {PACK_INDEX_KEY: item[PACK_INDEX_KEY], 'index': len(data), 'label': data.upper()}
+            if first_time and data.startswith('bad'):
+                del result['label']
+            if first_time and data.startswith('missing'):
+                continue
+            results.append(result)
+            if first_time and data.startswith('duplicate'):
+                results.append({**result, 'label': 'OTHER'})
+        return results
+
+
+def build_labeler(response_factory, max_retries: int = 3) -> tuple[YuLabeler, FakeLabelChatModel]:
+    llm = FakeLabelChatModel(response_factory=response_factory)
+    labeler = YuLabeler(
+        llm=llm,
+        schema_pydantic_base_model=IndexedLabel,
+        system_message=SystemMessage(content='label the data.'),
+        max_retries=max_retries,
+    )
+    return labeler, llm
+
+
+class TestPackLabelDatas:
+    def test_pack_and_requeue_failed_items(
+        self,
+    ) -> None:
+        response_factory = PackResponseFactory()
+        labeler, llm = build_labeler(response_factory)
+        datas = ['a', 'bad-b', 'c', 'missing-d', 'e', 'duplicate-f', 'g']
+        results = asyncio.run(labeler.pack_label_datas(datas, pack_size=4))
+        assert [result.label for result in results] == [data.upper() for data in datas]
+        # schema 自身的 index 字段不受打包的影响。
+        assert [result.index for result in results] == [len(data) for data in datas]
+        # 第一轮 2 个 pack ，只有失败的 3 条数据重新打包为 1 个 pack 。
+        assert response_factory.pack_sizes == [4, 3, 3]
+        assert llm.num_requests == 3
+
+    def test_label_pack_validates_each_item(
+        self,
+    ) -> None:
+        def response_factory(content: str) -> dict:
+            items = get_packed_items(content)
+            return {'items': [
+                {PACK_INDEX_KEY: 0, 'index': 0, 'label': 'A'},
+                {PACK_INDEX_KEY: 1, 'index': 'not a number', 'label': 'B'},
+                {PACK_INDEX_KEY: 2, 'index': 2, 'label': 'C'},
+                {PACK_INDEX_KEY: 2, 'index': 2, 'label': 'C2'},
+                {PACK_INDEX_KEY: len(items), 'index': 9, 'label': 'OUT OF RANGE'},
+                {'index': 3, 'label': 'NO PACK INDEX'},
+            ]}
+
+        labeler, _ = build_labeler(response_factory)
+        results = asyncio.run(labeler.label_pack(['a', 'b', 'c', 'd']))
+        assert results[0] == IndexedLabel(index=0, label='A')
+        # 未通过 schema 检验、重复和缺失的都为 None 。
+        assert results[1:] == [None, None, None]
+
+    def test_items_failing_every_round_are_none(
+        self,
+    ) -> None:
+        labeler, llm = build_labeler(lambda content: [], max_retries=2)
+        results = asyncio.run(labeler.pack_label_datas(['a', 'b'], pack_size=8))
+        assert results == [None, None]
+        assert llm.num_requests == 2
+
+
+class TestMessageBuilder:
+    def test_label_with_message_builder(
+        self,
+    ) -> None:
+        llm = FakeLabelChatModel(response_factory=lambda data: {'index': len(data), 'label': data.upper()})
+        message_builder = CachedPrefixMessageBuilder(
+            system_prompt='label the data.',
+            schema_pydantic_base_model=IndexedLabel,
+        )
+        labeler = YuLabeler(llm=llm, schema_pydantic_base_model=IndexedLabel, message_builder=message_builder)
+        results = asyncio.run(labeler.batch_label_datas(['a', 'bb']))
+        assert results == [IndexedLabel(index=1, label='A'), IndexedLabel(index=2, label='BB')]
+        # FakeLabelChatModel 不返回缓存信息，全部计为未命中。
+        assert labeler.prompt_cache_usage == {'cached_tokens': 0, 'uncached_tokens': llm.prompt_tokens}
+
+    def test_requires_system_message_or_message_builder(
+        self,
+    ) -> None:
+        with pytest.raises(ValueError):
+            YuLabeler(llm=FakeLabelChatModel(response_factory=dict), schema_pydantic_base_model=IndexedLabel)
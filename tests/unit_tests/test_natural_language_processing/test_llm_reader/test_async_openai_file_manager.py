@@ -0,0 +1,136 @@
+"""
+对异步文件管理器的测试。使用本地 mock 的 OpenAI 兼容 files 接口。
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+
+from _old_or_discarded._llm_methods.llm_reader.async_openai_file_manager import AsyncOpenAIFileManager
+from _old_or_discarded._llm_methods.llm_reader.openai_file_index import OpenAIFileIndex
+from openai import AsyncOpenAI
+from tests.fixtures.mock_file_server import MockFileServer
+import httpx
+
+# if TYPE_CHECKING:
+
+
+class TestAsyncOpenAIFileManager:
+    def test_bulk_upload_retrieve_delete(
+        self,
+        tmp_path,
+    ) -> None:
+        server = MockFileServer()
+        file_paths = []
+        for index in range(20):
+            file_path = tmp_path / f'{index:03d}.md'
+            file_path.write_text(f'document {index}', encoding='utf-8')
+            file_paths.append(file_path)
+        client = AsyncOpenAI(
+            base_url='http://mock/v1',
+            api_key='mock',
+            max_retries=2,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handler)),
+        )
+
+        async def run() -> tuple:
+            async with AsyncOpenAIFileManager(
+                base_url='http://mock/v1',
+                api_key='mock',
+                max_concurrency=4,
+                client=client,
+            ) as manager:
+                uploaded = await manager.create_files(file_paths=file_paths, purpose='file-extract')
+                retrieved = await manager.retrieve_files(file_ids=[uploaded[0]['id'], 'file-missing'])
+                deleted = await manager.delete_files(file_ids=[file_object['id'] for file_object in uploaded])
+            return uploaded, retrieved, deleted
+
+        uploaded, retrieved, deleted = asyncio.run(run())
+        # 每个文件第一次上传失败，由 client 重试。结果与输入顺序一致。
+        assert [file_object['filename'] for file_object in uploaded] == [file_path.name for file_path in file_paths]
+        assert retrieved[0]['filename'] == '000.md'
+        # 404 不是暂时性错误，不重试，直接返回 None 。
+        assert retrieved[1] is None
+        assert all(result['deleted'] for result in deleted)
+        assert server.files == {}
+        assert 1 < server.max_in_flight <= 4
+
+    def test_upload_deduplication(
+        self,
+        tmp_path,
+    ) -> None:
+        server = MockFileServer(latency=0.)
+        file_paths = []
+        for index in range(3):
+            file_path = tmp_path / f'{index}.md'
+            file_path.write_text(f'document {index}', encoding='utf-8')
+            file_paths.append(file_path)
+        # 内容相同的文件只上传一次。
+        (tmp_path / 'copy.md').write_text('document 0', encoding='utf-8')
+        file_index = OpenAIFileIndex(db_path=tmp_path / 'index.sqlite')
+
+        def get_manager() -> AsyncOpenAIFileManager:
+            client = AsyncOpenAI(
+                base_url='http://mock/v1',
+                api_key='mock',
+                http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handler)),
+            )
+            return AsyncOpenAIFileManager(base_url='http://mock/v1', api_key='mock', file_index=file_index, client=client)
+
+        async def run() -> None:
+            async with get_manager() as manager:
+                first = await manager.create_files(file_paths=file_paths, purpose='file-extract')
+            num_requests = server.num_requests
+            async with get_manager() as manager:
+                second = await manager.create_files(
+                    file_paths=[*file_paths, tmp_path / 'copy.md'],
+                    purpose='file-extract',
+                )
+                assert server.num_requests == num_requests
+                assert second == [*first, first[0]]
+                await manager.delete_file(first[1]['id'])
+                # provider 上的文件被其他方式删除。
+                del server.files[first[2]['id']]
+                assert await manager.reconcile_file_index() == 1
+                await manager.create_files(file_paths=file_paths, purpose='file-extract')
+            # 只有被删除的 2 个文件重新上传，每个文件第一次请求失败后重试。
+            assert sorted(file_object['filename'] for file_object in server.files.values()) == ['0.md', '1.md', '2.md']
+
+        asyncio.run(run())
+
+    def test_iter_files_and_purge(
+        self,
+    ) -> None:
+        server = MockFileServer(latency=0.)
+        now = int(time.time())
+        for index in range(10):
+            server.files[f'file-{index}'] = {
+                'id': f'file-{index}', 'object': 'file', 'bytes': 100, 'created_at': now - index * 3600,
+                'filename': f'{"tmp" if index % 2 else "doc"}-{index}.md',
+                'purpose': 'batch' if index == 9 else 'file-extract', 'status': 'processed',
+            }
+        client = AsyncOpenAI(
+            base_url='http://mock/v1',
+            api_key='mock',
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handler)),
+        )
+
+        async def run() -> tuple[list[str], dict, dict]:
+            async with AsyncOpenAIFileManager(base_url='http://mock/v1', api_key='mock', client=client) as manager:
+                file_ids = [
+                    file_object['id']
+                    async for file_object in manager.iter_files(purpose='file-extract', page_size=3)
+                ]
+                dry_run_report = await manager.purge(older_than=7200 - 1, filename_prefix='tmp')
+                report = await manager.purge(older_than=7200 - 1, filename_prefix='tmp', dry_run=False)
+            return file_ids, dry_run_report, report
+
+        file_ids, dry_run_report, report = asyncio.run(run())
+        assert file_ids == [f'file-{index}' for index in range(9)]
+        # 每页 3 个，逐页获取。
+        assert server.num_list_requests >= 3
+        assert dry_run_report['matched_file_ids'] == ['file-3', 'file-5', 'file-7', 'file-9']
+        assert dry_run_report['num_bytes'] == 400
+        assert dry_run_report['num_deleted'] == 0
+        assert report['num_deleted'] == 4
+        assert sorted(server.files) == ['file-0', 'file-1', 'file-2', 'file-4', 'file-6', 'file-8']
@@ -0,0 +1,183 @@
+"""
+对并发长文本阅读器的测试。使用本地模拟的 OpenAI 兼容接口。
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+
+from _old_or_discarded._llm_methods.llm_output.json_output_extractor import JsonOutputExtractor
+from _old_or_discarded._llm_methods.llm_reader.dashscope_reader import (
+    AsyncQwenLongReader,
+    QwenLongQuestionsJob,
+    QwenLongReadJob,
+)
+from openai import AsyncOpenAI
+from tests.fixtures.fake_openai_transport import FakeOpenAITransport
+import httpx
+
+# if TYPE_CHECKING:
+
+
+async def stream_handler(request: httpx.Request) -> httpx.Response:
+    """以 server-sent-events 逐段返回内容，每段之间间隔 10ms 。"""
+    deltas = ['long ', 'context ', 'answer']
+
+    async def iter_events():
+        await asyncio.sleep(0.05)
+        for index, delta in enumerate(deltas):
+            chunk = {
+                'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'qwen-long',
+                'choices': [{
+                    'index': 0,
+                    'delta': {'role': 'assistant', 'content': delta},
+                    'finish_reason': 'stop' if index == len(deltas) - 1 else None,
+                }],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            await asyncio.sleep(0.01)
+        usage_chunk = {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'qwen-long',
+            'choices': [], 'usage': {'prompt_tokens': 100, 'completion_tokens': 3, 'total_tokens': 103},
+        }
+        yield f"data: {json.dumps(usage_chunk)}\n\n".encode('utf-8')
+        yield b"data: [DONE]\n\n"
+
+    return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=iter_events())
+
+
+class TestAsyncQwenLongReader:
+    def test_skip_valid_results(
+        self,
+        tmp_path,
+    ) -> None:
+        transport = FakeOpenAITransport(response_factory=lambda question: {'answer': question.upper()})
+
+        def get_reader() -> AsyncQwenLongReader:
+            client = AsyncOpenAI(base_url='http://mock/v1', api_key='mock', http_client=transport.get_async_client())
+            return AsyncQwenLongReader(api_key='mock', max_concurrency=4, client=client)
+
+        jobs = [
+            QwenLongReadJob(
+                file_id=f'file-{index}',
+                system_message_content='You are a helpful assistant.',
+                human_message_content=f'question {index}',
+                result_path=tmp_path / f'{index}.json',
+            )
+            for index in range(6)
+        ]
+        results = asyncio.run(get_reader().read_files(jobs))
+        assert transport.num_requests == 6
+        content = results[2]['choices'][0]['message']['content']
+        assert JsonOutputExtractor.extract_json_from_str(content) == {'answer': 'QUESTION 2'}
+        assert not list(tmp_path.glob('*.tmp'))
+
+        # 不完整的结果和 prompt 不一致的结果需要重新请求。
+        (tmp_path / '0.json').write_text('{"file_id": "file-0", "prom', encoding='utf-8')
+        jobs[1].human_message_content = 'question 1 changed'
+        results_again = asyncio.run(get_reader().read_files(jobs))
+        assert transport.num_requests == 8
+        assert results_again[2:] == results[2:]
+        assert json.loads((tmp_path / '0.json').read_text(encoding='utf-8'))['file_id'] == 'file-0'
+
+    def test_questions_fan_in_with_fallback(
+        self,
+        tmp_path,
+    ) -> None:
+        def answer_questions(content: str) -> dict | list:
+            questions = JsonOutputExtractor.extract_json_from_str(content)
+            if questions is None:
+                # 单独请求的问题。
+                return {'answer': content.upper()}
+            # 一次回答所有问题，但是漏掉含有 hard 的问题。
+            return [
+                {'index': question['index'], 'answer': question['question'].upper()}
+                for question in questions if 'hard' not in question['question']
+            ]
+
+        transport = FakeOpenAITransport(response_factory=answer_questions)
+        client = AsyncOpenAI(base_url='http://mock/v1', api_key='mock', http_client=transport.get_async_client())
+        reader = AsyncQwenLongReader(api_key='mock', client=client)
+        job = QwenLongQuestionsJob(
+            file_id='file-0',
+            system_message_content='You are a helpful assistant.',
+            questions=['who', 'hard one', 'when'],
+            result_path=tmp_path / 'questions.json',
+        )
+        [answers] = asyncio.run(reader.read_files_questions([job]))
+        # 1 次合并的请求，1 次单独的请求。
+        assert transport.num_requests == 2
+        assert answers[0] == 'WHO' and answers[2] == 'WHEN'
+        assert JsonOutputExtractor.extract_json_from_str(answers[1]) == {'answer': 'HARD ONE'}
+        result = json.loads(job.result_path.read_text(encoding='utf-8'))
+        assert result['answers'] == answers and len(result['completions']) == 2
+        assert asyncio.run(reader.read_file_questions(job)) == answers
+        assert transport.num_requests == 2
+
+    def test_stream_read_file_metrics(
+        self,
+        tmp_path,
+    ) -> None:
+        client = AsyncOpenAI(
+            base_url='http://mock/v1',
+            api_key='mock',
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(stream_handler)),
+        )
+        reader = AsyncQwenLongReader(api_key='mock', client=client)
+        job = QwenLongReadJob(
+            file_id='file-0',
+            system_message_content='You are a helpful assistant.',
+            human_message_content='summarize.',
+            result_path=tmp_path / 'stream.json',
+        )
+
+        async def collect() -> list[str]:
+            return [delta async for delta in reader.stream_read_file(job)]
+
+        assert asyncio.run(collect()) == ['long ', 'context ', 'answer']
+        [metrics] = reader.stream_metrics
+        assert 0.05 <= metrics['ttft'] < metrics['latency']
+        assert metrics['completion_tokens'] == 3 and metrics['tokens_per_second'] > 0
+        assert not (tmp_path / 'stream.json.part').exists()
+        # 结果文件与 read_file 的格式一致，再次读取时直接使用。
+        assert asyncio.run(reader.read_file(job))['choices'][0]['message']['content'] == 'long context answer'
+        assert asyncio.run(collect()) == ['long context answer']
+
+    def test_stream_does_not_hold_semaphore_while_suspended(
+        self,
+        tmp_path,
+    ) -> None:
+        client = AsyncOpenAI(
+            base_url='http://mock/v1',
+            api_key='mock',
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(stream_handler)),
+        )
+        reader = AsyncQwenLongReader(api_key='mock', max_concurrency=1, client=client)
+        jobs = [
+            QwenLongReadJob(
+                file_id=f'file-{index}',
+                system_message_content='You are a helpful assistant.',
+                human_message_content='summarize.',
+                result_path=tmp_path / f'stream-{index}.json',
+            )
+            for index in range(3)
+        ]
+
+        async def collect(job: QwenLongReadJob) -> list[str]:
+            return [delta async for delta in reader.stream_read_file(job)]
+
+        async def run() -> None:
+            # 第一个调用方暂停在 yield ，第二个请求依然可以使用唯一的并发数。
+            first = reader.stream_read_file(jobs[0])
+            assert await anext(first) == 'long '
+            assert await asyncio.wait_for(collect(jobs[1]), timeout=5.) == ['long ', 'context ', 'answer']
+            assert [delta async for delta in first] == ['context ', 'answer']
+            # 提前停止迭代时取消请求，不写入结果文件。
+            third = reader.stream_read_file(jobs[2])
+            assert await anext(third) == 'long '
+            await third.aclose()
+            assert await asyncio.wait_for(collect(jobs[2]), timeout=5.) == ['long ', 'context ', 'answer']
+
+        asyncio.run(run())
+        assert len(reader.stream_metrics) == 3
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['stream-0.json', 'stream-1.json', 'stream-2.json']
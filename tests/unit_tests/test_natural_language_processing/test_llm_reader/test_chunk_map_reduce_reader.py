@@ -0,0 +1,136 @@
+"""
+对 map-reduce 阅读器的测试。使用本地模拟的 OpenAI 兼容接口，以字符作为 token 。
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+
+from _old_or_discarded._llm_methods.llm_reader.chunk_map_reduce_reader import ChunkMapReduceReader
+from openai import AsyncOpenAI
+from tests.fixtures.fake_openai_transport import FakeOpenAITransport
+import httpx
+import pytest
+
+# if TYPE_CHECKING:
+
+
+class CharEncoding:
+    """以字符作为 token ，不需要下载 tiktoken 的 encoding 。"""
+    def encode(self, text: str, disallowed_special=()) -> list[int]:
+        return [ord(char) for char in text]
+
+    def decode(self, tokens: list[int]) -> str:
+        return ''.join(chr(token) for token in tokens)
+
+
+class FlakyTransport(FakeOpenAITransport):
+    """每个 map 请求第一次返回 500 。包含 poison 的 map 请求返回 400 。"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_server_errors = 0
+        self._seen_contents: set[str] = set()
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        messages = json.loads(request.content)['messages']
+        content = messages[-1]['content']
+        if messages[0]['content'] == 'extract facts.':
+            if 'poison' in content:
+                return httpx.Response(400, json={'error': {'message': 'bad request', 'type': 'invalid_request'}})
+            if content not in self._seen_contents:
+                self._seen_contents.add(content)
+                self.num_server_errors += 1
+                # retry-after-ms 使 client 立即重试。
+                return httpx.Response(500, headers={'retry-after-ms': '1'}, json={'error': {'message': 'internal'}})
+        return await super().handler(request)
+
+
+def build_reader(
+    transport: FakeOpenAITransport,
+    **kwargs,
+) -> ChunkMapReduceReader:
+    client = AsyncOpenAI(
+        base_url='http://mock/v1', api_key='mock', max_retries=2, http_client=transport.get_async_client(),
+    )
+    return ChunkMapReduceReader(
+        base_url='http://mock/v1',
+        api_key='mock',
+        model='mock-model',
+        map_instruction='extract facts.',
+        reduce_instruction='merge facts.',
+        max_chunk_tokens=200,
+        overlap_tokens=20,
+        reduce_fan_in=4,
+        encoding=CharEncoding(),
+        client=client,
+        **kwargs,
+    )
+
+
+class TestChunkMapReduceReader:
+    def test_map_reduce_with_chunk_cache(
+        self,
+        tmp_path,
+    ) -> None:
+        transport = FakeOpenAITransport(response_factory=lambda content: {'num_chars': len(content)})
+        client = AsyncOpenAI(base_url='http://mock/v1', api_key='mock', http_client=transport.get_async_client())
+        reader = ChunkMapReduceReader(
+            base_url='http://mock/v1',
+            api_key='mock',
+            model='mock-model',
+            map_instruction='extract facts.',
+            reduce_instruction='merge facts.',
+            max_chunk_tokens=200,
+            overlap_tokens=20,
+            reduce_fan_in=4,
+            cache_dir=tmp_path,
+            encoding=CharEncoding(),
+            client=client,
+        )
+        paragraphs = [f'paragraph {index} ' + 'x' * (index % 7 * 10) for index in range(100)]
+        text = '\n\n'.join(paragraphs)
+
+        chunks = reader.split_text(text)
+        assert all(len(chunk) <= 200 + 20 + 2 for chunk in chunks)
+        assert chunks[1].startswith(chunks[0][-20:])
+        result = asyncio.run(reader.read(text))
+        assert result.startswith('```json')
+        num_requests = transport.num_requests
+        assert num_requests > len(chunks)
+
+        # 完全相同的文本全部命中缓存。
+        assert asyncio.run(reader.read(text)) == result
+        assert transport.num_requests == num_requests
+
+        # 修改一个段落，只有附近的 chunk 和受影响的 reduce 重新请求。
+        paragraphs[50] = 'paragraph 50 edited'
+        asyncio.run(reader.read('\n\n'.join(paragraphs)))
+        assert transport.num_requests - num_requests < len(chunks) // 2
+
+    def test_empty_text(
+        self,
+    ) -> None:
+        reader = build_reader(transport=FakeOpenAITransport(response_factory=lambda content: {}))
+        with pytest.raises(ValueError):
+            asyncio.run(reader.read(''))
+        with pytest.raises(ValueError):
+            asyncio.run(reader.read('\n\n  \n\n'))
+
+    def test_failed_map_is_recorded_per_chunk(
+        self,
+    ) -> None:
+        transport = FlakyTransport(response_factory=lambda content: {'num_chars': len(content)})
+        reader = build_reader(transport=transport)
+        paragraphs = [f'paragraph {index} ' + 'x' * 150 for index in range(6)]
+        paragraphs[3] = 'poison ' + 'x' * 150
+        text = '\n\n'.join(paragraphs)
+        chunks = reader.split_text(text)
+        poison_indexes = [index for index, chunk in enumerate(chunks) if 'poison' in chunk]
+        result = asyncio.run(reader.read(text))
+        assert result.startswith('```json')
+        # 暂时性错误重试后成功，400 不重试，只记录失败的 chunk 。
+        assert transport.num_server_errors == len(chunks) - len(poison_indexes)
+        assert poison_indexes and reader.failed_chunk_indexes == poison_indexes
+        # 全部失败时抛出。
+        with pytest.raises(RuntimeError):
+            asyncio.run(reader.read('poison'))
@@ -0,0 +1,166 @@
+"""
+对同步文件管理器的测试。与异步文件管理器的测试使用同一个 mock 的 files 接口。
+"""
+
+from __future__ import annotations
+import time
+
+from _old_or_discarded._llm_methods.llm_reader.openai_file_index import OpenAIFileIndex
+from _old_or_discarded._llm_methods.llm_reader.openai_file_manager import OpenAIFileManager, is_file_matched
+from openai import OpenAI
+from openai.types import FileObject
+from tests.fixtures.mock_file_server import MockFileServer
+import httpx
+import pytest
+
+# if TYPE_CHECKING:
+
+
+@pytest.fixture
+def server(monkeypatch) -> MockFileServer:
+    """OpenAIFileManager 的每个方法都会构建 client ，这里替换为请求 mock 的 client 。"""
+    server = MockFileServer(latency=0.)
+
+    def create_openai_client(base_url: str, api_key: str) -> OpenAI:
+        return OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=2,
+            http_client=httpx.Client(transport=httpx.MockTransport(server.sync_handler)),
+        )
+
+    monkeypatch.setattr(OpenAIFileManager, 'create_openai_client', staticmethod(create_openai_client))
+    return server
+
+
+def add_files(server: MockFileServer) -> None:
+    now = int(time.time())
+    for index in range(10):
+        server.files[f'file-{index}'] = {
+            'id': f'file-{index}', 'object': 'file', 'bytes': 100, 'created_at': now - index * 3600,
+            'filename': f'{"tmp" if index % 2 else "doc"}-{index}.md',
+            'purpose': 'batch' if index == 9 else 'file-extract', 'status': 'processed',
+        }
+
+
+class TestOpenAIFileManager:
+    def test_upload_deduplication(
+        self,
+        server: MockFileServer,
+        tmp_path,
+    ) -> None:
+        file_paths = []
+        for index in range(3):
+            file_path = tmp_path / f'{index}.md'
+            file_path.write_text(f'document {index}', encoding='utf-8')
+            file_paths.append(file_path)
+        # 内容相同的文件只上传一次。
+        (tmp_path / 'copy.md').write_text('document 0', encoding='utf-8')
+        file_index = OpenAIFileIndex(db_path=tmp_path / 'index.sqlite')
+        first = OpenAIFileManager.create_files(
+            base_url='http://mock/v1', api_key='mock', file_paths=file_paths, purpose='file-extract',
+            file_index=file_index,
+        )
+        # 每个文件第一次上传失败，由 client 重试。
+        assert [file_object['filename'] for file_object in first] == ['0.md', '1.md', '2.md']
+        num_requests = server.num_requests
+        second = OpenAIFileManager.create_files(
+            base_url='http://mock/v1', api_key='mock', file_paths=[*file_paths, tmp_path / 'copy.md'],
+            purpose='file-extract', file_index=file_index,
+        )
+        assert server.num_requests == num_requests
+        assert second == [*first, first[0]]
+        # 不使用索引时每次都上传。
+        OpenAIFileManager.create_file(
+            base_url='http://mock/v1', api_key='mock', file_path=file_paths[0], purpose='file-extract',
+        )
+        assert len(server.files) == 4
+
+    def test_delete_and_reconcile_file_index(
+        self,
+        server: MockFileServer,
+        tmp_path,
+    ) -> None:
+        file_paths = []
+        for index in range(3):
+            file_path = tmp_path / f'{index}.md'
+            file_path.write_text(f'document {index}', encoding='utf-8')
+            file_paths.append(file_path)
+        file_index = OpenAIFileIndex(db_path=tmp_path / 'index.sqlite')
+        uploaded = OpenAIFileManager.create_files(
+            base_url='http://mock/v1', api_key='mock', file_paths=file_paths, purpose='file-extract',
+            file_index=file_index,
+        )
+        OpenAIFileManager.delete_file(
+            base_url='http://mock/v1', api_key='mock', file_id=uploaded[1]['id'], file_index=file_index,
+        )
+        # provider 上的文件被其他方式删除。
+        del server.files[uploaded[2]['id']]
+        num_removed = OpenAIFileManager.reconcile_file_index(
+            base_url='http://mock/v1', api_key='mock', file_index=file_index,
+        )
+        assert num_removed == 1
+        sha256s = [file_index.get_file_sha256(file_path) for file_path in file_paths]
+        assert file_index.get(sha256=sha256s[0], purpose='file-extract') == uploaded[0]
+        assert file_index.get(sha256=sha256s[1], purpose='file-extract') is None
+        assert file_index.get(sha256=sha256s[2], purpose='file-extract') is None
+
+    def test_iter_files(
+        self,
+        server: MockFileServer,
+    ) -> None:
+        add_files(server)
+        file_ids = [
+            file_object['id']
+            for file_object in OpenAIFileManager.iter_files(
+                base_url='http://mock/v1', api_key='mock', purpose='file-extract', page_size=3,
+            )
+        ]
+        assert file_ids == [f'file-{index}' for index in range(9)]
+        # 每页 3 个，逐页获取。
+        assert server.num_list_requests >= 3
+        file_ids = [
+            file_object['id']
+            for file_object in OpenAIFileManager.iter_files(
+                base_url='http://mock/v1', api_key='mock', older_than=7200 - 1, filename_prefix='tmp',
+            )
+        ]
+        assert file_ids == ['file-3', 'file-5', 'file-7', 'file-9']
+
+    def test_purge(
+        self,
+        server: MockFileServer,
+        tmp_path,
+    ) -> None:
+        add_files(server)
+        file_index = OpenAIFileIndex(db_path=tmp_path / 'index.sqlite')
+        file_index.put(sha256='0' * 64, purpose='file-extract', file_object=server.files['file-3'])
+        dry_run_report = OpenAIFileManager.purge(
+            base_url='http://mock/v1', api_key='mock', older_than=7200 - 1, filename_prefix='tmp',
+        )
+        assert dry_run_report['matched_file_ids'] == ['file-3', 'file-5', 'file-7', 'file-9']
+        assert dry_run_report['num_bytes'] == 400
+        assert dry_run_report['num_deleted'] == 0
+        assert len(server.files) == 10
+        # 并发删除，同时删除索引中的记录。
+        report = OpenAIFileManager.purge(
+            base_url='http://mock/v1', api_key='mock', older_than=7200 - 1, filename_prefix='tmp',
+            dry_run=False, max_concurrency=4, file_index=file_index,
+        )
+        assert report['num_deleted'] == 4
+        assert report['failed_file_ids'] == []
+        assert sorted(server.files) == ['file-0', 'file-1', 'file-2', 'file-4', 'file-6', 'file-8']
+        assert file_index.get(sha256='0' * 64, purpose='file-extract') is None
+
+    def test_is_file_matched(
+        self,
+    ) -> None:
+        file = FileObject(
+            id='file-0', object='file', bytes=0, created_at=100, filename='tmp-0.md', purpose='batch',
+            status='processed',
+        )
+        assert is_file_matched(file)
+        assert is_file_matched(file, purpose='batch', created_before=101, filename_prefix='tmp')
+        assert not is_file_matched(file, purpose='file-extract')
+        assert not is_file_matched(file, created_before=100)
+        assert not is_file_matched(file, filename_prefix='doc')
@@ -0,0 +1,3 @@
+"""
+对 torch 工具的单元测试。
+"""
@@ -0,0 +1,287 @@
+"""
+对 checkpoint 保存和加载的测试。
+"""
+
+from __future__ import annotations
+import json
+
+from _old_or_discarded._torch_utils.checkpoint_tool import (
+    AsyncCheckpointWriter,
+    compact_delta_checkpoint,
+    detect_checkpoint_format,
+    load_checkpoint,
+    read_checkpoint,
+    save_checkpoint,
+    write_checkpoint,
+    write_delta_checkpoint,
+    write_sharded_checkpoint,
+)
+from safetensors import safe_open
+from safetensors.torch import save_file
+import pytest
+import torch
+
+# if TYPE_CHECKING:
+
+
+def build_training_state() -> tuple[torch.nn.Module, torch.optim.Optimizer, torch.optim.lr_scheduler.LRScheduler]:
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 2))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-2)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1)
+    return model, optimizer, scheduler
+
+
+def train_one_step(model, optimizer, scheduler) -> None:
+    loss = model(torch.randn(4, 8)).pow(2).mean()
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+    scheduler.step()
+
+
+class TestAsyncCheckpointWriter:
+    def test_snapshot_and_keep_last_k(
+        self,
+        tmp_path,
+    ) -> None:
+        model, optimizer, scheduler = build_training_state()
+        train_one_step(model, optimizer, scheduler)
+        with AsyncCheckpointWriter(keep_last_k=2) as writer:
+            for step in range(3):
+                expected_state = {key: value.clone() for key, value in model.state_dict().items()}
+                save_checkpoint(tmp_path / f'step_{step}.pt', model, optimizer, scheduler, async_writer=writer)
+                # 保存之后继续训练，不影响已经快照的状态。
+                train_one_step(model, optimizer, scheduler)
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['step_1.pt', 'step_2.pt']
+
+        new_model, new_optimizer, new_scheduler = build_training_state()
+        load_checkpoint(tmp_path / 'step_2.pt', new_model, new_optimizer, new_scheduler)
+        for key, value in new_model.state_dict().items():
+            assert torch.equal(value, expected_state[key])
+        assert new_scheduler.last_epoch == 3
+
+    def test_checkpoint_format_and_state_dict_metadata(
+        self,
+        tmp_path,
+    ) -> None:
+        model, optimizer, scheduler = build_training_state()
+        train_one_step(model, optimizer, scheduler)
+        with AsyncCheckpointWriter() as writer:
+            save_checkpoint(tmp_path / 'step.pt', model, optimizer, scheduler, async_writer=writer)
+            # checkpoint_format 覆盖 writer 的格式。
+            save_checkpoint(tmp_path / 'step.safetensors', model, optimizer, scheduler, async_writer=writer,
+                            checkpoint_format='safetensors')
+            with pytest.raises(ValueError):
+                save_checkpoint(tmp_path / 'delta.safetensors', model, optimizer, async_writer=writer,
+                                checkpoint_format='delta')
+            with pytest.raises(ValueError):
+                save_checkpoint(tmp_path / 'delta.safetensors', model, optimizer, async_writer=writer,
+                                delta_base=tmp_path / 'step.safetensors')
+        with safe_open(tmp_path / 'step.safetensors', framework='pt') as f:
+            assert 'skeleton' in f.metadata()
+        # 快照保留 state_dict 的 _metadata ，load_state_dict 依赖其中的版本。
+        checkpoint = read_checkpoint(tmp_path / 'step.pt', keys=['model'])
+        assert checkpoint['model']._metadata == model.state_dict()._metadata
+        assert list(checkpoint['model']) == list(model.state_dict())
+
+
+class TestSafetensorsCheckpoint:
+    def test_round_trip_and_model_only_loading(
+        self,
+        tmp_path,
+    ) -> None:
+        model, optimizer, scheduler = build_training_state()
+        train_one_step(model, optimizer, scheduler)
+        path = tmp_path / 'checkpoint.safetensors'
+        save_checkpoint(path, model, optimizer, scheduler, checkpoint_format='safetensors')
+
+        new_model, new_optimizer, new_scheduler = build_training_state()
+        torch.nn.init.zeros_(new_model[0].weight)
+        load_checkpoint(path, new_model, new_optimizer, new_scheduler, map_location='cpu')
+        for key, value in model.state_dict().items():
+            assert torch.equal(new_model.state_dict()[key], value)
+        # int 作为 key 的 optimizer state 和 tuple 形式的 betas 保持不变。
+        assert optimizer.state_dict()['state'].keys() == new_optimizer.state_dict()['state'].keys()
+        assert new_optimizer.param_groups[0]['betas'] == optimizer.param_groups[0]['betas']
+        assert new_scheduler.last_epoch == scheduler.last_epoch
+
+        # 只加载 model ，不读取 optimizer 。
+        inference_model = build_training_state()[0]
+        torch.nn.init.zeros_(inference_model[0].bias)
+        assert load_checkpoint(path, inference_model) is inference_model
+        assert torch.equal(inference_model[0].bias, model[0].bias)
+
+    def test_shared_views_are_saved_once(
+        self,
+        tmp_path,
+    ) -> None:
+        weight = torch.randn(4, 4)
+        state = {'model': {'encoder.weight': weight, 'decoder.weight': weight, 'head.weight': weight[:2]}}
+        path = tmp_path / 'tied.safetensors'
+        write_checkpoint(state, path, checkpoint_format='safetensors')
+        with safe_open(path, framework='pt') as f:
+            assert sorted(f.keys()) == ['model/encoder.weight', 'model/head.weight']
+        loaded = read_checkpoint(path)
+        assert all(torch.equal(loaded['model'][key], value) for key, value in state['model'].items())
+
+
+class TestShardedCheckpoint:
+    def test_parallel_shards_and_partial_loading(
+        self,
+        tmp_path,
+    ) -> None:
+        model, optimizer, scheduler = build_training_state()
+        train_one_step(model, optimizer, scheduler)
+        state = {'model': model.state_dict(), 'optimizer': optimizer.state_dict()}
+        path = tmp_path / 'sharded'
+        # 每个 shard 最多 256 字节，共有多个 shard 。
+        write_sharded_checkpoint(state, path, max_shard_size=256, num_workers=4)
+        index = json.loads((path / 'index.json').read_text(encoding='utf-8'))
+        assert len(index['shards']) > 3
+        # 覆盖已有的 checkpoint 。
+        save_checkpoint(path, model, optimizer, scheduler, checkpoint_format='sharded')
+
+        new_model, new_optimizer, new_scheduler = build_training_state()
+        torch.nn.init.zeros_(new_model[0].weight)
+        load_checkpoint(path, new_model, new_optimizer, new_scheduler)
+        for key, value in model.state_dict().items():
+            assert torch.equal(new_model.state_dict()[key], value)
+        assert new_scheduler.last_epoch == scheduler.last_epoch
+
+        # 损坏只包含 optimizer 的 shard ，只加载 model 时不受影响，加载 optimizer 时检查出错误。
+        write_sharded_checkpoint(state, path, max_shard_size=256)
+        index = json.loads((path / 'index.json').read_text(encoding='utf-8'))
+        optimizer_shard = index['weight_map']['optimizer/state/0/exp_avg']
+        assert all(
+            shard_name != optimizer_shard
+            for tensor_key, shard_name in index['weight_map'].items() if tensor_key.startswith('model/')
+        )
+        (path / optimizer_shard).write_bytes(b'corrupted')
+        assert torch.equal(read_checkpoint(path, keys=['model'])['model']['0.bias'], model[0].bias)
+        with pytest.raises(ValueError, match='sha256'):
+            read_checkpoint(path)
+
+
+class TestDeltaCheckpoint:
+    def test_delta_chain_and_compaction(
+        self,
+        tmp_path,
+    ) -> None:
+        torch.manual_seed(0)
+        # 类似 LoRA: 较大的 backbone 冻结，只训练较小的 adapter 。
+        model = torch.nn.ModuleDict({
+            'backbone': torch.nn.Linear(256, 256),
+            'adapter': torch.nn.Linear(256, 2),
+        })
+        model['backbone'].requires_grad_(False)
+        optimizer = torch.optim.AdamW(model['adapter'].parameters(), lr=1e-2)
+
+        def train_one_adapter_step() -> None:
+            loss = model['adapter'](model['backbone'](torch.randn(4, 256))).pow(2).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        train_one_adapter_step()
+        paths = [tmp_path / f'step_{step}.safetensors' for step in range(4)]
+        save_checkpoint(paths[0], model, optimizer, checkpoint_format='delta')
+        for step in range(1, 4):
+            train_one_adapter_step()
+            save_checkpoint(paths[step], model, optimizer, checkpoint_format='delta', delta_base=paths[step - 1])
+        # delta 中只有 adapter 和 optimizer 的 tensor 。
+        with safe_open(paths[3], framework='pt') as f:
+            assert not any(tensor_key.startswith('model/backbone') for tensor_key in f.keys())
+        assert paths[3].stat().st_size * 20 < paths[0].stat().st_size
+
+        def assert_loaded_equal(path) -> None:
+            new_model = torch.nn.ModuleDict({
+                'backbone': torch.nn.Linear(256, 256),
+                'adapter': torch.nn.Linear(256, 2),
+            })
+            new_optimizer = torch.optim.AdamW(new_model['adapter'].parameters(), lr=1e-2)
+            load_checkpoint(path, new_model, new_optimizer)
+            for key, value in model.state_dict().items():
+                assert torch.equal(new_model.state_dict()[key], value)
+            assert torch.equal(
+                new_optimizer.state_dict()['state'][0]['exp_avg'],
+                optimizer.state_dict()['state'][0]['exp_avg'],
+            )
+
+        assert_loaded_equal(paths[3])
+        # 合并后不再依赖 base 链。
+        compact_delta_checkpoint(paths[3], tmp_path / 'compacted.safetensors')
+        for path in paths:
+            path.unlink()
+        assert_loaded_equal(tmp_path / 'compacted.safetensors')
+
+        # 超过 max_chain_length 时写入完整的 checkpoint 。
+        state = {'model': model.state_dict()}
+        write_delta_checkpoint(state, tmp_path / 'a.safetensors')
+        write_delta_checkpoint(state, tmp_path / 'b.safetensors', delta_base=tmp_path / 'a.safetensors')
+        write_delta_checkpoint(
+            state, tmp_path / 'c.safetensors', delta_base=tmp_path / 'b.safetensors', max_chain_length=1,
+        )
+        with safe_open(tmp_path / 'b.safetensors', framework='pt') as f:
+            assert f.keys() == [] and f.metadata()['delta_base'] == 'a.safetensors'
+        with safe_open(tmp_path / 'c.safetensors', framework='pt') as f:
+            assert 'delta_base' not in f.metadata() and len(f.keys()) == 4
+
+    def test_reject_self_reference_and_cycles(
+        self,
+        tmp_path,
+    ) -> None:
+        model, optimizer, scheduler = build_training_state()
+        paths = [tmp_path / f'step_{step}.safetensors' for step in range(3)]
+        save_checkpoint(paths[0], model, optimizer, checkpoint_format='delta')
+        train_one_step(model, optimizer, scheduler)
+        save_checkpoint(paths[1], model, optimizer, checkpoint_format='delta', delta_base=paths[0])
+        base_bytes = paths[1].read_bytes()
+        # 覆盖 base 自身或 base 链上的文件。
+        for path_to_save in (paths[1], paths[0], tmp_path / '.' / 'step_0.safetensors'):
+            with pytest.raises(ValueError):
+                save_checkpoint(path_to_save, model, optimizer, checkpoint_format='delta', delta_base=paths[1])
+        assert paths[1].read_bytes() == base_bytes
+        (tmp_path / 'link.safetensors').symlink_to(paths[1])
+        with pytest.raises(ValueError):
+            save_checkpoint(tmp_path / 'link.safetensors', model, optimizer, checkpoint_format='delta',
+                            delta_base=paths[1])
+        save_checkpoint(paths[2], model, optimizer, checkpoint_format='delta', delta_base=paths[1])
+        assert read_checkpoint(paths[2], keys=['model'])['model'].keys() == model.state_dict().keys()
+
+        # 已经存在的循环(例如手动修改的文件)，读取时抛出 ValueError 而不是无限循环。
+        tensors = {'model/weight': torch.zeros(2)}
+        skeleton = json.dumps({'model': {'weight': {'__tensor__': 'model/weight'}}})
+        save_file(tensors, tmp_path / 'a.safetensors', metadata={'skeleton': skeleton, 'delta_base': 'b.safetensors'})
+        save_file(tensors, tmp_path / 'b.safetensors', metadata={'skeleton': skeleton, 'delta_base': 'a.safetensors'})
+        with pytest.raises(ValueError):
+            read_checkpoint(tmp_path / 'a.safetensors')
+        with pytest.raises(ValueError):
+            write_delta_checkpoint({'model': model.state_dict()}, tmp_path / 'c.safetensors',
+                                   delta_base=tmp_path / 'a.safetensors')
+
+
+class TestDetectCheckpointFormat:
+    def test_format_is_detected_from_content(
+        self,
+        tmp_path,
+    ) -> None:
+        model, optimizer, scheduler = build_training_state()
+        # 常用的 .pt 文件名保存 safetensors 和 delta 格式。
+        save_checkpoint(tmp_path / 'full.pt', model, optimizer, checkpoint_format='safetensors')
+        save_checkpoint(tmp_path / 'step_0.pt', model, optimizer, checkpoint_format='delta')
+        train_one_step(model, optimizer, scheduler)
+        save_checkpoint(tmp_path / 'step_1.pt', model, optimizer, checkpoint_format='delta',
+                        delta_base=tmp_path / 'step_0.pt')
+        save_checkpoint(tmp_path / 'torch.ckpt', model, optimizer, checkpoint_format='torch')
+        torch.save({'model': model.state_dict()}, tmp_path / 'legacy.pt', _use_new_zipfile_serialization=False)
+        write_sharded_checkpoint({'model': model.state_dict()}, tmp_path / 'sharded')
+        assert [
+            detect_checkpoint_format(tmp_path / name)
+            for name in ('full.pt', 'step_0.pt', 'step_1.pt', 'torch.ckpt', 'legacy.pt', 'sharded')
+        ] == ['safetensors', 'safetensors', 'safetensors', 'torch', 'torch', 'sharded']
+        for name in ('step_1.pt', 'torch.ckpt'):
+            new_model, new_optimizer, _ = build_training_state()
+            load_checkpoint(tmp_path / name, new_model, new_optimizer)
+            for key, value in model.state_dict().items():
+                assert torch.equal(new_model.state_dict()[key], value)
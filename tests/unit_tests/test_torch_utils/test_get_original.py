@@ -0,0 +1,89 @@
+"""
+对序列长度和 padded/packed 转换的测试。
+"""
+
+from __future__ import annotations
+
+from _old_or_discarded._torch_utils.get_original import (
+    LengthBucketSampler,
+    get_batch_sequence_lengths,
+    get_padding_ratio,
+    packed_to_padded,
+    padded_to_packed,
+)
+import pytest
+import torch
+
+# if TYPE_CHECKING:
+
+
+def build_padded_batch(lengths: list[int], hidden_size: int = 3) -> torch.Tensor:
+    sequences = torch.zeros(len(lengths), max(lengths), hidden_size)
+    for row, length in enumerate(lengths):
+        sequences[row, :length] = torch.randn(length, hidden_size) + 10
+    return sequences
+
+
+class TestSequenceLengths:
+    def test_lengths_from_padding_value_and_mask(
+        self,
+    ) -> None:
+        sequences = build_padded_batch([5, 2, 3, 1])
+        lengths = get_batch_sequence_lengths(sequences)
+        assert lengths.tolist() == [5, 2, 3, 1]
+        mask = torch.arange(5).unsqueeze(0) < lengths.unsqueeze(1)
+        assert torch.equal(get_batch_sequence_lengths(sequence_mask=mask), lengths)
+        assert torch.equal(get_batch_sequence_lengths(sequence_mask=mask.T, batch_first=False), lengths)
+        token_ids = torch.tensor([[3, 4, -1], [5, -1, -1]])
+        assert get_batch_sequence_lengths(token_ids, padding_value=-1).tolist() == [2, 1]
+
+    def test_packed_round_trip(
+        self,
+    ) -> None:
+        sequences = build_padded_batch([5, 2, 3, 1])
+        lengths = get_batch_sequence_lengths(sequences)
+        packed, cu_seqlens, max_seqlen = padded_to_packed(sequences, lengths)
+        assert packed.shape == (11, 3)
+        assert cu_seqlens.tolist() == [0, 5, 7, 10, 11] and cu_seqlens.dtype == torch.int32
+        assert max_seqlen == 5
+        assert torch.equal(packed[5:7], sequences[1, :2])
+        assert torch.equal(packed_to_padded(packed, cu_seqlens), sequences)
+        # 时间维在前。
+        packed_t, _, _ = padded_to_packed(sequences.transpose(0, 1), lengths, batch_first=False)
+        assert torch.equal(packed_t, packed)
+        padded_t = packed_to_padded(packed, cu_seqlens, max_seqlen=6, padding_value=-1., batch_first=False)
+        assert padded_t.shape == (6, 4, 3) and bool((padded_t[5] == -1).all())
+
+
+class TestLengthBucketSampler:
+    def test_batches_cover_dataset_and_reduce_padding(
+        self,
+    ) -> None:
+        lengths = torch.randint(1, 512, (1000,), generator=torch.Generator().manual_seed(0))
+        sampler = LengthBucketSampler(lengths, batch_size=16, num_batches_per_bucket=8, seed=1)
+        batches = list(sampler)
+        assert len(batches) == len(sampler) == 63
+        assert sorted(index for batch in batches for index in batch) == list(range(1000))
+        random_batches = torch.split(torch.randperm(1000, generator=torch.Generator().manual_seed(0)), 16)
+        assert get_padding_ratio(lengths, batches) < get_padding_ratio(lengths, random_batches) / 2
+        # 相同 epoch 的顺序相同，不同 epoch 的顺序不同。
+        assert list(sampler) == batches
+        sampler.set_epoch(1)
+        assert list(sampler) != batches
+
+    def test_drop_last_and_no_shuffle(
+        self,
+    ) -> None:
+        lengths = [5, 1, 4, 2, 3]
+        sampler = LengthBucketSampler(lengths, batch_size=2, shuffle=False, drop_last=True)
+        assert list(sampler) == [[1, 3], [4, 2]]
+        assert len(sampler) == 2
+
+    @pytest.mark.parametrize('shuffle', [True, False])
+    def test_empty_lengths(
+        self,
+        shuffle: bool,
+    ) -> None:
+        sampler = LengthBucketSampler([], batch_size=4, shuffle=shuffle)
+        assert sampler.get_batches() == []
+        assert list(sampler) == [] and len(sampler) == 0
@@ -0,0 +1,129 @@
+"""
+对 batch 移动和预取的测试。只使用 CPU 。
+"""
+
+from __future__ import annotations
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass, field
+import threading
+
+from _old_or_discarded._torch_utils.move_dict_to_device import BatchPrefetcher, move_batch_to_device
+import pytest
+import torch
+
+# if TYPE_CHECKING:
+
+Pair = namedtuple('Pair', ['left', 'right'])
+
+
+@dataclass
+class Sample:
+    pixel_values: torch.Tensor
+    label: int
+    extra: list = field(default_factory=list)
+    mask: torch.Tensor = field(init=False)
+    num_post_init: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        self.mask = torch.ones(self.pixel_values.shape, dtype=torch.float32)
+        self.num_post_init += 1
+
+
+@dataclass(frozen=True)
+class FrozenSample:
+    pixel_values: torch.Tensor
+
+
+class TestMoveBatchToDevice:
+    def test_nested_structure(
+        self,
+    ) -> None:
+        batch = {
+            'input_ids': torch.arange(6).reshape(2, 3),
+            'pair': Pair(torch.ones(2), 'text'),
+            'samples': [Sample(torch.zeros(3), label=1), (torch.ones(1, dtype=torch.float64), None)],
+            'ordered': OrderedDict(mask=torch.ones(2, dtype=torch.bool)),
+            'frozen': FrozenSample(torch.zeros(2)),
+        }
+        moved = move_batch_to_device(batch, 'cpu', dtype=torch.bfloat16)
+        # 结构和非 tensor 保持不变。
+        assert isinstance(moved['pair'], Pair) and moved['pair'].right == 'text'
+        assert isinstance(moved['samples'][0], Sample) and moved['samples'][0].label == 1
+        assert isinstance(moved['samples'][1], tuple) and moved['samples'][1][1] is None
+        assert isinstance(moved['ordered'], OrderedDict)
+        # 只有浮点数 tensor 转换 dtype 。
+        assert moved['input_ids'].dtype == torch.int64
+        assert moved['ordered']['mask'].dtype == torch.bool
+        assert moved['pair'].left.dtype == torch.bfloat16
+        assert moved['samples'][0].pixel_values.dtype == torch.bfloat16
+        assert moved['samples'][1][0].dtype == torch.bfloat16
+        assert moved['frozen'].pixel_values.dtype == torch.bfloat16
+        # init=False 的 field 也会移动，__post_init__ 不会再次调用。
+        assert moved['samples'][0].mask.dtype == torch.bfloat16
+        assert moved['samples'][0].num_post_init == 1
+        assert batch['samples'][0].pixel_values.dtype == torch.float32
+        assert torch.equal(moved['input_ids'], batch['input_ids'])
+
+    def test_flat_dict_is_backward_compatible(
+        self,
+    ) -> None:
+        batch = {'x': torch.randn(2, 2), 'y': torch.tensor([1, 2])}
+        moved = move_batch_to_device(batch, torch.device('cpu'))
+        assert moved.keys() == batch.keys()
+        assert moved['x'].dtype == torch.float32
+        assert torch.equal(moved['x'], batch['x'])
+
+    def test_non_blocking_only_for_cuda_target(
+        self,
+        monkeypatch,
+    ) -> None:
+        non_blocking_values = []
+        original_to = torch.Tensor.to
+
+        def recording_to(tensor, *args, **kwargs):
+            non_blocking_values.append(kwargs.get('non_blocking'))
+            return original_to(tensor, *args, **kwargs)
+
+        monkeypatch.setattr(torch.Tensor, 'to', recording_to)
+        # 目标为 CPU 时同步复制，即使 non_blocking=True 。
+        move_batch_to_device({'x': torch.randn(2)}, 'cpu', non_blocking=True)
+        assert non_blocking_values == [False]
+
+
+class TestBatchPrefetcher:
+    def test_yields_batches_in_order(
+        self,
+    ) -> None:
+        batches = [{'x': torch.full((2,), float(index)), 'index': index} for index in range(10)]
+        with BatchPrefetcher(batches, device='cpu', num_prefetch=3, dtype=torch.float16) as prefetcher:
+            results = list(prefetcher)
+        assert [batch['index'] for batch in results] == list(range(10))
+        assert all(batch['x'].dtype == torch.float16 for batch in results)
+        # 可以再次迭代。
+        with BatchPrefetcher(batches, device='cpu') as prefetcher:
+            assert len(list(prefetcher)) == 10
+
+    def test_error_is_raised_in_consumer(
+        self,
+    ) -> None:
+        def data_loader():
+            yield torch.zeros(1)
+            raise RuntimeError('broken batch')
+
+        with BatchPrefetcher(data_loader(), device='cpu') as prefetcher:
+            iterator = iter(prefetcher)
+            next(iterator)
+            with pytest.raises(RuntimeError, match='broken batch'):
+                next(iterator)
+
+    def test_close_stops_worker_after_early_break(
+        self,
+    ) -> None:
+        def endless_data_loader():
+            while True:
+                yield torch.zeros(1)
+
+        with BatchPrefetcher(endless_data_loader(), device='cpu', num_prefetch=1) as prefetcher:
+            for _ in prefetcher:
+                break
+        assert not any(thread.name == 'batch-prefetcher' for thread in threading.enumerate())